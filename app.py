@@ -1,26 +1,44 @@
-from flask import Flask, render_template, jsonify, request, send_from_directory, session, redirect, url_for
+from flask import (
+    Flask, render_template, jsonify, request, send_from_directory, session, redirect, url_for,
+    Response, stream_with_context
+)
 from flask_cors import CORS
 import os.path
 import os
-import pandas as pd
+import json
 import traceback
 from datetime import datetime
-from collections import Counter
 import sys
 import io
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, confusion_matrix
+import time
 
 # Import cấu hình và tiện ích
-from config import MODEL_PATH, VECTORIZER_PATH, DATA_FILE, FLASK_CONFIG
-from utils import logger, login_required, handle_error, get_service_safely
+from config import (
+    MODEL_PATH, VECTORIZER_PATH, PIPELINE_PATH, COMPACT_MODEL_PATH, DATA_FILE, FLASK_CONFIG,
+    MAX_BATCH_SIZE, MAX_BULK_EMAILS, LEARNING_MODE, MODEL_FORMAT, TRAINING_STATE_DIR, EMAIL_STREAM_CHUNK_SIZE,
+    EMAIL_LIST_MODE
+)
+from utils import logger, login_required, handle_error, get_service_safely, process_memory_mb
 
 # Import các module xử lý
-from naive_bayes import train_model, classify_email, preprocess_text, load_stopwords
+from naive_bayes import (
+    train_model, classify_email, classify_emails, explain_email, preprocess_text,
+    warmup_preprocessing, get_model_version,
+    update_model_incremental, save_pipeline, load_pipeline, validate_pipeline, TrainingCancelled,
+    pipeline_lock, pipeline_stamp,
+    get_evaluation
+)
+from compact_model import export_compact_model, load_compact_model
+from model_registry import ModelRegistry
+from dataset_store import get_dataset_store
+from training_jobs import TrainingJobRunner
+from auto_triage import AutoTriageWorker
+from classification_cache import CLASSIFICATION_CACHE, content_key
 from gmail_oauth import (
     get_authorization_url, get_credentials_from_code, get_gmail_service,
-    get_emails, move_to_spam, move_to_inbox, send_email, mark_as_read,
-    delete_email, get_mailbox_stats
+    get_emails, iter_emails, get_email_body, move_to_spam, move_to_inbox, send_email, mark_as_read,
+    delete_email, get_mailbox_stats, list_mailboxes, invalidate_gmail_service,
+    modify_messages, trash_messages, get_feedback_contents
 )
 
 # Thiết lập hỗ trợ UTF-8 cho stdout và stderr nếu cần thiết
@@ -37,26 +55,199 @@ CORS(app, supports_credentials=True)
 for key, value in FLASK_CONFIG.items():
     app.config[key] = value
 
-# Biến toàn cục cho model và vectorizer
-MODEL, VECTORIZER = None, None
+def _compact_model_current():
+    """Mô hình gọn đã tồn tại và không cũ hơn pipeline hay chưa."""
+    if not os.path.exists(COMPACT_MODEL_PATH):
+        return False
+    return not os.path.exists(PIPELINE_PATH) or os.path.getmtime(COMPACT_MODEL_PATH) >= os.path.getmtime(PIPELINE_PATH)
+
+def load_serving_model(csv_file=DATA_FILE):
+    """Nạp mô hình phục vụ theo MODEL_FORMAT.
+
+    Ở chế độ 'compact', mô hình gọn được nạp thẳng bằng mmap (không cần
+    unpickle pipeline); nếu file chưa có hoặc cũ hơn pipeline thì được xuất lại.
+
+    Returns:
+        tuple - (model, vectorizer)
+    """
+    if MODEL_FORMAT == 'compact':
+        if not _compact_model_current():
+            export_compact_model(*train_model(csv_file), path=COMPACT_MODEL_PATH)
+        return load_compact_model(COMPACT_MODEL_PATH)
+    return train_model(csv_file)
+
+def _load_initial_model():
+    model, vectorizer = load_serving_model()
+    # Nạp tokenizer một lần thay vì ở mỗi email
+    warmup_preprocessing()
+    return model, vectorizer
+
+# Mô hình đang phục vụ: ảnh chụp bất biến (model, vectorizer, phiên bản) thay thế nguyên tử
+MODEL_REGISTRY = ModelRegistry(_load_initial_model, get_model_version)
+
+def initialize_model():
+    """Lấy ảnh chụp mô hình đang phục vụ (nạp lần đầu nếu cần).
+
+    Mỗi request nên gọi hàm này một lần và dùng ảnh chụp trả về cho đến hết
+    request để mô hình, vectorizer và phiên bản luôn nhất quán.
+
+    Returns:
+        ModelSnapshot - Giải nén được thành (model, vectorizer); có thêm thuộc tính version
+    """
+    try:
+        return MODEL_REGISTRY.current()
+    except Exception as e:
+        logger.error(f"Lỗi khởi tạo mô hình: {str(e)}")
+        raise
+
+def reload_serving_model():
+    """Nạp lại mô hình phục vụ từ file đã lưu (khi tiến trình khác đã cập nhật mô hình).
+
+    Returns:
+        ModelSnapshot - Ảnh chụp đang phục vụ sau khi nạp lại
+    """
+    return MODEL_REGISTRY.publish(*load_serving_model())
+
+def to_serving_model(model, vectorizer):
+    """Chuyển mô hình sklearn vừa huấn luyện/cập nhật sang dạng phục vụ theo MODEL_FORMAT.
+
+    Returns:
+        tuple - (model, vectorizer) dùng để phục vụ
+    """
+    if MODEL_FORMAT == 'compact':
+        export_compact_model(model, vectorizer, path=COMPACT_MODEL_PATH)
+        return load_compact_model(COMPACT_MODEL_PATH)
+    return model, vectorizer
+
+def run_retrain_job(job):
+    """Huấn luyện lại mô hình trong job nền rồi thay thế mô hình đang phục vụ.
 
-def initialize_model(csv_file=DATA_FILE):
-    """Khởi tạo model và vectorizer một lần duy nhất.
+    Pipeline mới được ghi ra file tạm, kiểm tra hợp lệ, đổi tên nguyên tử
+    thành PIPELINE_PATH rồi mới được đưa vào phục vụ. Mô hình cũ vẫn phục vụ
+    bình thường trong suốt quá trình huấn luyện.
 
     Args:
-        csv_file: str - Đường dẫn tới file dữ liệu huấn luyện
+        job: TrainingJob - Job đang chạy (dùng để báo tiến độ và kiểm tra hủy)
 
     Returns:
-        tuple - (model, vectorizer) đã khởi tạo
+        dict - Thông tin kết quả huấn luyện
     """
-    global MODEL, VECTORIZER
-    if MODEL is None or VECTORIZER is None:
-        try:
-            MODEL, VECTORIZER = train_model(csv_file)
-        except Exception as e:
-            logger.error(f"Lỗi khởi tạo mô hình: {str(e)}")
-            raise
-    return MODEL, VECTORIZER
+    tmp_path = f"{PIPELINE_PATH}.training-{job.id}"
+    try:
+        train_model(DATA_FILE, force=True, output_path=tmp_path,
+                    progress_callback=job.set_progress, cancel_event=job.cancel_event)
+
+        job.set_progress(0.97, 'validating')
+        model, vectorizer = validate_pipeline(tmp_path)
+        if job.cancel_event.is_set():
+            raise TrainingCancelled("Đã hủy huấn luyện trước khi thay thế mô hình")
+
+        def install(current):
+            # Đổi file và mô hình phục vụ trong cùng một lần cập nhật
+            os.replace(tmp_path, PIPELINE_PATH)
+            return to_serving_model(model, vectorizer)
+
+        with pipeline_lock():
+            snapshot = MODEL_REGISTRY.update(install)
+        logger.info(f"Đã lưu pipeline mới tại: {PIPELINE_PATH}")
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    # Xóa các file cũ nếu tồn tại (để dọn dẹp)
+    for file_path in [MODEL_PATH, VECTORIZER_PATH]:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+            logger.info(f"Đã dọn dẹp file cũ: {file_path}")
+
+    images_dir = 'images'
+    model_perf_path = os.path.join(images_dir, 'model_performance.png')
+    confusion_matrix_path = os.path.join(images_dir, 'confusion_matrix.png')
+    images_created = os.path.exists(model_perf_path) and os.path.exists(confusion_matrix_path)
+    if not images_created:
+        logger.warning("Không thể tạo các biểu đồ hiệu suất mô hình và ma trận nhầm lẫn")
+
+    return {
+        'model_version': snapshot.version,
+        'pipeline_saved': True,
+        'images_saved': images_created,
+        'performance_image': '/images/model_performance.png' if images_created else None,
+        'confusion_matrix_image': '/images/confusion_matrix.png' if images_created else None
+    }
+
+TRAINING_JOBS = TrainingJobRunner(run_retrain_job, state_dir=TRAINING_STATE_DIR)
+AUTO_TRIAGE = AutoTriageWorker(MODEL_REGISTRY.current)
+
+# Trạng thái sẵn sàng của tiến trình (được cập nhật bởi warm_up_model)
+READINESS = {
+    'status': 'starting',  # starting | warming_up | ready | failed
+    'ready': False,
+    'model_version': None,
+    'load_seconds': None,
+    'warmup_seconds': None,
+    'error': None
+}
+_PROCESS_STARTED_AT = time.time()
+
+def warm_up_model():
+    """Nạp (hoặc huấn luyện) mô hình và chạy thử một email trước khi nhận request.
+
+    Email mẫu đi qua đủ các bước tiền xử lý, vector hóa, dự đoán và phân
+    tích từ khóa nên mọi khởi tạo lười (tokenizer, danh sách đặc trưng...)
+    được thực hiện trước, không rơi vào request đầu tiên của người dùng.
+
+    Returns:
+        dict - Trạng thái sẵn sàng (giống READINESS)
+    """
+    READINESS.update(status='warming_up', ready=False, error=None)
+    try:
+        start = time.perf_counter()
+        snapshot = initialize_model()
+        model, vectorizer = snapshot
+        loaded = time.perf_counter()
+
+        classify_emails(
+            model, vectorizer,
+            ['Xin chào, đây là email kiểm tra khởi động hệ thống. Truy cập http://example.com để biết thêm.'],
+            ['Kiểm tra khởi động'],
+            explain=True
+        )
+        done = time.perf_counter()
+
+        READINESS.update(
+            status='ready', ready=True,
+            model_version=snapshot.version,
+            load_seconds=round(loaded - start, 3),
+            warmup_seconds=round(done - loaded, 3)
+        )
+        logger.info(
+            f"Mô hình sẵn sàng: nạp {READINESS['load_seconds']}s, warm-up {READINESS['warmup_seconds']}s"
+        )
+    except Exception as e:
+        READINESS.update(status='failed', ready=False, error=str(e))
+        logger.error(f"Warm-up mô hình thất bại: {str(e)}")
+    return dict(READINESS)
+
+def _readiness_payload():
+    payload = dict(READINESS)
+    if MODEL_REGISTRY.loaded:
+        # Phiên bản có thể đổi sau khi huấn luyện lại hoặc học từ phản hồi
+        payload['model_version'] = MODEL_REGISTRY.version
+    payload['uptime_seconds'] = round(time.time() - _PROCESS_STARTED_AT, 1)
+    payload['pid'] = os.getpid()
+    payload['memory_mb'] = process_memory_mb()
+    return payload
+
+@app.route('/healthz')
+def healthz():
+    """Kiểm tra tiến trình còn sống (luôn trả về 200 kèm trạng thái warm-up)."""
+    return jsonify(_readiness_payload())
+
+@app.route('/readyz')
+def readyz():
+    """Kiểm tra sẵn sàng nhận traffic: 200 khi mô hình đã warm-up, 503 nếu chưa."""
+    payload = _readiness_payload()
+    return jsonify(payload), (200 if payload['ready'] else 503)
 
 # Route đăng nhập với Google OAuth
 @app.route('/login')
@@ -155,6 +346,7 @@ def logout():
     """API đăng xuất người dùng."""
     try:
         # Xóa thông tin người dùng và credentials khỏi session
+        invalidate_gmail_service()
         session.pop('user', None)
         session.pop('credentials', None)
         session.pop('state', None)
@@ -185,6 +377,64 @@ def check_auth():
         error_info = handle_error(e, "Lỗi kiểm tra đăng nhập")
         return jsonify({'authenticated': False, 'error': error_info['error']})
 
+def parse_email_filters(args):
+    """Đọc bộ lọc kết quả phân loại từ query string.
+
+    Tham số: classification (spam/ham), min_confidence (>=), max_confidence (<),
+    ví dụ ?classification=spam&max_confidence=70.
+
+    Returns:
+        dict|None - Bộ lọc hoặc None nếu không có
+    """
+    filters = {
+        'classification': args.get('classification') if args.get('classification') in ('spam', 'ham') else None,
+        'min_confidence': args.get('min_confidence', type=float),
+        'max_confidence': args.get('max_confidence', type=float)
+    }
+    return filters if any(value is not None for value in filters.values()) else None
+
+def stream_emails_response(service, max_results, search_query, page_token, label_ids, metadata_only=False,
+                           filters=None):
+    """Trả một trang email dạng NDJSON, mỗi email một dòng ngay khi được phân loại xong.
+
+    Các dòng có dạng {"type": "email", "email": {...}}, dòng cuối là
+    {"type": "end", "nextPageToken": ..., "count": ...}. Lỗi xảy ra sau khi
+    đã bắt đầu gửi được báo bằng dòng {"type": "error", "error": ...}.
+
+    Returns:
+        Response - Phản hồi stream, hoặc phản hồi lỗi 500 nếu không lấy được lượt đầu tiên
+    """
+    records = iter_emails(service, max_results, search_query, page_token, label_ids,
+                          chunk_size=EMAIL_STREAM_CHUNK_SIZE, metadata_only=metadata_only, filters=filters)
+    # Lấy trước bản ghi đầu tiên để lỗi khi liệt kê email vẫn trả về mã lỗi HTTP
+    try:
+        first = next(records)
+    except Exception as e:
+        error_info = handle_error(e, "Lỗi khi lấy emails")
+        return jsonify(error_info), 500
+
+    def encode(kind, payload):
+        if kind == 'email':
+            record = {'type': 'email', 'email': payload}
+        else:
+            record = {'type': kind, **payload}
+        return json.dumps(record, ensure_ascii=False) + '\n'
+
+    def generate():
+        yield encode(*first)
+        try:
+            for kind, payload in records:
+                yield encode(kind, payload)
+        except Exception as e:
+            logger.error(f"Lỗi khi stream danh sách email: {str(e)}")
+            yield encode('error', {'error': str(e)})
+
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    # Không để proxy (nginx) gom phản hồi lại rồi mới gửi
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 @app.route('/emails')
 @login_required
 def get_emails_route():
@@ -193,14 +443,22 @@ def get_emails_route():
         max_results = request.args.get('max', 20, type=int)
         search_query = request.args.get('q', '')
         page_token = request.args.get('pageToken', None)
+        # 'metadata': chỉ lấy header + snippet, nội dung lấy qua /emails/<id> khi mở
+        metadata_only = request.args.get('mode', EMAIL_LIST_MODE) == 'metadata'
+        filters = parse_email_filters(request.args)
 
         # Lấy Gmail service an toàn
         service = get_service_safely()
         if not service:
             return jsonify({'error': 'Lỗi xác thực, vui lòng đăng nhập lại'}), 401
 
+        if request.args.get('stream') == '1':
+            return stream_emails_response(service, max_results, search_query, page_token, ['INBOX'],
+                                          metadata_only=metadata_only, filters=filters)
+
         # Lấy email từ INBOX
-        result = get_emails(service, max_results, search_query, page_token, label_ids=['INBOX'])
+        result = get_emails(service, max_results, search_query, page_token, label_ids=['INBOX'],
+                            metadata_only=metadata_only, filters=filters)
 
         # Kiểm tra lỗi từ kết quả
         if 'error' in result:
@@ -215,6 +473,24 @@ def get_emails_route():
         error_info = handle_error(e, "Lỗi khi lấy emails")
         return jsonify(error_info), 500
 
+@app.route('/emails/<email_id>')
+@login_required
+def get_email_body_route(email_id):
+    """API lấy nội dung đầy đủ và kết quả phân loại chính thức của một email."""
+    try:
+        # Lấy Gmail service an toàn
+        service = get_service_safely()
+        if not service:
+            return jsonify({'error': 'Lỗi xác thực, vui lòng đăng nhập lại'}), 401
+
+        result = get_email_body(service, email_id)
+        if 'error' in result:
+            return jsonify({'error': result['error']}), 500
+        return jsonify(result)
+    except Exception as e:
+        error_info = handle_error(e, "Lỗi khi lấy nội dung email")
+        return jsonify(error_info), 500
+
 @app.route('/mark_spam', methods=['POST'])
 @login_required
 def mark_spam():
@@ -243,7 +519,6 @@ def mark_spam():
             content = data.get('content', '')
 
             if content:
-                MODEL, VECTORIZER = initialize_model()
                 add_to_dataset_internal('spam', content, subject)
                 logger.info(f"Đã thêm email vào dataset spam: {subject}")
         except Exception as e:
@@ -283,7 +558,6 @@ def mark_not_spam():
             content = data.get('content', '')
 
             if content:
-                MODEL, VECTORIZER = initialize_model()
                 add_to_dataset_internal('ham', content, subject)
                 logger.info(f"Đã thêm email vào dataset ham: {subject}")
         except Exception as e:
@@ -307,9 +581,8 @@ def list_mailboxes_route():
         if not service:
             return jsonify({'error': 'Lỗi xác thực, vui lòng đăng nhập lại'}), 401
 
-        # Lấy danh sách thư mục
-        labels = service.users().labels().list(userId='me').execute().get('labels', [])
-        mailboxes = [label['name'] for label in labels]
+        # Lấy danh sách thư mục (từ bản sao hộp thư nếu được bật)
+        mailboxes = list_mailboxes(service)
         return jsonify({'mailboxes': mailboxes})
     except Exception as e:
         error_info = handle_error(e, "Lỗi khi liệt kê thư mục")
@@ -351,43 +624,23 @@ def get_stats():
                 else:
                     confidence_levels['low'] += 1
 
-        data = pd.read_csv('spam_data.csv')
-        training_size = len(data)
-        X = data['text'].apply(preprocess_text)
-        y = data['label']
-        _, X_test, _, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-        X_test_vec = vectorizer.transform(X_test)
-        y_pred = model.predict(X_test_vec)
-        accuracy = accuracy_score(y_test, y_pred)
-
-        # Tính các chỉ số hiệu suất
-        precision = precision_score(y_test, y_pred, pos_label='spam')
-        recall = recall_score(y_test, y_pred, pos_label='spam')
-        f1 = f1_score(y_test, y_pred, pos_label='spam')
-        conf_matrix = confusion_matrix(y_test, y_pred, labels=['ham', 'spam']).tolist()
+        # Chỉ số mô hình được tính một lần cho mỗi phiên bản mô hình
+        evaluation = get_evaluation(model, vectorizer, DATA_FILE)
+        accuracy = evaluation['accuracy']
+        precision = evaluation['precision']
+        recall = evaluation['recall']
+        f1 = evaluation['f1_score']
+        conf_matrix = evaluation['confusion_matrix']
 
-        # Đã loại bỏ chức năng biểu đồ xu hướng theo thời gian
+        # Thống kê tập dữ liệu được cập nhật dần theo kho dữ liệu, không quét lại toàn bộ
+        corpus_stats = get_dataset_store().get_stats(top_patterns=5, top_keywords=10)
+        training_size = corpus_stats['training_size']
 
-        # Phân tích các mẫu spam phổ biến dựa trên dữ liệu thực
-        spam_df = data[data['label'] == 'spam']
-
-        # Tìm các mẫu phổ biến trong tiêu đề và nội dung email spam
-        common_patterns = [
-            'khuyến mãi', 'trúng thưởng', 'thanh toán', 'tài khoản', 'cập nhật',
-            'miễn phí', 'giảm giá', 'quà tặng', 'khẩn cấp', 'xác nhận', 'hết hạn'
-        ]
-
-        # Đếm các mẫu spam phổ biến
-        pattern_counts = {}
-        for text in spam_df['text']:
-            text_lower = str(text).lower()
-            for pattern in common_patterns:
-                if pattern in text_lower:
-                    pattern_counts[pattern] = pattern_counts.get(pattern, 0) + 1
+        # Đã loại bỏ chức năng biểu đồ xu hướng theo thời gian
 
         # Chuyển đổi thành danh sách các mẫu và tần suất
         spam_patterns = []
-        for pattern, count in sorted(pattern_counts.items(), key=lambda x: x[1], reverse=True)[:5]:
+        for pattern, count in corpus_stats['spam_patterns']:
             # Chuyển đổi pattern thành dạng tiêu đề (viết hoa chữ cái đầu)
             formatted_pattern = ' '.join(word.capitalize() for word in pattern.split())
             spam_patterns.append({
@@ -409,26 +662,11 @@ def get_stats():
                 if len(spam_patterns) < 5 and not any(p['pattern'] == pattern['pattern'] for p in spam_patterns):
                     spam_patterns.append(pattern)
 
-        # Phân tích từ khóa phổ biến trong spam sử dụng stopwords.txt
-        import re
-
-        # Lấy danh sách stopwords từ file
-        stopwords = load_stopwords('stopwords.txt')
-
-        # Đếm các từ xuất hiện trong spam
-        words = []
-        for text in spam_df['text']:
-            words.extend(re.findall(r'\b\w+\b', str(text).lower()))
-
-        # Lọc bỏ stopwords từ file
-        filtered_words = [word for word in words if word not in stopwords and len(word) > 2]
+        # Từ khóa phổ biến trong spam (đã lọc stopwords khi cập nhật bộ đếm)
+        common_keywords = [{'word': word, 'count': count} for word, count in corpus_stats['common_keywords']]
 
-        # Lấy top từ khóa phổ biến
-        common_keywords = Counter(filtered_words).most_common(10)
-        common_keywords = [{'word': word, 'count': count} for word, count in common_keywords]
-
-        last_training = None
-        if os.path.exists(MODEL_PATH):
+        last_training = evaluation.get('timestamp')
+        if not last_training and os.path.exists(MODEL_PATH):
             timestamp = os.path.getmtime(MODEL_PATH)
             last_training = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
 
@@ -458,63 +696,42 @@ def get_stats():
 @app.route('/retrain', methods=['POST'])
 @login_required
 def retrain_model():
-    """API để huấn luyện lại mô hình."""
-    try:
-        # Import cần thiết
-        from config import PIPELINE_PATH
-
-        # Xóa file pipeline cũ để buộc huấn luyện lại
-        if os.path.exists(PIPELINE_PATH):
-            os.remove(PIPELINE_PATH)
-            logger.info(f"Đã xóa pipeline cũ: {PIPELINE_PATH}")
-
-        # Xóa các file cũ nếu tồn tại (để dọn dẹp)
-        old_files = [MODEL_PATH, VECTORIZER_PATH]
-        for file_path in old_files:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-                logger.info(f"Đã dọn dẹp file cũ: {file_path}")
-
-        # Đảm bảo thư mục images tồn tại
-        images_dir = 'images'
-        if not os.path.exists(images_dir):
-            os.makedirs(images_dir)
-
-        # Reset biến global để buộc huấn luyện lại
-        global MODEL, VECTORIZER
-        MODEL, VECTORIZER = None, None
-
-        # Huấn luyện lại mô hình
-        MODEL, VECTORIZER = train_model(DATA_FILE)
-        logger.info("Đã huấn luyện lại mô hình thành công")
-
-        # Kiểm tra xem các file đã được tạo chưa
-        pipeline_created = os.path.exists(PIPELINE_PATH)
-        model_perf_path = os.path.join(images_dir, 'model_performance.png')
-        confusion_matrix_path = os.path.join(images_dir, 'confusion_matrix.png')
-        images_created = os.path.exists(model_perf_path) and os.path.exists(confusion_matrix_path)
-
-        if pipeline_created:
-            logger.info(f"Đã lưu pipeline mới tại: {PIPELINE_PATH}")
-
-        if images_created:
-            logger.info(f"Đã lưu biểu đồ hiệu suất mô hình tại: {model_perf_path}")
-            logger.info(f"Đã lưu ma trận nhầm lẫn tại: {confusion_matrix_path}")
-        else:
-            logger.warning("Không thể tạo các biểu đồ hiệu suất mô hình và ma trận nhầm lẫn")
+    """API để huấn luyện lại mô hình (chạy nền).
 
+    Trả về ngay job huấn luyện; nếu đang có job chạy thì trả về job đó.
+    """
+    try:
+        job, created = TRAINING_JOBS.submit()
         return jsonify({
             'success': True,
-            'message': 'Đã huấn luyện lại mô hình thành công',
-            'pipeline_saved': pipeline_created,
-            'images_saved': images_created,
-            'performance_image': '/images/model_performance.png' if images_created else None,
-            'confusion_matrix_image': '/images/confusion_matrix.png' if images_created else None
-        })
+            'message': 'Đã bắt đầu huấn luyện lại mô hình' if created else 'Mô hình đang được huấn luyện',
+            'job': job.to_dict()
+        }), 202
     except Exception as e:
         error_info = handle_error(e, "Lỗi khi huấn luyện lại mô hình")
         return jsonify(error_info), 500
 
+@app.route('/retrain/status')
+@app.route('/retrain/<job_id>')
+@login_required
+def retrain_status(job_id=None):
+    """API lấy trạng thái và tiến độ của job huấn luyện."""
+    job = TRAINING_JOBS.get(job_id) if job_id else TRAINING_JOBS.current()
+    if job is None:
+        return jsonify({'error': 'Không tìm thấy job huấn luyện'}), 404
+    return jsonify({'job': job.to_dict()})
+
+@app.route('/retrain/<job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_retrain(job_id):
+    """API hủy job huấn luyện đang chạy."""
+    job = TRAINING_JOBS.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Không tìm thấy job huấn luyện'}), 404
+    if not TRAINING_JOBS.cancel(job_id):
+        return jsonify({'error': 'Job huấn luyện không còn chạy', 'job': job.to_dict()}), 409
+    return jsonify({'success': True, 'job': job.to_dict()})
+
 # API endpoints for spam and analyzer - no template rendering needed
 
 @app.route('/spam_emails')
@@ -525,13 +742,21 @@ def get_spam_emails_route():
         max_results = request.args.get('max', 20, type=int)
         search_query = request.args.get('q', '')
         page_token = request.args.get('pageToken', None)
+        # 'metadata': chỉ lấy header + snippet, nội dung lấy qua /emails/<id> khi mở
+        metadata_only = request.args.get('mode', EMAIL_LIST_MODE) == 'metadata'
+        filters = parse_email_filters(request.args)
 
         # Lấy Gmail service an toàn
         service = get_service_safely()
         if not service:
             return jsonify({'error': 'Lỗi xác thực, vui lòng đăng nhập lại'}), 401
 
-        result = get_emails(service, max_results, search_query, page_token, label_ids=['SPAM'])
+        if request.args.get('stream') == '1':
+            return stream_emails_response(service, max_results, search_query, page_token, ['SPAM'],
+                                          metadata_only=metadata_only, filters=filters)
+
+        result = get_emails(service, max_results, search_query, page_token, label_ids=['SPAM'],
+                            metadata_only=metadata_only, filters=filters)
         return jsonify({
             'emails': result['emails'],
             'nextPageToken': result['nextPageToken']
@@ -588,6 +813,145 @@ def delete_email_route():
         error_info = handle_error(e, "Lỗi khi xóa email")
         return jsonify(error_info), 500
 
+def run_bulk_action(action, error_message, feedback_label=None):
+    """Xử lý chung cho các API /bulk/*.
+
+    Body JSON: {"email_ids": [...]} hoặc {"emails": [{"id", "subject", "content"}, ...]}.
+    Với feedback_label, các email xử lý thành công được thêm vào tập huấn luyện
+    trong một lần ghi (nội dung lấy từ yêu cầu, nếu thiếu thì từ hộp thư).
+
+    Args:
+        action: callable - Hàm (service, list ID) -> dict ID -> kết quả
+        error_message: str - Thông báo khi lỗi
+        feedback_label: str - Nhãn cần thêm vào tập huấn luyện (spam/ham, tùy chọn)
+
+    Returns:
+        Response - Kết quả của từng email
+    """
+    try:
+        data = request.json or {}
+        emails = data.get('emails') or []
+        email_ids = data.get('email_ids') or [email.get('id') for email in emails if isinstance(email, dict)]
+
+        if not isinstance(email_ids, list) or not email_ids or not all(isinstance(i, str) and i for i in email_ids):
+            return jsonify({'error': 'Danh sách ID email không hợp lệ'}), 400
+        if len(email_ids) > MAX_BULK_EMAILS:
+            return jsonify({'error': f'Tối đa {MAX_BULK_EMAILS} email mỗi yêu cầu'}), 400
+
+        # Lấy Gmail service an toàn
+        service = get_service_safely()
+        if not service:
+            return jsonify({'error': 'Lỗi xác thực, vui lòng đăng nhập lại'}), 401
+
+        contents = {}
+        if feedback_label:
+            # Lấy nội dung trước khi đổi nhãn, ưu tiên nội dung gửi kèm yêu cầu
+            contents = {
+                email['id']: {'subject': email.get('subject', ''), 'content': email['content']}
+                for email in emails
+                if isinstance(email, dict) and email.get('id') and email.get('content')
+            }
+            contents.update(get_feedback_contents(service, [i for i in email_ids if i not in contents]))
+
+        results = action(service, email_ids)
+        succeeded = [email_id for email_id, result in results.items() if result['success']]
+
+        dataset = {}
+        if feedback_label and succeeded:
+            try:
+                entries = [
+                    (feedback_label, contents[email_id]['content'], contents[email_id]['subject'])
+                    for email_id in succeeded if email_id in contents
+                ]
+                for status in add_to_dataset_many(entries):
+                    dataset[status] = dataset.get(status, 0) + 1
+                logger.info(f"Đã thêm {len(entries)} email vào dataset {feedback_label}: {dataset}")
+            except Exception as e:
+                logger.warning(f"Lỗi khi thêm vào dataset: {str(e)}")
+                # Không trả về lỗi vì thao tác trên Gmail đã hoàn thành
+                dataset = {'error': str(e)}
+
+        return jsonify({
+            'success': len(succeeded) == len(results),
+            'succeeded': len(succeeded),
+            'failed': len(results) - len(succeeded),
+            'results': results,
+            'dataset': dataset
+        })
+    except Exception as e:
+        error_info = handle_error(e, error_message)
+        return jsonify(error_info), 500
+
+@app.route('/bulk/mark_spam', methods=['POST'])
+@login_required
+def bulk_mark_spam():
+    """API đánh dấu nhiều email là spam."""
+    return run_bulk_action(
+        lambda service, ids: modify_messages(service, ids, add_label_ids=['SPAM'], remove_label_ids=['INBOX']),
+        "Lỗi khi đánh dấu email là spam", feedback_label='spam'
+    )
+
+@app.route('/bulk/mark_not_spam', methods=['POST'])
+@login_required
+def bulk_mark_not_spam():
+    """API bỏ đánh dấu spam cho nhiều email."""
+    return run_bulk_action(
+        lambda service, ids: modify_messages(service, ids, add_label_ids=['INBOX'], remove_label_ids=['SPAM']),
+        "Lỗi khi bỏ đánh dấu email là spam", feedback_label='ham'
+    )
+
+@app.route('/bulk/mark_read', methods=['POST'])
+@login_required
+def bulk_mark_read():
+    """API đánh dấu nhiều email là đã đọc."""
+    return run_bulk_action(
+        lambda service, ids: modify_messages(service, ids, remove_label_ids=['UNREAD']),
+        "Lỗi khi đánh dấu email là đã đọc"
+    )
+
+@app.route('/bulk/delete', methods=['POST'])
+@login_required
+def bulk_delete():
+    """API chuyển nhiều email vào thùng rác."""
+    return run_bulk_action(trash_messages, "Lỗi khi xóa email")
+
+@app.route('/auto_triage', methods=['GET'])
+@login_required
+def auto_triage_status():
+    """API lấy trạng thái tự động phân loại email mới của tài khoản hiện tại."""
+    try:
+        return jsonify(AUTO_TRIAGE.status(session['user']['email']))
+    except Exception as e:
+        error_info = handle_error(e, "Lỗi khi lấy trạng thái tự động phân loại")
+        return jsonify(error_info), 500
+
+@app.route('/auto_triage', methods=['POST'])
+@login_required
+def update_auto_triage():
+    """API bật/tắt tự động phân loại email mới. Body JSON: {"enabled": bool}."""
+    try:
+        data = request.json or {}
+        account = session['user']['email']
+        if not data.get('enabled'):
+            AUTO_TRIAGE.disable(account)
+            return jsonify(AUTO_TRIAGE.status(account))
+
+        if not AUTO_TRIAGE.available:
+            return jsonify({'error': 'Tự động phân loại chưa được bật trên server'}), 400
+
+        # Làm mới token (nếu cần) trước khi lưu credentials cho luồng nền
+        service = get_service_safely()
+        if not service:
+            return jsonify({'error': 'Lỗi xác thực, vui lòng đăng nhập lại'}), 401
+        try:
+            AUTO_TRIAGE.enable(account, session['credentials'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify(AUTO_TRIAGE.status(account))
+    except Exception as e:
+        error_info = handle_error(e, "Lỗi khi cập nhật tự động phân loại")
+        return jsonify(error_info), 500
+
 @app.route('/analyze_text', methods=['POST'])
 @login_required
 def analyze_text():
@@ -600,8 +964,13 @@ def analyze_text():
         if not content:
             return jsonify({'error': 'Nội dung email không được để trống'}), 400
 
-        model, vectorizer = initialize_model()
-        result = classify_email(model, vectorizer, content, subject)
+        snapshot = initialize_model()
+        model, vectorizer, version = snapshot.model, snapshot.vectorizer, snapshot.version
+        cache_key = content_key(content, subject)
+        result = CLASSIFICATION_CACHE.get(cache_key, version)
+        if result is None:
+            result = classify_email(model, vectorizer, content, subject)
+            CLASSIFICATION_CACHE.put(cache_key, result, version)
 
         return jsonify({
             'classification': result['classification'],
@@ -613,6 +982,80 @@ def analyze_text():
         error_info = handle_error(e, "Lỗi khi phân tích nội dung email")
         return jsonify(error_info), 500
 
+@app.route('/explain', methods=['POST'])
+@login_required
+def explain_route():
+    """API giải thích kết quả phân loại (từ khóa ảnh hưởng) theo yêu cầu."""
+    try:
+        data = request.json
+        subject = data.get('subject', '')
+        content = data.get('content', '')
+        top_k = max(1, min(request.args.get('top_k', 20, type=int), 100))
+
+        if not content:
+            return jsonify({'error': 'Nội dung email không được để trống'}), 400
+
+        model, vectorizer = initialize_model()
+        return jsonify(explain_email(model, vectorizer, content, subject, top_k=top_k))
+    except Exception as e:
+        error_info = handle_error(e, "Lỗi khi giải thích kết quả phân loại")
+        return jsonify(error_info), 500
+
+@app.route('/analyze_batch', methods=['POST'])
+@login_required
+def analyze_batch():
+    """API để phân tích nhiều email trong một lần gọi.
+
+    Nhận một mảng JSON các đối tượng {subject, content}; kết quả trả về
+    theo đúng thứ tự đầu vào.
+    """
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, list) or not data:
+            return jsonify({'error': 'Dữ liệu phải là một mảng email không rỗng'}), 400
+        if len(data) > MAX_BATCH_SIZE:
+            return jsonify({'error': f'Tối đa {MAX_BATCH_SIZE} email mỗi lần phân tích'}), 400
+
+        results = [None] * len(data)
+        indices, contents, subjects = [], [], []
+        for i, item in enumerate(data):
+            content = item.get('content', '') if isinstance(item, dict) else ''
+            if not content or not isinstance(content, str):
+                results[i] = {'error': 'Nội dung email không được để trống'}
+                continue
+            indices.append(i)
+            contents.append(content)
+            subjects.append(item.get('subject', '') or '')
+
+        if contents:
+            snapshot = initialize_model()
+            model, vectorizer, version = snapshot.model, snapshot.vectorizer, snapshot.version
+            keys = [content_key(content, subject) for content, subject in zip(contents, subjects)]
+            cached = CLASSIFICATION_CACHE.get_many(keys, version)
+
+            # Chỉ chạy mô hình cho các email chưa có trong bộ nhớ đệm
+            pending = [j for j, key in enumerate(keys) if key not in cached]
+            if pending:
+                new_results = classify_emails(model, vectorizer,
+                                              [contents[j] for j in pending], [subjects[j] for j in pending])
+                fresh = {keys[j]: result for j, result in zip(pending, new_results)}
+                CLASSIFICATION_CACHE.put_many(fresh, version)
+                cached.update(fresh)
+
+            for i, key in zip(indices, keys):
+                result = cached[key]
+                results[i] = {
+                    'classification': result['classification'],
+                    'confidence': result['confidence'],
+                    'top_keywords': result.get('top_keywords', []),
+                    'email_stats': result.get('email_stats', {})
+                }
+
+        return jsonify({'results': results})
+    except Exception as e:
+        error_info = handle_error(e, "Lỗi khi phân tích lô email")
+        return jsonify(error_info), 500
+
 @app.route('/send_email', methods=['POST'])
 @login_required
 def send_email_route():
@@ -637,8 +1080,100 @@ def send_email_route():
         error_info = handle_error(e, "Lỗi khi gửi email")
         return jsonify(error_info), 500
 
+def learn_from_feedback(label, full_text, old_label=None):
+    """Cập nhật mô hình sau khi người dùng gán nhãn một email.
+
+    Ở chế độ 'incremental', email được cộng trực tiếp vào bộ đếm của mô hình
+    đang phục vụ và pipeline được lưu lại mà không cần huấn luyện lại.
+    Ở chế độ 'full', một job huấn luyện lại toàn bộ (giống /retrain) được tạo
+    để chạy nền.
+
+    Args:
+        label: str - Nhãn mới (spam/ham)
+        full_text: str - Nội dung đầy đủ (tiêu đề + nội dung)
+        old_label: str - Nhãn cũ nếu là đổi nhãn (tùy chọn)
+    """
+    learn_from_feedback_many([(label, full_text, old_label)])
+
+# Dấu của file pipeline do tiến trình này ghi lần gần nhất (xem learn_from_feedback_many)
+_SAVED_PIPELINE_STAMP = None
+
+def learn_from_feedback_many(items):
+    """Cập nhật mô hình với nhiều email được gán nhãn trong một lần.
+
+    Cả lô chỉ tạo một lần cập nhật tăng dần (hoặc một job huấn luyện lại
+    chạy nền ở chế độ 'full') thay vì một lần cho mỗi email.
+
+    Args:
+        items: list - Các bộ (nhãn mới, nội dung đầy đủ, nhãn cũ hoặc None)
+    """
+    if not items:
+        return
+    if LEARNING_MODE != 'incremental':
+        # Huấn luyện lại toàn bộ ở job nền thay vì chặn request
+        job, created = TRAINING_JOBS.submit()
+        if created:
+            logger.info(f"Đã tạo job huấn luyện lại {job.id} sau phản hồi của người dùng ({len(items)} email)")
+        else:
+            logger.info(
+                f"Job huấn luyện {job.id} đang chạy; {len(items)} email phản hồi sẽ được học ở lần huấn luyện sau"
+            )
+        return
+
+    labels = [item[0] for item in items]
+    texts = [item[1] for item in items]
+    old_labels = [item[2] for item in items]
+
+    def apply_feedback(current):
+        global _SAVED_PIPELINE_STAMP
+        if MODEL_FORMAT != 'compact' and pipeline_stamp() == _SAVED_PIPELINE_STAMP:
+            # File pipeline vẫn là bản tiến trình này vừa ghi: cập nhật trên ảnh chụp hiện tại
+            model, vectorizer = current.model, current.vectorizer
+        else:
+            # Tiến trình khác đã ghi pipeline mới hơn (hoặc mô hình gọn chỉ đọc):
+            # cập nhật trên pipeline mới nhất trên đĩa để không làm mất phản hồi của tiến trình đó
+            model, vectorizer = load_pipeline(PIPELINE_PATH)
+        # update_model_incremental trả về bản sao nên ảnh chụp cũ không bị sửa
+        new_model = update_model_incremental(model, vectorizer, texts, labels, old_labels)
+        save_pipeline(new_model, vectorizer)
+        _SAVED_PIPELINE_STAMP = pipeline_stamp()
+        return to_serving_model(new_model, vectorizer)
+
+    with pipeline_lock():
+        MODEL_REGISTRY.update(apply_feedback)
+    logger.info(f"Đã cập nhật mô hình tăng dần với {len(items)} email")
+
+def add_to_dataset_many(entries):
+    """Thêm nhiều email vào tập huấn luyện trong một lần ghi và một lần cập nhật mô hình.
+
+    Args:
+        entries: list - Các bộ (nhãn, nội dung, tiêu đề)
+
+    Returns:
+        list - Trạng thái của từng email: 'added', 'relabeled' hoặc 'exists'
+    """
+    items = [(label, f"{subject}\n{content}" if subject else content) for label, content, subject in entries]
+    stored = get_dataset_store().add_many(items)
+
+    # Gộp theo nội dung: mỗi văn bản chỉ được cập nhật vào mô hình một lần,
+    # từ nhãn trước lô sang nhãn cuối cùng trong lô
+    changes = {}
+    for (label, full_text), result in zip(items, stored):
+        if result['status'] == 'exists':
+            continue
+        if full_text in changes:
+            changes[full_text][1] = label
+        else:
+            changes[full_text] = [result['old_label'], label]
+    learn_from_feedback_many([
+        (new_label, full_text, old_label)
+        for full_text, (old_label, new_label) in changes.items()
+        if new_label != old_label
+    ])
+    return [result['status'] for result in stored]
+
 def add_to_dataset_internal(label, content, subject=''):
-    """Thêm dữ liệu vào tập huấn luyện và huấn luyện lại mô hình nếu cần.
+    """Thêm dữ liệu vào tập huấn luyện và cập nhật mô hình.
 
     Args:
         label: str - Nhãn của dữ liệu (spam/ham)
@@ -648,58 +1183,42 @@ def add_to_dataset_internal(label, content, subject=''):
     Returns:
         dict - Kết quả thực hiện
     """
-    # Khai báo biến global ở đầu hàm
-    global MODEL, VECTORIZER
-
     try:
         # Tạo nội dung đầy đủ
         full_text = f"{subject}\n{content}" if subject else content
 
-        # Đọc file dữ liệu
-        df = pd.read_csv(DATA_FILE)
+        # Thêm/đổi nhãn trong kho dữ liệu (kiểm tra trùng lặp bằng chỉ mục mã băm)
+        stored = get_dataset_store().add(label, full_text)
 
-        # Kiểm tra xem dữ liệu đã tồn tại chưa
-        existing_index = df[df['text'] == full_text].index
+        if stored['status'] == 'exists':
+            # Nếu nhãn giống nhau, không cho phép thêm
+            return {
+                'success': False,
+                'message': f'Dữ liệu đã tồn tại với nhãn {label}',
+                'existing_label': stored['old_label']
+            }
 
-        if len(existing_index) > 0:
-            # Dữ liệu đã tồn tại, kiểm tra nhãn
-            existing_label = df.loc[existing_index[0], 'label']
+        if stored['status'] == 'relabeled':
+            existing_label = stored['old_label']
 
-            if existing_label == label:
-                # Nếu nhãn giống nhau, không cho phép thêm
-                return {
-                    'success': False,
-                    'message': f'Dữ liệu đã tồn tại với nhãn {label}',
-                    'existing_label': existing_label
-                }
-            else:
-                # Nếu nhãn khác nhau, cập nhật nhãn
-                df.loc[existing_index[0], 'label'] = label
-                df.to_csv(DATA_FILE, index=False)
-
-                # Huấn luyện lại mô hình
-                MODEL, VECTORIZER = train_model(DATA_FILE)
-
-                return {
-                    'success': True,
-                    'message': f'Đã cập nhật nhãn từ {existing_label} thành {label}',
-                    'updated': True,
-                    'old_label': existing_label,
-                    'new_label': label
-                }
-        else:
-            # Dữ liệu chưa tồn tại, thêm mới
-            new_data = pd.DataFrame({'label': [label], 'text': [full_text]})
-            df = pd.concat([df, new_data], ignore_index=True)
-            df.to_csv(DATA_FILE, index=False)
-
-            # Huấn luyện lại mô hình
-            MODEL, VECTORIZER = train_model(DATA_FILE)
+            # Cập nhật mô hình với nhãn mới
+            learn_from_feedback(label, full_text, old_label=existing_label)
 
             return {
                 'success': True,
-                'message': f'Đã thêm dữ liệu vào tập huấn luyện với nhãn {label}'
+                'message': f'Đã cập nhật nhãn từ {existing_label} thành {label}',
+                'updated': True,
+                'old_label': existing_label,
+                'new_label': label
             }
+
+        # Cập nhật mô hình với dữ liệu mới
+        learn_from_feedback(label, full_text)
+
+        return {
+            'success': True,
+            'message': f'Đã thêm dữ liệu vào tập huấn luyện với nhãn {label}'
+        }
     except Exception as e:
         logger.error(f"Lỗi khi thêm dữ liệu vào tập huấn luyện: {str(e)}")
         return {'success': False, 'error': str(e)}
@@ -748,5 +1267,10 @@ def serve(path):
     return render_template('index.html')
 
 if __name__ == '__main__':
+    debug = True
+    # Với debug reloader, tiến trình cha chỉ theo dõi file thay đổi; chỉ tiến trình phục vụ cần warm-up
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        warm_up_model()
+        AUTO_TRIAGE.start()
     # Sử dụng port 5001 để tránh xung đột với AirPlay
-    app.run(debug=True, host='0.0.0.0', port=5001)
\ No newline at end of file
+    app.run(debug=debug, host='0.0.0.0', port=5001)
\ No newline at end of file
@@ -0,0 +1,363 @@
+# Tự động phân loại email mới vào INBOX ở luồng nền và chuyển spam sang SPAM
+#
+# Tính năng tùy chọn: server bật bằng AUTO_TRIAGE_ENABLED=1, sau đó mỗi người
+# dùng tự bật cho tài khoản của mình qua POST /auto_triage. Khi bật,
+# credentials của người dùng được lưu (chỉ chủ sở hữu đọc được) trong
+# AUTO_TRIAGE_STATE_DIR để luồng nền truy cập Gmail khi người dùng không mở trang.
+#
+# Mỗi chu kỳ, với từng tài khoản: đọc Gmail history kể từ historyId đã lưu
+# (checkpoint) để lấy các email mới vào INBOX, lấy chi tiết và phân loại theo
+# lô, chuyển các email spam có độ tin cậy >= AUTO_TRIAGE_THRESHOLD sang SPAM
+# bằng batchModify rồi mới lưu historyId mới. Nếu tiến trình dừng giữa chu kỳ,
+# chu kỳ sau xử lý lại từ checkpoint cũ (chuyển lại một email đã ở SPAM là vô hại).
+#
+# Chỉ một tiến trình (một worker của serve_prod.py) chạy vòng lặp tại một thời
+# điểm nhờ khóa file; các tiến trình khác thay thế khi tiến trình đó dừng.
+import os
+import json
+import time
+import hashlib
+import threading
+from datetime import datetime
+from config import (
+    AUTO_TRIAGE_ENABLED, AUTO_TRIAGE_INTERVAL, AUTO_TRIAGE_THRESHOLD, AUTO_TRIAGE_BATCH_SIZE,
+    AUTO_TRIAGE_STATE_DIR
+)
+from utils import logger
+from mailbox_mirror import collect_history_changes, _history_expired
+
+class AutoTriageWorker:
+    """Luồng nền phân loại email mới của các tài khoản đã bật tự động phân loại.
+
+    Mỗi tài khoản có hai file trong state_dir: file cài đặt (credentials, chỉ
+    do request của người dùng ghi) và file checkpoint (historyId, số liệu của
+    chu kỳ gần nhất, chỉ do luồng nền ghi), nên hai bên không ghi đè lên nhau.
+    """
+
+    def __init__(self, model_fn, state_dir=AUTO_TRIAGE_STATE_DIR, available=AUTO_TRIAGE_ENABLED,
+                 interval=AUTO_TRIAGE_INTERVAL, threshold=AUTO_TRIAGE_THRESHOLD, batch_size=AUTO_TRIAGE_BATCH_SIZE):
+        """
+        Args:
+            model_fn: callable - Hàm trả về ảnh chụp (model, vectorizer) đang phục vụ
+            state_dir: str - Thư mục lưu cài đặt và checkpoint của từng tài khoản
+            available: bool - Server có cho phép tính năng này không
+            interval: float - Số giây giữa hai chu kỳ
+            threshold: float - Độ tin cậy spam tối thiểu (%) để chuyển email sang SPAM
+            batch_size: int - Số email lấy chi tiết và phân loại mỗi lô
+        """
+        self.model_fn = model_fn
+        self.state_dir = state_dir
+        self.available = available
+        self.interval = interval
+        self.threshold = threshold
+        self.batch_size = max(1, batch_size)
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._leader_file = None
+        self._services = {}  # tài khoản -> (refresh token, credentials, Gmail service)
+
+    # ---- Trạng thái lưu trên đĩa ----------------------------------------
+
+    def _path(self, account, kind):
+        name = hashlib.sha256(account.lower().encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.state_dir, f'{name}.{kind}.json')
+
+    def _read(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, path, data):
+        os.makedirs(self.state_dir, exist_ok=True)
+        tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        # Quyền 600 vì file cài đặt chứa refresh token của người dùng
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def enable(self, account, credentials_dict):
+        """Bật tự động phân loại cho tài khoản.
+
+        Args:
+            account: str - Địa chỉ email của tài khoản
+            credentials_dict: dict - Credentials của người dùng (xem credentials_to_dict)
+        """
+        if not self.available:
+            raise RuntimeError('Tự động phân loại chưa được bật trên server (AUTO_TRIAGE_ENABLED=1)')
+        if not credentials_dict.get('refresh_token'):
+            raise ValueError('Không có refresh token, vui lòng đăng nhập lại')
+        self._write(self._path(account, 'settings'), {
+            'account': account,
+            'credentials': credentials_dict,
+            'enabled_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        })
+        logger.info(f"Đã bật tự động phân loại cho {account}")
+
+    def disable(self, account):
+        """Tắt tự động phân loại và xóa credentials đã lưu của tài khoản."""
+        for kind in ('settings', 'checkpoint'):
+            try:
+                os.remove(self._path(account, kind))
+            except FileNotFoundError:
+                pass
+        logger.info(f"Đã tắt tự động phân loại cho {account}")
+
+    def status(self, account):
+        """Trạng thái tự động phân loại của tài khoản (không gồm credentials).
+
+        Returns:
+            dict - Cài đặt của server, checkpoint và số liệu của chu kỳ gần nhất
+        """
+        settings = self._read(self._path(account, 'settings'))
+        checkpoint = self._read(self._path(account, 'checkpoint')) or {}
+        return {
+            'available': self.available,
+            'enabled': settings is not None,
+            'enabled_at': settings.get('enabled_at') if settings else None,
+            'threshold': self.threshold,
+            'interval': self.interval,
+            'history_id': checkpoint.get('history_id'),
+            'last_cycle': checkpoint.get('last_cycle'),
+            'last_error': checkpoint.get('last_error'),
+            'totals': checkpoint.get('totals', {'classified': 0, 'moved': 0})
+        }
+
+    def _enabled_accounts(self):
+        try:
+            names = sorted(os.listdir(self.state_dir))
+        except FileNotFoundError:
+            return []
+        settings = [self._read(os.path.join(self.state_dir, name)) for name in names if name.endswith('.settings.json')]
+        return [item for item in settings if item and item.get('account') and item.get('credentials')]
+
+    # ---- Luồng nền -----------------------------------------------------
+
+    def start(self):
+        """Khởi động luồng nền (không làm gì nếu server không bật tính năng).
+
+        Returns:
+            bool - True nếu luồng nền đang chạy
+        """
+        if not self.available:
+            return False
+        if self._thread is not None and self._thread.is_alive():
+            return True
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='auto-triage', daemon=True)
+        self._thread.start()
+        logger.info(
+            f"Tự động phân loại: mỗi {self.interval}s, ngưỡng {self.threshold}%, lô {self.batch_size} email"
+        )
+        return True
+
+    def stop(self, timeout=None):
+        """Dừng luồng nền sau khi chu kỳ đang chạy kết thúc."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self._leader_file is not None:
+            self._leader_file.close()
+            self._leader_file = None
+
+    def _acquire_leader(self):
+        """Giữ khóa file để chỉ một tiến trình chạy các chu kỳ."""
+        if self._leader_file is not None:
+            return True
+        try:
+            import fcntl
+        except ImportError:  # Windows: một tiến trình
+            return True
+        os.makedirs(self.state_dir, exist_ok=True)
+        lock_file = open(os.path.join(self.state_dir, '.lock'), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._leader_file = lock_file
+        return True
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                if self._acquire_leader():
+                    self.run_cycle()
+            except Exception as e:
+                logger.error(f"Lỗi trong chu kỳ tự động phân loại: {str(e)}")
+            self._stop_event.wait(self.interval)
+
+    def run_cycle(self):
+        """Chạy một chu kỳ cho mọi tài khoản đã bật.
+
+        Returns:
+            dict - Tài khoản -> số liệu của chu kỳ (None nếu chỉ vừa tạo checkpoint)
+        """
+        metrics = {}
+        for settings in self._enabled_accounts():
+            account = settings['account']
+            checkpoint_path = self._path(account, 'checkpoint')
+            checkpoint = self._read(checkpoint_path) or {'totals': {'classified': 0, 'moved': 0}}
+            try:
+                metrics[account] = self.triage_account(settings, checkpoint)
+                checkpoint.pop('last_error', None)
+            except Exception as e:
+                logger.error(f"Lỗi khi tự động phân loại email của {account}: {str(e)}")
+                checkpoint['last_error'] = str(e)
+                self._services.pop(account, None)
+            if self._read(self._path(account, 'settings')) is not None:
+                # Người dùng có thể vừa tắt tính năng trong lúc chu kỳ chạy
+                self._write(checkpoint_path, checkpoint)
+        return metrics
+
+    def _service(self, settings):
+        from gmail_oauth import credentials_from_dict, get_background_service
+
+        account = settings['account']
+        refresh_token = settings['credentials']['refresh_token']
+        cached = self._services.get(account)
+        if cached is None or cached[0] != refresh_token:
+            cached = (refresh_token, credentials_from_dict(settings['credentials']), None)
+        credentials, service = cached[1], cached[2]
+        if service is None or not credentials.valid:
+            # Token mới chỉ giữ trong bộ nhớ; refresh token trong file cài đặt không đổi
+            service, _ = get_background_service(credentials)
+        self._services[account] = (refresh_token, credentials, service)
+        return service
+
+    def _new_inbox_messages(self, service, start_history_id):
+        """Đọc history kể từ checkpoint và lấy ID các email mới vẫn còn trong INBOX.
+
+        Returns:
+            tuple - (list ID email, historyId mới nhất)
+        """
+        records = []
+        latest_history_id = start_history_id
+        page_token = None
+        history_api = service.users().history()
+        while True:
+            response = history_api.list(
+                userId='me', startHistoryId=str(start_history_id), historyTypes=['messageAdded'],
+                labelId='INBOX', pageToken=page_token
+            ).execute()
+            records.extend(response.get('history', []))
+            latest_history_id = max(latest_history_id, int(response.get('historyId', start_history_id)))
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                break
+        changes = collect_history_changes(records)
+        message_ids = [
+            message_id for message_id, label_ids in changes.labels.items()
+            if message_id in changes.added and 'INBOX' in label_ids
+        ]
+        return message_ids, latest_history_id
+
+    def triage_account(self, settings, checkpoint):
+        """Phân loại các email mới của một tài khoản và cập nhật checkpoint (trong bộ nhớ).
+
+        Args:
+            settings: dict - Cài đặt của tài khoản (account, credentials)
+            checkpoint: dict - Checkpoint hiện tại, được cập nhật tại chỗ
+
+        Returns:
+            dict|None - Số liệu của chu kỳ, None nếu chỉ vừa tạo checkpoint
+        """
+        from gmail_oauth import fetch_messages, build_email_data, classify_page, modify_messages
+
+        account = settings['account']
+        started = time.monotonic()
+        service = self._service(settings)
+
+        if checkpoint.get('history_id') is None:
+            # Lần đầu: chỉ phân loại email đến sau thời điểm bật tính năng
+            profile = service.users().getProfile(userId='me').execute()
+            checkpoint['history_id'] = int(profile['historyId'])
+            logger.info(f"Tự động phân loại {account}: bắt đầu từ historyId {checkpoint['history_id']}")
+            return None
+
+        try:
+            message_ids, latest_history_id = self._new_inbox_messages(service, checkpoint['history_id'])
+        except Exception as e:
+            if not _history_expired(e):
+                raise
+            # Checkpoint quá cũ (server dừng lâu): bỏ qua khoảng bị mất, tiếp tục từ hiện tại
+            profile = service.users().getProfile(userId='me').execute()
+            logger.warning(
+                f"historyId {checkpoint['history_id']} của {account} đã hết hạn, "
+                f"tự động phân loại tiếp tục từ historyId {profile['historyId']}"
+            )
+            message_ids, latest_history_id = [], int(profile['historyId'])
+        poll_seconds = time.monotonic() - started
+
+        metrics = {
+            'new_messages': len(message_ids), 'classified': 0, 'spam': 0, 'moved': 0, 'move_failed': 0,
+            'poll_seconds': round(poll_seconds, 3), 'fetch_seconds': 0.0, 'classify_seconds': 0.0,
+            'modify_seconds': 0.0
+        }
+        arrival_latencies = []
+        snapshot = self.model_fn() if message_ids else None
+
+        for start in range(0, len(message_ids), self.batch_size):
+            chunk = message_ids[start:start + self.batch_size]
+
+            step = time.monotonic()
+            fetched = fetch_messages(service, chunk)
+            metrics['fetch_seconds'] += time.monotonic() - step
+
+            step = time.monotonic()
+            emails, contents = [], []
+            for message_id in chunk:
+                msg = fetched.get(message_id)
+                # Bỏ qua email đã bị xóa hoặc người dùng đã chuyển khỏi INBOX
+                if msg is None or 'INBOX' not in msg.get('labelIds', []):
+                    continue
+                email_data, content = build_email_data(message_id, msg)
+                emails.append(email_data)
+                contents.append(content)
+                if msg.get('internalDate'):
+                    arrival_latencies.append(time.time() - int(msg['internalDate']) / 1000)
+            results = classify_page(snapshot.model, snapshot.vectorizer, emails, contents)
+            metrics['classify_seconds'] += time.monotonic() - step
+            metrics['classified'] += len(results)
+
+            spam_ids = [message_id for message_id, result in results.items() if result['classification'] == 'spam']
+            to_move = [message_id for message_id in spam_ids if results[message_id]['confidence'] >= self.threshold]
+            metrics['spam'] += len(spam_ids)
+            if to_move:
+                step = time.monotonic()
+                moved = modify_messages(service, to_move, add_label_ids=['SPAM'], remove_label_ids=['INBOX'])
+                metrics['modify_seconds'] += time.monotonic() - step
+                succeeded = sum(1 for result in moved.values() if result['success'])
+                metrics['moved'] += succeeded
+                metrics['move_failed'] += len(moved) - succeeded
+
+        duration = time.monotonic() - started
+        for key in ('fetch_seconds', 'classify_seconds', 'modify_seconds'):
+            metrics[key] = round(metrics[key], 3)
+        metrics.update({
+            'finished_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'duration_seconds': round(duration, 3),
+            'throughput': round(metrics['classified'] / duration, 1) if duration > 0 else 0.0,
+            # Thời gian từ lúc email đến hộp thư tới lúc được phân loại
+            'arrival_latency_avg': round(sum(arrival_latencies) / len(arrival_latencies), 2) if arrival_latencies else None,
+            'arrival_latency_max': round(max(arrival_latencies), 2) if arrival_latencies else None
+        })
+
+        checkpoint['history_id'] = max(checkpoint['history_id'], latest_history_id)
+        checkpoint['last_cycle'] = metrics
+        totals = checkpoint.setdefault('totals', {'classified': 0, 'moved': 0})
+        totals['classified'] += metrics['classified']
+        totals['moved'] += metrics['moved']
+
+        if message_ids:
+            logger.info(
+                f"Tự động phân loại {account}: {metrics['classified']}/{metrics['new_messages']} email mới, "
+                f"chuyển {metrics['moved']} sang SPAM ({metrics['move_failed']} lỗi) trong "
+                f"{metrics['duration_seconds']}s ({metrics['throughput']} email/s; history "
+                f"{metrics['poll_seconds']}s, lấy {metrics['fetch_seconds']}s, phân loại "
+                f"{metrics['classify_seconds']}s, đổi nhãn {metrics['modify_seconds']}s); "
+                f"độ trễ từ lúc đến: TB {metrics['arrival_latency_avg']}s, tối đa {metrics['arrival_latency_max']}s"
+            )
+        return metrics
@@ -0,0 +1,248 @@
+# Bộ nhớ đệm kết quả phân loại email
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from config import (
+    CLASSIFICATION_CACHE_SIZE, CLASSIFICATION_CACHE_DB, CLASSIFICATION_CACHE_DB_MAX_ROWS,
+    CLASSIFICATION_CACHE_PRUNE_INTERVAL
+)
+from utils import logger
+
+def message_key(message_id):
+    """Khóa bộ nhớ đệm cho email Gmail (nội dung email không thay đổi theo ID)."""
+    return f"msg:{message_id}"
+
+def snippet_key(message_id):
+    """Khóa cho kết quả phân loại tạm thời (từ tiêu đề + snippet) của email Gmail."""
+    return f"snippet:{message_id}"
+
+def content_key(content, subject=''):
+    """Khóa bộ nhớ đệm theo mã băm nội dung (dùng cho văn bản nhập tay)."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update((subject or '').encode('utf-8', errors='surrogatepass'))
+    digest.update(b'\0')
+    digest.update((content or '').encode('utf-8', errors='surrogatepass'))
+    return f"text:{digest.hexdigest()}"
+
+# 3: kết quả không kèm giải thích không còn lưu 'top_keywords' rỗng
+SCHEMA_VERSION = 3
+
+class ClassificationCache:
+    """Bộ nhớ đệm hai tầng cho kết quả phân loại.
+
+    Tầng 1 là LRU trong bộ nhớ, tầng 2 (tùy chọn) là file SQLite dùng chung
+    giữa các tiến trình và giữ lại sau khi khởi động lại. Mọi khóa đều gắn với
+    phiên bản mô hình, nên các tiến trình đang phục vụ các phiên bản khác nhau
+    (ví dụ khi serve_prod.py thay worker) dùng chung file mà không xóa kết quả
+    của nhau. Kết quả cũ bị loại dần theo số dòng tối đa thay vì bị xóa hết
+    mỗi lần đổi phiên bản.
+    """
+
+    def __init__(self, maxsize=CLASSIFICATION_CACHE_SIZE, db_path=CLASSIFICATION_CACHE_DB,
+                 max_rows=CLASSIFICATION_CACHE_DB_MAX_ROWS):
+        self.maxsize = maxsize
+        self.db_path = db_path or None
+        self.max_rows = max_rows
+        self._memory = OrderedDict()  # (phiên bản, khóa) -> kết quả
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+        self._last_prune = 0.0
+        self._version = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _connect(self):
+        # Mỗi luồng (và mỗi tiến trình sau khi fork) dùng kết nối riêng
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _db(self):
+        """Kết nối tới tầng SQLite (mở và tạo bảng ở lần dùng đầu tiên), None nếu đã tắt."""
+        if self._initialized:
+            return self._connect() if self.db_path else None
+        with self._init_lock:
+            if not self._initialized:
+                if self.db_path:
+                    try:
+                        self._init_db()
+                    except Exception as e:
+                        logger.warning(f"Không thể mở bộ nhớ đệm SQLite {self.db_path}, chỉ dùng bộ nhớ: {e}")
+                        self.db_path = None
+                self._initialized = True
+        return self._connect() if self.db_path else None
+
+    def _init_db(self):
+        conn = self._connect()
+        with conn:
+            if conn.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+                # Bảng của phiên bản cũ (khóa chính hoặc dạng kết quả khác): chỉ là bộ nhớ đệm nên tạo lại
+                conn.execute('DROP TABLE IF EXISTS classifications')
+                conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS classifications ('
+                'key TEXT NOT NULL, model_version TEXT NOT NULL, '
+                'result TEXT NOT NULL, created_at REAL NOT NULL, '
+                'PRIMARY KEY (key, model_version))'
+            )
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS idx_classifications_created ON classifications (created_at)'
+            )
+
+    def _check_version(self, version):
+        """Ghi nhận phiên bản mô hình tiến trình đang dùng (chỉ để thống kê và ghi log)."""
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            self._version = version
+        logger.info(f"Bộ nhớ đệm phân loại chuyển sang phiên bản mô hình {version}")
+
+    def _prune(self, conn):
+        """Xóa các dòng cũ nhất khi tầng SQLite vượt max_rows (tối đa một lần mỗi CLASSIFICATION_CACHE_PRUNE_INTERVAL giây)."""
+        now = time.time()
+        if now - self._last_prune < CLASSIFICATION_CACHE_PRUNE_INTERVAL:
+            return
+        self._last_prune = now
+        excess = conn.execute('SELECT COUNT(*) FROM classifications').fetchone()[0] - self.max_rows
+        if excess > 0:
+            with conn:
+                conn.execute(
+                    'DELETE FROM classifications WHERE rowid IN '
+                    '(SELECT rowid FROM classifications ORDER BY created_at LIMIT ?)',
+                    (excess,)
+                )
+            logger.info(f"Đã xóa {excess} kết quả phân loại cũ khỏi bộ nhớ đệm SQLite")
+
+    def _remember(self, key, result):
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    def get_many(self, keys, version):
+        """Tra cứu nhiều kết quả.
+
+        Args:
+            keys: list - Danh sách khóa
+            version: str - Phiên bản mô hình hiện tại
+
+        Returns:
+            dict - Ánh xạ khóa -> kết quả cho các khóa tìm thấy
+        """
+        self._check_version(version)
+        found = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                result = self._memory.get((version, key))
+                if result is not None:
+                    self._memory.move_to_end((version, key))
+                    found[key] = result
+                else:
+                    missing.append(key)
+            self.hits += len(found)
+
+        if missing:
+            try:
+                conn = self._db()
+                for start in range(0, len(missing) if conn is not None else 0, 500):
+                    chunk = missing[start:start + 500]
+                    placeholders = ','.join('?' * len(chunk))
+                    rows = conn.execute(
+                        f'SELECT key, result FROM classifications '
+                        f'WHERE model_version = ? AND key IN ({placeholders})',
+                        [version] + chunk
+                    ).fetchall()
+                    with self._lock:
+                        for key, payload in rows:
+                            result = json.loads(payload)
+                            found[key] = result
+                            self._remember((version, key), result)
+                        self.disk_hits += len(rows)
+            except Exception as e:
+                logger.warning(f"Lỗi khi đọc bộ nhớ đệm phân loại: {e}")
+
+        with self._lock:
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items, version):
+        """Lưu nhiều kết quả.
+
+        Args:
+            items: dict - Ánh xạ khóa -> kết quả phân loại
+            version: str - Phiên bản mô hình đã tạo ra các kết quả
+        """
+        if not items:
+            return
+        self._check_version(version)
+        with self._lock:
+            for key, result in items.items():
+                self._remember((version, key), result)
+
+        try:
+            conn = self._db()
+            if conn is not None:
+                now = time.time()
+                with conn:
+                    conn.executemany(
+                        'INSERT OR REPLACE INTO classifications (key, model_version, result, created_at) '
+                        'VALUES (?, ?, ?, ?)',
+                        [(key, version, json.dumps(result, ensure_ascii=False), now) for key, result in items.items()]
+                    )
+                self._prune(conn)
+        except Exception as e:
+            logger.warning(f"Lỗi khi ghi bộ nhớ đệm phân loại: {e}")
+
+    def get(self, key, version):
+        """Tra cứu một kết quả, trả về None nếu không có."""
+        return self.get_many([key], version).get(key)
+
+    def put(self, key, result, version):
+        """Lưu một kết quả."""
+        self.put_many({key: result}, version)
+
+    def clear(self):
+        """Xóa toàn bộ bộ nhớ đệm (cả tầng SQLite)."""
+        with self._lock:
+            self._memory.clear()
+        try:
+            conn = self._db()
+            if conn is not None:
+                with conn:
+                    conn.execute('DELETE FROM classifications')
+        except Exception as e:
+            logger.warning(f"Lỗi khi xóa bộ nhớ đệm phân loại: {e}")
+
+    def stats(self):
+        """Thống kê bộ nhớ đệm.
+
+        Returns:
+            dict - Số lần hit (bộ nhớ/đĩa), miss và kích thước hiện tại
+        """
+        with self._lock:
+            return {
+                'memory_hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'size': len(self._memory),
+                'maxsize': self.maxsize,
+                'model_version': self._version,
+                'db_path': self.db_path
+            }
+
+CLASSIFICATION_CACHE = ClassificationCache()
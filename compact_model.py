@@ -0,0 +1,362 @@
+# Định dạng mô hình gọn, ánh xạ bộ nhớ (mmap) và bộ suy luận chỉ dùng NumPy
+#
+# Cấu trúc file:
+#   MAGIC | độ dài header (uint64, little-endian) | header JSON | các mảng thô căn lề 64 byte
+# Header mô tả cấu hình tách từ của vectorizer, các lớp và vị trí/kiểu/kích
+# thước của từng mảng. Các mảng được đọc thẳng từ vùng nhớ ánh xạ nên các
+# tiến trình (kể cả worker được fork) dùng chung trang nhớ của hệ điều hành.
+import os
+import re
+import json
+import mmap
+import struct
+import numpy as np
+from config import COMPACT_MODEL_PATH, COMPACT_MODEL_DTYPE
+from utils import logger
+
+MAGIC = b'NBCOMPACT1\n'
+_ALIGNMENT = 64
+# Sai lệch xác suất tối đa cho phép so với pipeline gốc theo kiểu số thực lưu trữ
+# (nhãn dự đoán luôn phải khớp; xem export_compact_model)
+PROBABILITY_TOLERANCE = {'float32': 1e-6, 'float64': 1e-12}
+
+class SparseRows:
+    """Ma trận thưa dạng CSR tối giản do CompactVectorizer trả về.
+
+    Hỗ trợ đủ giao diện mà classify_emails cần: shape, len và lấy một hàng
+    (có thuộc tính indices/data).
+    """
+
+    def __init__(self, indptr, indices, data, n_features):
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.shape = (len(indptr) - 1, n_features)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.shape[0]
+        start, end = self.indptr[i], self.indptr[i + 1]
+        return SparseRows(
+            np.array([0, end - start]), self.indices[start:end], self.data[start:end], self.shape[1]
+        )
+
+class SortedVocabulary:
+    """Từ vựng chỉ đọc trên bảng từ đã sắp xếp (thay cho dict vocabulary_).
+
+    Vị trí của từ trong bảng chính là chỉ số đặc trưng của nó.
+    """
+
+    def __init__(self, terms):
+        self.terms = terms
+
+    def __len__(self):
+        return len(self.terms)
+
+    def lookup(self, tokens):
+        """Tra chỉ số đặc trưng cho nhiều từ cùng lúc.
+
+        Args:
+            tokens: list - Danh sách từ (str)
+
+        Returns:
+            tuple - (mảng vị trí trong tokens có trong từ vựng, mảng chỉ số đặc trưng tương ứng)
+        """
+        width = self.terms.dtype.itemsize
+        encoded = [token.encode('utf-8') for token in tokens]
+        # Từ dài hơn độ rộng bảng chắc chắn không có trong từ vựng (và sẽ bị cắt nếu ép kiểu)
+        positions = np.fromiter(
+            (i for i, token in enumerate(encoded) if len(token) <= width), dtype=np.int64
+        )
+        if positions.size == 0 or len(self.terms) == 0:
+            return positions[:0], positions[:0]
+        candidates = np.array([encoded[i] for i in positions], dtype=self.terms.dtype)
+        columns = np.searchsorted(self.terms, candidates)
+        np.minimum(columns, len(self.terms) - 1, out=columns)
+        found = self.terms[columns] == candidates
+        return positions[found], columns[found]
+
+    def __contains__(self, token):
+        return self.lookup([token])[0].size > 0
+
+    def __getitem__(self, token):
+        _, columns = self.lookup([token])
+        if columns.size == 0:
+            raise KeyError(token)
+        return int(columns[0])
+
+    def __iter__(self):
+        for term in self.terms:
+            yield term.decode('utf-8')
+
+class CompactVectorizer:
+    """Bộ vector hóa TF-IDF đọc từ file mô hình gọn (tương đương TfidfVectorizer.transform)."""
+
+    def __init__(self, header, terms, idf):
+        self.lowercase = header['lowercase']
+        self.token_pattern = header['token_pattern']
+        self.ngram_range = tuple(header['ngram_range'])
+        self.binary = header['binary']
+        self.sublinear_tf = header['sublinear_tf']
+        self.norm = header['norm']
+        self.idf_ = idf
+        self.vocabulary_ = SortedVocabulary(terms)
+        self._token_regex = re.compile(self.token_pattern)
+
+    def _analyze(self, doc):
+        # Giống analyzer 'word' của sklearn: chữ thường -> tách từ -> n-gram
+        if self.lowercase:
+            doc = doc.lower()
+        tokens = self._token_regex.findall(doc)
+        min_n, max_n = self.ngram_range
+        if max_n == 1:
+            return tokens
+        original_tokens = tokens
+        if min_n == 1:
+            tokens = list(original_tokens)
+            min_n += 1
+        else:
+            tokens = []
+        n_original_tokens = len(original_tokens)
+        for n in range(min_n, min(max_n + 1, n_original_tokens + 1)):
+            for i in range(n_original_tokens - n + 1):
+                tokens.append(' '.join(original_tokens[i:i + n]))
+        return tokens
+
+    def transform(self, raw_documents):
+        """Chuyển danh sách văn bản thành ma trận TF-IDF thưa.
+
+        Args:
+            raw_documents: list - Danh sách văn bản đã tiền xử lý
+
+        Returns:
+            SparseRows - Ma trận thưa (n_docs x n_features)
+        """
+        n_docs = len(raw_documents)
+        n_features = len(self.vocabulary_)
+        tokens = []
+        doc_ids = []
+        for doc_id, doc in enumerate(raw_documents):
+            doc_tokens = self._analyze(doc)
+            tokens.extend(doc_tokens)
+            doc_ids.extend([doc_id] * len(doc_tokens))
+
+        positions, columns = self.vocabulary_.lookup(tokens)
+        docs = np.asarray(doc_ids, dtype=np.int64)[positions]
+
+        # Đếm số lần xuất hiện theo (văn bản, đặc trưng); kết quả đã sắp theo văn bản rồi theo cột
+        keys, counts = np.unique(docs * n_features + columns, return_counts=True)
+        row_of = keys // n_features
+        indices = (keys % n_features).astype(np.int32)
+        data = counts.astype(np.float64)
+        if self.binary:
+            data.fill(1.0)
+        if self.sublinear_tf:
+            data = np.log(data) + 1
+        if self.idf_ is not None:
+            data *= self.idf_[indices]
+        if self.norm == 'l2':
+            norms = np.sqrt(np.bincount(row_of, weights=data * data, minlength=n_docs))
+        elif self.norm == 'l1':
+            norms = np.bincount(row_of, weights=np.abs(data), minlength=n_docs)
+        else:
+            norms = None
+        if norms is not None:
+            norms[norms == 0.0] = 1.0
+            data /= norms[row_of]
+
+        indptr = np.zeros(n_docs + 1, dtype=np.int64)
+        np.cumsum(np.bincount(row_of, minlength=n_docs), out=indptr[1:])
+        return SparseRows(indptr, indices, data, n_features)
+
+    def get_feature_names_out(self):
+        """Danh sách đặc trưng theo thứ tự chỉ số (giải mã một lần khi cần giải thích)."""
+        return np.char.decode(self.vocabulary_.terms, 'utf-8').astype(object)
+
+class CompactNB:
+    """Bộ suy luận Multinomial Naive Bayes trên tham số đọc từ file mô hình gọn."""
+
+    def __init__(self, classes, class_log_prior, feature_log_prob):
+        self.classes_ = np.array(classes, dtype=object)
+        self.class_log_prior_ = class_log_prior
+        self.feature_log_prob_ = feature_log_prob
+
+    def _joint_log_likelihood(self, X):
+        n_docs = X.shape[0]
+        row_of = np.repeat(np.arange(n_docs), np.diff(X.indptr))
+        jll = np.empty((n_docs, len(self.classes_)), dtype=np.float64)
+        for c in range(len(self.classes_)):
+            weights = X.data * self.feature_log_prob_[c, X.indices]
+            jll[:, c] = np.bincount(row_of, weights=weights, minlength=n_docs) + self.class_log_prior_[c]
+        return jll
+
+    def predict_log_proba(self, X):
+        jll = self._joint_log_likelihood(X)
+        jll_max = jll.max(axis=1, keepdims=True)
+        log_prob_x = jll_max + np.log(np.exp(jll - jll_max).sum(axis=1, keepdims=True))
+        return jll - log_prob_x
+
+    def predict_proba(self, X):
+        """Xác suất của từng lớp cho mỗi văn bản (n_docs x n_classes)."""
+        return np.exp(self.predict_log_proba(X))
+
+    def predict(self, X):
+        """Nhãn dự đoán cho mỗi văn bản."""
+        return self.classes_[self._joint_log_likelihood(X).argmax(axis=1)]
+
+def _check_exportable(model, vectorizer):
+    params = vectorizer.get_params()
+    unsupported = {
+        'analyzer': 'word', 'tokenizer': None, 'preprocessor': None,
+        'stop_words': None, 'strip_accents': None, 'input': 'content'
+    }
+    for name, expected in unsupported.items():
+        if params.get(name, expected) != expected:
+            raise ValueError(f"Không hỗ trợ xuất vectorizer với {name}={params[name]!r}")
+    if params.get('norm') not in ('l1', 'l2', None):
+        raise ValueError(f"Không hỗ trợ norm={params.get('norm')!r}")
+    for attr in ('classes_', 'class_log_prior_', 'feature_log_prob_'):
+        if not hasattr(model, attr):
+            raise ValueError(f"Mô hình thiếu thuộc tính {attr}")
+
+def export_compact_model(model, vectorizer, path=COMPACT_MODEL_PATH, dtype=COMPACT_MODEL_DTYPE):
+    """Xuất cặp MultinomialNB + TfidfVectorizer sang định dạng gọn, ánh xạ bộ nhớ được.
+
+    Từ vựng được lưu thành bảng byte UTF-8 đã sắp xếp (vị trí = chỉ số đặc
+    trưng), idf và log-xác suất đặc trưng lưu dạng float32 (mặc định).
+
+    Với float32, nhãn dự đoán khớp pipeline gốc nhưng xác suất lệch tới
+    PROBABILITY_TOLERANCE['float32'] (1e-6; đo được ~2.7e-7 trên tập dữ liệu)
+    và trọng số từ khóa giải thích cũng lệch tương ứng. Dùng dtype='float64'
+    (hoặc COMPACT_MODEL_DTYPE=float64) khi cần xác suất khớp tới sai số làm tròn.
+
+    Args:
+        model: MultinomialNB - Mô hình đã huấn luyện
+        vectorizer: TfidfVectorizer - Vectorizer đã huấn luyện
+        path: str - Đường dẫn file đích
+        dtype: str - Kiểu số thực của idf và log-xác suất
+
+    Returns:
+        str - Đường dẫn đã ghi
+    """
+    _check_exportable(model, vectorizer)
+    feature_names = vectorizer.get_feature_names_out()
+    encoded = [str(name).encode('utf-8') for name in feature_names]
+    terms = np.array(encoded, dtype=f'S{max((len(t) for t in encoded), default=1)}')
+    # sklearn đánh chỉ số đặc trưng theo thứ tự từ điển nên bảng đã sắp xếp sẵn
+    if len(terms) > 1 and not np.all(terms[:-1] < terms[1:]):
+        raise ValueError("Từ vựng không được sắp xếp theo chỉ số đặc trưng")
+
+    params = vectorizer.get_params()
+    arrays = {
+        'terms': terms,
+        'feature_log_prob': np.ascontiguousarray(model.feature_log_prob_, dtype=dtype),
+        'class_log_prior': np.ascontiguousarray(model.class_log_prior_, dtype=np.float64)
+    }
+    idf = getattr(vectorizer, 'idf_', None) if params.get('use_idf', True) else None
+    if idf is not None:
+        arrays['idf'] = np.ascontiguousarray(idf, dtype=dtype)
+
+    header = {
+        'lowercase': params.get('lowercase', True),
+        'token_pattern': params.get('token_pattern'),
+        'ngram_range': list(params.get('ngram_range', (1, 1))),
+        'binary': params.get('binary', False),
+        'sublinear_tf': params.get('sublinear_tf', False),
+        'norm': params.get('norm', 'l2'),
+        'classes': [str(c) for c in model.classes_],
+        'arrays': {}
+    }
+
+    # Tính vị trí căn lề cho từng mảng (header có độ dài cố định sau khi điền offset)
+    offset = 0
+    for name, array in arrays.items():
+        header['arrays'][name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += -(-array.nbytes // _ALIGNMENT) * _ALIGNMENT
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    data_start = -(-(len(MAGIC) + 8 + len(header_bytes)) // _ALIGNMENT) * _ALIGNMENT
+
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header_bytes)))
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.seek(data_start + header['arrays'][name]['offset'])
+            f.write(array.tobytes())
+    os.replace(tmp_path, path)
+    logger.info(f"Đã xuất mô hình gọn tại: {path} ({os.path.getsize(path)} byte)")
+    return path
+
+def load_compact_model(path=COMPACT_MODEL_PATH):
+    """Nạp mô hình gọn bằng ánh xạ bộ nhớ (không cần sklearn).
+
+    Args:
+        path: str - Đường dẫn file mô hình gọn
+
+    Returns:
+        tuple - (CompactNB, CompactVectorizer)
+    """
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if buffer[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"File {path} không phải mô hình gọn hợp lệ")
+    (header_length,) = struct.unpack_from('<Q', buffer, len(MAGIC))
+    header_start = len(MAGIC) + 8
+    header = json.loads(buffer[header_start:header_start + header_length].decode('utf-8'))
+    data_start = -(-(header_start + header_length) // _ALIGNMENT) * _ALIGNMENT
+
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dtype = np.dtype(spec['dtype'])
+        count = int(np.prod(spec['shape'])) if spec['shape'] else 1
+        arrays[name] = np.frombuffer(
+            buffer, dtype=dtype, count=count, offset=data_start + spec['offset']
+        ).reshape(spec['shape'])
+
+    vectorizer = CompactVectorizer(header, arrays['terms'], arrays.get('idf'))
+    model = CompactNB(header['classes'], arrays['class_log_prior'], arrays['feature_log_prob'])
+    return model, vectorizer
+
+def verify_compact_model(model, vectorizer, compact_model, compact_vectorizer, texts, batch_size=1000):
+    """So sánh dự đoán của mô hình gọn với pipeline gốc.
+
+    Args:
+        model, vectorizer: object - Pipeline gốc
+        compact_model, compact_vectorizer: object - Mô hình gọn đã nạp
+        texts: list - Văn bản đã tiền xử lý dùng để so sánh
+        batch_size: int - Số văn bản mỗi lô
+
+    Returns:
+        dict - {'samples': int, 'label_mismatches': int, 'max_probability_diff': float,
+                'tolerance': float, 'passed': bool}
+    """
+    mismatches = 0
+    max_diff = 0.0
+    for start in range(0, len(texts), batch_size):
+        batch = texts[start:start + batch_size]
+        expected = model.predict_proba(vectorizer.transform(batch))
+        actual = compact_model.predict_proba(compact_vectorizer.transform(batch))
+        mismatches += int(np.sum(expected.argmax(axis=1) != actual.argmax(axis=1)))
+        if len(batch):
+            max_diff = max(max_diff, float(np.abs(expected - actual).max()))
+    tolerance = PROBABILITY_TOLERANCE.get(np.dtype(compact_model.feature_log_prob_.dtype).name, 0.0)
+    return {
+        'samples': len(texts), 'label_mismatches': mismatches, 'max_probability_diff': max_diff,
+        'tolerance': tolerance, 'passed': mismatches == 0 and max_diff <= tolerance
+    }
+
+if __name__ == '__main__':
+    # Xuất mô hình gọn từ pipeline hiện tại và kiểm tra trên toàn bộ tập dữ liệu
+    from config import PIPELINE_PATH, DATA_FILE
+    from naive_bayes import load_pipeline, load_dataset, preprocess_corpus
+
+    model, vectorizer = load_pipeline(PIPELINE_PATH)
+    export_compact_model(model, vectorizer)
+    compact_model, compact_vectorizer = load_compact_model()
+    texts = preprocess_corpus(load_dataset(DATA_FILE)['text'].dropna().tolist())
+    report = verify_compact_model(model, vectorizer, compact_model, compact_vectorizer, texts)
+    logger.info(f"Kết quả kiểm tra mô hình gọn: {report}")
@@ -5,10 +5,28 @@ import os
 MODEL_PATH = 'spam_model.pkl'
 VECTORIZER_PATH = 'vectorizer.pkl'
 PIPELINE_PATH = 'spam_pipeline.pkl'  # Đường dẫn lưu pipeline hoàn chỉnh
+COMPACT_MODEL_PATH = 'spam_model.nbc'  # Mô hình gọn ánh xạ bộ nhớ, xuất từ pipeline (xem compact_model.py)
+# Kiểu số thực của idf và log-xác suất trong mô hình gọn: 'float32' (nhỏ, xác suất lệch tối đa
+# ~1e-6 so với pipeline) hoặc 'float64' (xác suất khớp pipeline tới sai số làm tròn)
+COMPACT_MODEL_DTYPE = os.environ.get('COMPACT_MODEL_DTYPE', 'float32')
+# Định dạng mô hình dùng để phục vụ: 'pickle' (pipeline sklearn) hoặc 'compact' (mô hình gọn, chỉ cần NumPy)
+MODEL_FORMAT = os.environ.get('MODEL_FORMAT', 'pickle')
 
 # Đường dẫn đến file dữ liệu huấn luyện
 DATA_FILE = 'spam_data.csv'
 
+# Kho dữ liệu huấn luyện có chỉ mục (được nạp từ DATA_FILE ở lần chạy đầu tiên)
+DATASET_DB = 'spam_data.db'
+
+# Các mẫu spam phổ biến được thống kê cho dashboard (lưu cùng kho dữ liệu)
+SPAM_PATTERNS = [
+    'khuyến mãi', 'trúng thưởng', 'thanh toán', 'tài khoản', 'cập nhật',
+    'miễn phí', 'giảm giá', 'quà tặng', 'khẩn cấp', 'xác nhận', 'hết hạn'
+]
+
+# Đường dẫn lưu kết quả đánh giá mô hình (dùng cho /api/stats)
+EVALUATION_PATH = 'model_evaluation.json'
+
 # Đường dẫn đến file stopwords
 STOPWORDS_FILE = 'stopwords.txt'
 
@@ -36,3 +54,76 @@ FLASK_CONFIG = {
     'PERMANENT_SESSION_LIFETIME': 86400,  # 24 giờ
     'JSON_AS_ASCII': False  # Đảm bảo JSON không chuyển đổi ký tự Unicode
 }
+
+# Cấu hình bộ tiền xử lý văn bản
+PREPROCESS_CACHE_SIZE = 20000  # Số kết quả tiền xử lý tối đa giữ trong bộ nhớ đệm LRU
+NLTK_OFFLINE = os.environ.get('NLTK_OFFLINE', '0') == '1'  # Không tải tài nguyên NLTK qua mạng
+PREPROCESSED_CORPUS_PATH = 'processed_corpus.npz'  # File lưu văn bản đã tiền xử lý của tập huấn luyện
+# Chiến lược tìm kiếm siêu tham số khi huấn luyện:
+# 'grid' - GridSearchCV đầy đủ, vectorizer được fit lại cho mỗi giá trị alpha
+# 'cached' - GridSearchCV, vectorizer đã fit được lưu đệm và dùng lại cho mọi giá trị alpha
+# 'halving' - HalvingGridSearchCV (successive halving) kết hợp lưu đệm vectorizer
+SEARCH_MODE = os.environ.get('SEARCH_MODE', 'cached')
+SEARCH_CANCEL_CHUNK = 8  # Số ứng viên GridSearchCV đánh giá giữa hai lần báo tiến độ/kiểm tra yêu cầu hủy
+MAX_BATCH_SIZE = 500  # Số email tối đa trong một yêu cầu /analyze_batch
+MAX_BULK_EMAILS = 5000  # Số email tối đa trong một yêu cầu /bulk/*
+
+# Cấu hình Gmail API
+GMAIL_BATCH_SIZE = 100  # Số yêu cầu tối đa trong một batch request (giới hạn của Gmail API là 100)
+GMAIL_BATCH_MODIFY_SIZE = 1000  # Số ID tối đa trong một lời gọi messages.batchModify (giới hạn của Gmail API)
+GMAIL_SERVICE_CACHE_SIZE = 256  # Số Gmail service (mỗi người dùng một service) giữ trong bộ nhớ đệm
+TOKEN_REFRESH_MARGIN = 300  # Làm mới access token khi còn ít hơn số giây này trước khi hết hạn
+EMAIL_STREAM_CHUNK_SIZE = 10  # Số email được lấy và phân loại mỗi lượt khi trả danh sách dạng stream (?stream=1)
+# Chế độ lấy danh sách email mặc định (ghi đè bằng ?mode=):
+# 'full' - lấy toàn bộ nội dung từng email và phân loại theo nội dung
+# 'metadata' - chỉ lấy header và snippet, phân loại tạm thời từ tiêu đề + snippet;
+#              nội dung đầy đủ được lấy qua /emails/<id> khi mở email
+EMAIL_LIST_MODE = os.environ.get('EMAIL_LIST_MODE', 'full')
+# Trường cần lấy khi liệt kê ở chế độ metadata (partial response của Gmail API)
+GMAIL_METADATA_HEADERS = ['Subject', 'From', 'Date']
+GMAIL_METADATA_FIELDS = 'id,labelIds,snippet,payload/headers'
+
+# Giới hạn giải mã nội dung email (chặn CPU/bộ nhớ với bản tin lớn hoặc email nhiều phần)
+EMAIL_BODY_MAX_BYTES = 256 * 1024  # Số byte tối đa được giải mã cho mỗi loại nội dung (text/plain, text/html) của một email
+EMAIL_MIME_MAX_PARTS = 200  # Số phần MIME tối đa được duyệt trong một email
+
+# Cấu hình bộ nhớ đệm kết quả phân loại
+CLASSIFICATION_CACHE_SIZE = 5000  # Số kết quả phân loại tối đa giữ trong bộ nhớ
+# File SQLite lưu kết quả phân loại giữa các lần khởi động/tiến trình (để trống để tắt)
+CLASSIFICATION_CACHE_DB = os.environ.get('CLASSIFICATION_CACHE_DB', 'classification_cache.db')
+CLASSIFICATION_CACHE_DB_MAX_ROWS = 200000  # Số kết quả tối đa giữ trong file SQLite (mọi phiên bản mô hình), dòng cũ nhất bị xóa trước
+CLASSIFICATION_CACHE_PRUNE_INTERVAL = 300  # Số giây tối thiểu giữa hai lần dọn file SQLite của một tiến trình
+
+# Bản sao cục bộ hộp thư Gmail (SQLite), đồng bộ dần qua Gmail history API (để trống để tắt)
+MAILBOX_MIRROR_DB = os.environ.get('MAILBOX_MIRROR_DB', 'mailbox_mirror.db')
+MAILBOX_MIRROR_LABELS = ['INBOX', 'SPAM']  # Các nhãn được sao chép về và đọc từ bản sao
+MAILBOX_SYNC_INTERVAL = 15  # Số giây tối thiểu giữa hai lần hỏi Gmail history API
+MAILBOX_BACKFILL_PAGE_SIZE = 100  # Số email lấy thêm mỗi lần khi đọc tới cuối bản sao
+MAILBOX_LABELS_REFRESH_INTERVAL = 3600  # Số giây giữa hai lần làm mới danh sách thư mục
+MAILBOX_BACKFILL_PAUSE = 0.5  # Số giây nghỉ giữa hai trang khi tải nền toàn bộ nhãn cho tìm kiếm
+
+# Thư mục lưu trạng thái job huấn luyện (dùng chung giữa các worker của serve_prod.py)
+TRAINING_STATE_DIR = 'training_state'
+
+# Tự động phân loại email mới ở luồng nền (auto_triage.py); người dùng bật cho tài khoản qua /auto_triage
+AUTO_TRIAGE_ENABLED = os.environ.get('AUTO_TRIAGE_ENABLED', '0') == '1'  # Server cho phép tính năng này
+AUTO_TRIAGE_INTERVAL = 10  # Số giây giữa hai lần kiểm tra email mới
+AUTO_TRIAGE_THRESHOLD = float(os.environ.get('AUTO_TRIAGE_THRESHOLD', '95'))  # Độ tin cậy spam tối thiểu (%) để chuyển sang SPAM
+AUTO_TRIAGE_BATCH_SIZE = 100  # Số email lấy chi tiết và phân loại mỗi lô
+AUTO_TRIAGE_STATE_DIR = 'auto_triage_state'  # Thư mục lưu credentials và checkpoint (chỉ chủ sở hữu đọc được)
+
+# Cấu hình server production nhiều tiến trình (serve_prod.py)
+PROD_HOST = os.environ.get('PROD_HOST', '0.0.0.0')
+PROD_PORT = int(os.environ.get('PROD_PORT', '5001'))
+PROD_WORKERS = int(os.environ.get('PROD_WORKERS', str(os.cpu_count() or 1)))  # Số worker được fork
+MODEL_RELOAD_INTERVAL = 5  # Số giây giữa các lần master kiểm tra file mô hình đã đổi chưa
+# Số giây tối thiểu giữa hai lần thay toàn bộ worker; các thay đổi mô hình trong khoảng này
+# (ví dụ mỗi lần học từ phản hồi) được gộp vào một lần thay worker
+MODEL_GENERATION_MIN_INTERVAL = int(os.environ.get('MODEL_GENERATION_MIN_INTERVAL', '300'))
+WORKER_MEMORY_REPORT_INTERVAL = 300  # Số giây giữa các lần ghi log bộ nhớ của từng worker
+WORKER_SHUTDOWN_TIMEOUT = 30  # Số giây tối đa chờ request đang xử lý khi dừng một worker
+
+# Chế độ học từ phản hồi người dùng:
+# 'incremental' - cập nhật trực tiếp bộ đếm của mô hình (vài mili giây)
+# 'full' - tạo job huấn luyện lại toàn bộ chạy nền (như /retrain)
+LEARNING_MODE = os.environ.get('LEARNING_MODE', 'incremental')
@@ -0,0 +1,210 @@
+# Thống kê mẫu spam và từ khóa phổ biến, được cập nhật dần theo kho dữ liệu
+import re
+import hashlib
+from collections import Counter, deque
+from config import SPAM_PATTERNS, STOPWORDS_FILE
+from utils import logger
+
+WORD_PATTERN = re.compile(r'\b\w+\b')
+
+class AhoCorasick:
+    """Bộ so khớp nhiều mẫu chuỗi con trong một lần duyệt văn bản.
+
+    Tất cả mẫu được dựng thành một automaton (trie + liên kết thất bại), nên
+    chi phí tìm kiếm tỉ lệ với độ dài văn bản thay vì độ dài văn bản nhân số
+    mẫu. Kết quả giống hệt phép `pattern in text` cho từng mẫu, kể cả khi các
+    mẫu chồng lên nhau.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [set()]
+
+        for index, pattern in enumerate(self.patterns):
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(set())
+                state = next_state
+            self._output[state].add(index)
+
+        # Tính liên kết thất bại theo chiều rộng (BFS)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] |= self._output[self._fail[next_state]]
+
+    def find_all(self, text):
+        """Tìm các mẫu xuất hiện trong văn bản.
+
+        Args:
+            text: str - Văn bản cần tìm
+
+        Returns:
+            set - Chỉ số (trong danh sách patterns) của các mẫu xuất hiện ít nhất một lần
+        """
+        goto, fail, output = self._goto, self._fail, self._output
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found |= output[state]
+                if len(found) == len(self.patterns):
+                    break
+        return found
+
+def _load_stopwords(file_path=STOPWORDS_FILE):
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return set(word.strip() for word in f)
+    except Exception as e:
+        logger.error(f"Lỗi khi đọc file stopwords: {e}")
+        return set()
+
+class CorpusStats:
+    """Bộ đếm thống kê của tập dữ liệu lưu cùng kho SQLite.
+
+    Bảng corpus_stats giữ số mẫu theo nhãn, số email spam chứa từng mẫu
+    spam phổ biến và tần suất từ khóa (đã bỏ stopwords) trong email spam.
+    Các bộ đếm được cộng/trừ trong cùng giao dịch với thao tác thêm hoặc đổi
+    nhãn mẫu, và chỉ dựng lại toàn bộ khi danh sách mẫu, stopwords hoặc cách
+    tách từ thay đổi.
+    """
+
+    def __init__(self, patterns=SPAM_PATTERNS, stopwords_file=STOPWORDS_FILE):
+        self.patterns = list(patterns)
+        self.stopwords = _load_stopwords(stopwords_file)
+        self.matcher = AhoCorasick(self.patterns)
+
+    def signature(self):
+        """Mã nhận diện cấu hình thống kê; khác mã đã lưu thì phải dựng lại."""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(WORD_PATTERN.pattern.encode('utf-8'))
+        for pattern in self.patterns:
+            digest.update(b'\x00p' + pattern.encode('utf-8'))
+        for word in sorted(self.stopwords):
+            digest.update(b'\x00s' + word.encode('utf-8'))
+        return digest.hexdigest()
+
+    def analyze(self, text):
+        """Trích các mẫu spam và từ khóa của một văn bản.
+
+        Args:
+            text: str - Nội dung mẫu
+
+        Returns:
+            tuple - (danh sách mẫu xuất hiện, Counter từ khóa)
+        """
+        text_lower = str(text).lower()
+        patterns = [self.patterns[i] for i in self.matcher.find_all(text_lower)]
+        keywords = Counter(
+            word for word in WORD_PATTERN.findall(text_lower)
+            if len(word) > 2 and word not in self.stopwords
+        )
+        return patterns, keywords
+
+    @staticmethod
+    def ensure_schema(conn):
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS corpus_stats ('
+            'kind TEXT NOT NULL, key TEXT NOT NULL, count INTEGER NOT NULL, '
+            'PRIMARY KEY (kind, key))'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_corpus_stats_count ON corpus_stats (kind, count)')
+        conn.execute('CREATE TABLE IF NOT EXISTS corpus_stats_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+
+    def is_current(self, conn):
+        row = conn.execute("SELECT value FROM corpus_stats_meta WHERE key = 'signature'").fetchone()
+        return row is not None and row[0] == self.signature()
+
+    def apply(self, conn, label, text, sign=1):
+        """Cộng (sign=1) hoặc trừ (sign=-1) đóng góp của một mẫu vào bộ đếm.
+
+        Phải được gọi bên trong giao dịch của thao tác ghi mẫu.
+        """
+        updates = [('label', label, sign)]
+        if label == 'spam':
+            patterns, keywords = self.analyze(text)
+            updates.extend(('pattern', pattern, sign) for pattern in patterns)
+            updates.extend(('keyword', word, sign * count) for word, count in keywords.items())
+
+        conn.executemany(
+            'INSERT INTO corpus_stats (kind, key, count) VALUES (?, ?, ?) '
+            'ON CONFLICT (kind, key) DO UPDATE SET count = count + excluded.count',
+            updates
+        )
+        if sign < 0:
+            # Chỉ xét các khóa vừa giảm, tra theo khóa chính thay vì quét cả bảng
+            conn.executemany(
+                'DELETE FROM corpus_stats WHERE kind = ? AND key = ? AND count <= 0',
+                [(kind, key) for kind, key, _ in updates]
+            )
+
+    def rebuild(self, conn, rows):
+        """Dựng lại toàn bộ bộ đếm trong một lần duyệt dữ liệu.
+
+        Args:
+            conn: sqlite3.Connection - Kết nối đang mở giao dịch
+            rows: iterable - Các cặp (nhãn, nội dung)
+        """
+        label_counts = Counter()
+        pattern_counts = Counter()
+        keyword_counts = Counter()
+        for label, text in rows:
+            label_counts[label] += 1
+            if label == 'spam':
+                patterns, keywords = self.analyze(text)
+                pattern_counts.update(patterns)
+                keyword_counts.update(keywords)
+
+        conn.execute('DELETE FROM corpus_stats')
+        conn.executemany(
+            'INSERT INTO corpus_stats (kind, key, count) VALUES (?, ?, ?)',
+            [('label', key, count) for key, count in label_counts.items()]
+            + [('pattern', key, count) for key, count in pattern_counts.items()]
+            + [('keyword', key, count) for key, count in keyword_counts.items()]
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO corpus_stats_meta (key, value) VALUES ('signature', ?)",
+            (self.signature(),)
+        )
+        logger.info(
+            f"Đã dựng lại thống kê dữ liệu: {sum(label_counts.values())} mẫu, "
+            f"{len(keyword_counts)} từ khóa spam"
+        )
+
+    @staticmethod
+    def read(conn, top_patterns=5, top_keywords=10):
+        """Đọc các bộ đếm đã tính sẵn.
+
+        Returns:
+            dict - {'label_counts': dict, 'spam_patterns': list, 'common_keywords': list}
+        """
+        def top(kind, limit):
+            return conn.execute(
+                'SELECT key, count FROM corpus_stats WHERE kind = ? ORDER BY count DESC, key LIMIT ?',
+                (kind, limit)
+            ).fetchall()
+
+        label_counts = dict(conn.execute("SELECT key, count FROM corpus_stats WHERE kind = 'label'").fetchall())
+        return {
+            'label_counts': label_counts,
+            'spam_patterns': top('pattern', top_patterns),
+            'common_keywords': top('keyword', top_keywords)
+        }
@@ -0,0 +1,254 @@
+# Kho dữ liệu huấn luyện có chỉ mục theo mã băm nội dung
+import os
+import csv
+import time
+import sqlite3
+import hashlib
+import threading
+from config import DATA_FILE, DATASET_DB
+from corpus_stats import CorpusStats
+from utils import logger
+
+def text_hash(text):
+    """Mã băm nội dung dùng làm chỉ mục tìm trùng lặp."""
+    return hashlib.blake2b(text.encode('utf-8', errors='surrogatepass'), digest_size=16).digest()
+
+class DatasetStore:
+    """Kho dữ liệu huấn luyện lưu trong SQLite.
+
+    Mỗi dòng có chỉ mục theo mã băm nội dung nên việc kiểm tra trùng lặp,
+    thêm mới và đổi nhãn đều có chi phí hằng số thay vì đọc/ghi lại cả file
+    CSV. Lần đầu mở, kho được nạp từ file CSV hiện có (giữ nguyên thứ tự và
+    cả các dòng trùng lặp để dữ liệu huấn luyện không thay đổi).
+    """
+
+    def __init__(self, db_path=DATASET_DB, csv_file=DATA_FILE):
+        self.db_path = db_path
+        self.csv_file = csv_file
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+        self.stats = CorpusStats()
+
+    def _connect(self):
+        # Mỗi luồng (và mỗi tiến trình sau khi fork) dùng kết nối riêng
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _ensure_initialized(self):
+        if self._initialized:
+            return self._connect()
+        with self._init_lock:
+            conn = self._connect()
+            if not self._initialized:
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS samples ('
+                    'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                    'text_hash BLOB NOT NULL, label TEXT NOT NULL, text TEXT NOT NULL, '
+                    'updated_at REAL NOT NULL)'
+                )
+                conn.execute('CREATE INDEX IF NOT EXISTS idx_samples_hash ON samples (text_hash)')
+                if conn.execute('SELECT 1 FROM samples LIMIT 1').fetchone() is None:
+                    self._import_csv(conn)
+                self.stats.ensure_schema(conn)
+                if not self.stats.is_current(conn):
+                    self._rebuild_stats(conn)
+                self._initialized = True
+        return conn
+
+    def _import_csv(self, conn):
+        """Nạp dữ liệu từ file CSV vào kho (chỉ chạy khi kho còn trống).
+
+        Nhiều tiến trình có thể cùng mở một kho mới, nên việc kiểm tra kho còn
+        trống được làm lại trong giao dịch ghi: chỉ tiến trình đầu tiên nạp CSV.
+        """
+        if not self.csv_file or not os.path.exists(self.csv_file):
+            return
+        now = time.time()
+        with open(self.csv_file, 'r', encoding='utf-8', newline='') as f:
+            rows = [
+                (text_hash(row['text']), row['label'], row['text'], now)
+                for row in csv.DictReader(f)
+                if row.get('label') and row.get('text')
+            ]
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if conn.execute('SELECT 1 FROM samples LIMIT 1').fetchone() is not None:
+                # Tiến trình khác đã nạp trong lúc đọc file CSV
+                conn.execute('ROLLBACK')
+                return
+            conn.executemany('INSERT INTO samples (text_hash, label, text, updated_at) VALUES (?, ?, ?, ?)', rows)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        logger.info(f"Đã nạp {len(rows)} mẫu từ {self.csv_file} vào kho dữ liệu {self.db_path}")
+
+    def _rebuild_stats(self, conn):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute('SELECT label, text FROM samples')
+            self.stats.rebuild(conn, rows)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def rebuild_stats(self):
+        """Dựng lại toàn bộ thống kê từ dữ liệu hiện có."""
+        self._rebuild_stats(self._ensure_initialized())
+
+    @staticmethod
+    def _find(conn, text):
+        rows = conn.execute(
+            'SELECT id, label, text FROM samples WHERE text_hash = ? ORDER BY id',
+            (text_hash(text),)
+        ).fetchall()
+        # So sánh nội dung để loại trừ va chạm mã băm
+        for sample_id, label, stored_text in rows:
+            if stored_text == text:
+                return sample_id, label
+        return None
+
+    def find(self, text):
+        """Tìm mẫu có nội dung trùng khớp.
+
+        Args:
+            text: str - Nội dung đầy đủ của mẫu
+
+        Returns:
+            tuple|None - (id, nhãn) của mẫu đầu tiên trùng khớp hoặc None
+        """
+        return self._find(self._ensure_initialized(), text)
+
+    def _add(self, conn, label, text):
+        # Phải được gọi bên trong giao dịch
+        existing = self._find(conn, text)
+        if existing is None:
+            cursor = conn.execute(
+                'INSERT INTO samples (text_hash, label, text, updated_at) VALUES (?, ?, ?, ?)',
+                (text_hash(text), label, text, time.time())
+            )
+            self.stats.apply(conn, label, text)
+            return {'status': 'added', 'id': cursor.lastrowid, 'old_label': None}
+        if existing[1] == label:
+            return {'status': 'exists', 'id': existing[0], 'old_label': existing[1]}
+        conn.execute('UPDATE samples SET label = ?, updated_at = ? WHERE id = ?',
+                     (label, time.time(), existing[0]))
+        self.stats.apply(conn, existing[1], text, sign=-1)
+        self.stats.apply(conn, label, text)
+        return {'status': 'relabeled', 'id': existing[0], 'old_label': existing[1]}
+
+    def add(self, label, text):
+        """Thêm mẫu mới hoặc đổi nhãn mẫu đã có.
+
+        Args:
+            label: str - Nhãn (spam/ham)
+            text: str - Nội dung đầy đủ của mẫu
+
+        Returns:
+            dict - {'status': 'added'|'exists'|'relabeled', 'id': int, 'old_label': str|None}
+        """
+        return self.add_many([(label, text)])[0]
+
+    def add_many(self, items):
+        """Thêm/đổi nhãn nhiều mẫu trong một giao dịch.
+
+        Args:
+            items: list - Các cặp (nhãn, nội dung đầy đủ), xử lý theo thứ tự
+
+        Returns:
+            list - Kết quả của từng mẫu (cùng dạng với add)
+        """
+        conn = self._ensure_initialized()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            results = [self._add(conn, label, text) for label, text in items]
+            conn.execute('COMMIT')
+            return results
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def iter_rows(self, batch_size=1000):
+        """Duyệt lần lượt các mẫu theo thứ tự thêm vào.
+
+        Yields:
+            tuple - (id, nhãn, nội dung)
+        """
+        cursor = self._ensure_initialized().execute('SELECT id, label, text FROM samples ORDER BY id')
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+
+    def to_dataframe(self):
+        """Đọc toàn bộ kho thành DataFrame (cột label, text; index là id của mẫu).
+
+        Returns:
+            DataFrame - Dữ liệu huấn luyện
+        """
+        import pandas as pd
+        rows = list(self.iter_rows())
+        return pd.DataFrame(
+            [(label, text) for _, label, text in rows],
+            columns=['label', 'text'],
+            index=pd.Index([sample_id for sample_id, _, _ in rows], name='id')
+        )
+
+    def count(self):
+        """Số mẫu trong kho."""
+        return self._ensure_initialized().execute('SELECT COUNT(*) FROM samples').fetchone()[0]
+
+    def get_stats(self, top_patterns=5, top_keywords=10):
+        """Đọc thống kê đã tính sẵn của tập dữ liệu (không quét lại dữ liệu).
+
+        Args:
+            top_patterns: int - Số mẫu spam phổ biến nhất cần lấy
+            top_keywords: int - Số từ khóa spam phổ biến nhất cần lấy
+
+        Returns:
+            dict - {'training_size': int, 'label_counts': dict,
+                    'spam_patterns': list[(mẫu, số email)], 'common_keywords': list[(từ, số lần)]}
+        """
+        stats = self.stats.read(self._ensure_initialized(), top_patterns, top_keywords)
+        stats['training_size'] = sum(stats['label_counts'].values())
+        return stats
+
+    def export_csv(self, path=None):
+        """Xuất kho dữ liệu ra file CSV (mặc định ghi đè file CSV gốc).
+
+        Args:
+            path: str - Đường dẫn file CSV đích
+
+        Returns:
+            str - Đường dẫn đã ghi
+        """
+        path = path or self.csv_file
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(['label', 'text'])
+            for _, label, text in self.iter_rows():
+                writer.writerow([label, text])
+        os.replace(tmp_path, path)
+        return path
+
+_STORE = None
+_STORE_LOCK = threading.Lock()
+
+def get_dataset_store():
+    """Lấy kho dữ liệu dùng chung của tiến trình."""
+    global _STORE
+    if _STORE is None:
+        with _STORE_LOCK:
+            if _STORE is None:
+                _STORE = DatasetStore()
+    return _STORE
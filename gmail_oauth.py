@@ -1,15 +1,36 @@
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import Flow
 from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.http import HttpRequest
+from google_auth_httplib2 import AuthorizedHttp
 from flask import session
+import httplib2
 import re
 import html
+import json
 import base64
+import codecs
+import hashlib
+import threading
 import traceback
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
 from email.mime.text import MIMEText
-from config import OAUTH_SCOPES, CLIENT_SECRET_FILE, OAUTH_REDIRECT_URI
+from config import (
+    OAUTH_SCOPES, CLIENT_SECRET_FILE, OAUTH_REDIRECT_URI, GMAIL_BATCH_SIZE,
+    GMAIL_SERVICE_CACHE_SIZE, TOKEN_REFRESH_MARGIN, GMAIL_METADATA_HEADERS, GMAIL_METADATA_FIELDS,
+    GMAIL_BATCH_MODIFY_SIZE, EMAIL_BODY_MAX_BYTES, EMAIL_MIME_MAX_PARTS
+)
 from utils import logger
+from classification_cache import CLASSIFICATION_CACHE, message_key, snippet_key
+from mailbox_mirror import MAILBOX_MIRROR, is_mirror_cursor, parse_search_query
+
+FILTER_KEYS = ('classification', 'min_confidence', 'max_confidence')
+MAX_CLASSIFY_CHUNK = 500  # Số email tối đa phân loại trong một lần gọi mô hình khi phân loại bù bản sao
+TEXT_MIME_TYPES = ('text/plain', 'text/html')
+CHARSET_PATTERN = re.compile(r'charset\s*=\s*"?([^";\s]+)', re.IGNORECASE)
 
 def get_oauth_flow():
     """Tạo OAuth flow cho Gmail API.
@@ -80,19 +101,36 @@ def get_credentials_from_session():
         if 'credentials' not in session:
             return None
 
-        credentials_dict = session['credentials']
-        return Credentials(
-            token=credentials_dict['token'],
-            refresh_token=credentials_dict['refresh_token'],
-            token_uri=credentials_dict['token_uri'],
-            client_id=credentials_dict['client_id'],
-            client_secret=credentials_dict['client_secret'],
-            scopes=credentials_dict['scopes']
-        )
+        return credentials_from_dict(session['credentials'])
     except Exception as e:
         logger.error(f"Lỗi khi lấy credentials từ session: {str(e)}")
         return None
 
+def credentials_from_dict(credentials_dict):
+    """Dựng Credentials từ dict đã lưu (session hoặc file trạng thái)."""
+    expiry = credentials_dict.get('expiry')
+    return Credentials(
+        token=credentials_dict['token'],
+        refresh_token=credentials_dict['refresh_token'],
+        token_uri=credentials_dict['token_uri'],
+        client_id=credentials_dict['client_id'],
+        client_secret=credentials_dict['client_secret'],
+        scopes=credentials_dict['scopes'],
+        expiry=datetime.fromisoformat(expiry) if expiry else None
+    )
+
+def credentials_to_dict(credentials):
+    """Chuyển Credentials thành dict có thể lưu dạng JSON."""
+    return {
+        'token': credentials.token,
+        'refresh_token': credentials.refresh_token,
+        'token_uri': credentials.token_uri,
+        'client_id': credentials.client_id,
+        'client_secret': credentials.client_secret,
+        'scopes': credentials.scopes,
+        'expiry': credentials.expiry.isoformat() if credentials.expiry else None
+    }
+
 def save_credentials(credentials):
     """Lưu credentials vào session.
     
@@ -103,21 +141,57 @@ def save_credentials(credentials):
         bool - True nếu thành công, False nếu lỗi
     """
     try:
-        session['credentials'] = {
-            'token': credentials.token,
-            'refresh_token': credentials.refresh_token,
-            'token_uri': credentials.token_uri,
-            'client_id': credentials.client_id,
-            'client_secret': credentials.client_secret,
-            'scopes': credentials.scopes
-        }
+        session['credentials'] = credentials_to_dict(credentials)
         return True
     except Exception as e:
         logger.error(f"Lỗi khi lưu credentials: {str(e)}")
         return False
 
+# Bộ nhớ đệm Gmail service dùng chung cho cả tiến trình: người dùng -> (token, service)
+_SERVICE_CACHE = OrderedDict()
+_SERVICE_CACHE_LOCK = threading.Lock()
+_GMAIL_DISCOVERY_DOC = None
+
+def _get_discovery_doc():
+    """Đọc discovery document của Gmail API đóng gói sẵn trong thư viện (chỉ một lần)."""
+    global _GMAIL_DISCOVERY_DOC
+    if _GMAIL_DISCOVERY_DOC is None:
+        doc = get_static_doc('gmail', 'v1')
+        if doc:
+            _GMAIL_DISCOVERY_DOC = json.loads(doc)
+    return _GMAIL_DISCOVERY_DOC
+
+def _service_cache_key(credentials):
+    """Khóa bộ nhớ đệm theo người dùng (refresh token), không lưu token gốc."""
+    identity = credentials.refresh_token or credentials.token or ''
+    return hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+def _token_expiring(credentials):
+    """Kiểm tra access token đã hết hạn hoặc sắp hết hạn chưa."""
+    if not credentials.token:
+        return True
+    if credentials.expiry is None:
+        return False
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return credentials.expiry - now < timedelta(seconds=TOKEN_REFRESH_MARGIN)
+
+def _build_service(credentials):
+    """Dựng Gmail service từ discovery document có sẵn, không tải qua mạng."""
+    def build_request(http, *args, **kwargs):
+        # httplib2.Http không an toàn luồng nên mỗi request dùng một đối tượng riêng
+        return HttpRequest(AuthorizedHttp(credentials, http=httplib2.Http()), *args, **kwargs)
+
+    authorized_http = AuthorizedHttp(credentials, http=httplib2.Http())
+    doc = _get_discovery_doc()
+    if doc is not None:
+        return build_from_document(doc, http=authorized_http, requestBuilder=build_request)
+    return build('gmail', 'v1', http=authorized_http, requestBuilder=build_request, static_discovery=True)
+
 def get_gmail_service():
     """Tạo và trả về dịch vụ Gmail API.
+
+    Service được lưu đệm theo người dùng và token; chỉ dựng lại khi token
+    thay đổi. Token chỉ được làm mới khi sắp hết hạn.
     
     Returns:
         object|None - Gmail service hoặc None nếu lỗi
@@ -127,94 +201,333 @@ def get_gmail_service():
         if not credentials:
             return None
 
-        if not credentials.valid:
-            if credentials.expired and credentials.refresh_token:
+        if _token_expiring(credentials):
+            if credentials.refresh_token:
                 credentials.refresh(Request())
                 save_credentials(credentials)
-            else:
+            elif not credentials.valid:
                 return None
 
-        return build('gmail', 'v1', credentials=credentials)
+        key = _service_cache_key(credentials)
+        with _SERVICE_CACHE_LOCK:
+            entry = _SERVICE_CACHE.get(key)
+            if entry is not None and entry[0] == credentials.token:
+                _SERVICE_CACHE.move_to_end(key)
+                return entry[1]
+
+        service = _build_service(credentials)
+        with _SERVICE_CACHE_LOCK:
+            _SERVICE_CACHE[key] = (credentials.token, service)
+            _SERVICE_CACHE.move_to_end(key)
+            while len(_SERVICE_CACHE) > GMAIL_SERVICE_CACHE_SIZE:
+                _SERVICE_CACHE.popitem(last=False)
+        return service
     except Exception as e:
         logger.error(f"Lỗi khi tạo Gmail service: {str(e)}")
         return None
 
-def get_emails(service, max_results=20, query=None, page_token=None, label_ids=['INBOX']):
-    """Lấy danh sách email từ Gmail API."""
+def get_background_service(credentials):
+    """Tạo Gmail service cho tác vụ chạy nền (không có session của người dùng).
+
+    Args:
+        credentials: Credentials - Credentials đã lưu của người dùng
+
+    Returns:
+        tuple - (Gmail service, bool token có được làm mới không)
+    """
+    refreshed = False
+    if _token_expiring(credentials):
+        if not credentials.refresh_token:
+            raise ValueError('Access token đã hết hạn và không có refresh token')
+        credentials.refresh(Request())
+        refreshed = True
+    return _build_service(credentials), refreshed
+
+def invalidate_gmail_service():
+    """Xóa Gmail service của người dùng hiện tại khỏi bộ nhớ đệm (khi đăng xuất)."""
+    credentials = get_credentials_from_session()
+    if not credentials:
+        return
+    with _SERVICE_CACHE_LOCK:
+        _SERVICE_CACHE.pop(_service_cache_key(credentials), None)
+
+def build_email_data(message_id, msg, metadata_only=False):
+    """Trích thông tin hiển thị và nội dung dùng để phân loại của một email.
+
+    Args:
+        message_id: str - ID email
+        msg: dict - Dữ liệu email từ Gmail API
+        metadata_only: bool - msg chỉ có header và snippet (format=metadata)
+
+    Returns:
+        tuple - (dict thông tin email, str nội dung dùng để phân loại)
+    """
+    # Lấy thông tin cơ bản
+    headers = msg['payload']['headers']
+    subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), 'No Subject')
+    sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), 'Unknown')
+    date = next((h['value'] for h in headers if h['name'].lower() == 'date'), '')
+    # Snippet của Gmail đã được escape HTML
+    snippet = html.unescape(msg.get('snippet', ''))
+
+    # Kiểm tra trạng thái đã đọc
+    read = 'UNREAD' not in msg.get('labelIds', [])
+
+    if metadata_only:
+        # Chưa có nội dung: phân loại tạm thời từ snippet, nội dung được lấy khi mở email
+        content, plain_content = '', ''
+        content_for_classification = snippet
+    else:
+        # Lấy nội dung email
+        content, plain_content = get_email_content(msg)
+        # Sử dụng plain_content cho phân loại nếu có, nếu không thì sử dụng content
+        content_for_classification = plain_content if plain_content else strip_html_tags(content)
+
+    # Tạo đối tượng email
+    email_data = {
+        'id': message_id,
+        'subject': subject,
+        'sender': sender,
+        'date': date,
+        'snippet': snippet,
+        'content': content,
+        'plain_content': plain_content,
+        'read': read,
+        'provisional': metadata_only
+    }
+    return email_data, content_for_classification
+
+def _mirror_account(service, page_token=None, label_ids=None):
+    """Đồng bộ bản sao hộp thư nếu yêu cầu có thể được đọc từ bản sao.
+
+    Returns:
+        str|None - Tài khoản của bản sao, None nếu phải đọc trực tiếp từ Gmail
+    """
+    if not MAILBOX_MIRROR.enabled:
+        return None
+    if label_ids is not None and (len(label_ids) != 1 or label_ids[0] not in MAILBOX_MIRROR.labels):
+        return None
+    if page_token and not is_mirror_cursor(page_token):
+        return None
     try:
-        # Import ở đây để tránh import vòng
-        from app import initialize_model
-        model, vectorizer = initialize_model()
+        return MAILBOX_MIRROR.sync(service)
+    except Exception as e:
+        if page_token:
+            # Token của bản sao không dùng được với Gmail
+            raise
+        logger.warning(f"Không thể đồng bộ bản sao hộp thư, đọc trực tiếp từ Gmail: {str(e)}")
+        return None
 
-        # Xây dựng truy vấn
-        search_query = query if query else ''
+def _mirror_email_data(message, metadata_only=False):
+    """Dựng dict email (cùng dạng với build_email_data) từ email trong bản sao."""
+    return {
+        'id': message['id'],
+        'subject': message['subject'],
+        'sender': message['sender'],
+        'date': message['date'],
+        'snippet': message['snippet'],
+        'content': '' if metadata_only else message['content'],
+        'plain_content': '' if metadata_only else message['plain_content'],
+        'read': message['read'],
+        # Bản sao đã có nội dung đầy đủ nên kết quả phân loại không còn là tạm thời
+        'provisional': False
+    }
 
-        # Thực hiện tìm kiếm
-        results = service.users().messages().list(
-            userId='me',
-            labelIds=label_ids,
-            q=search_query,
-            maxResults=max_results,
-            pageToken=page_token
-        ).execute()
+def _has_filters(filters):
+    return bool(filters) and any(filters.get(key) is not None for key in FILTER_KEYS)
 
-        messages = results.get('messages', [])
-        emails = []
+def matches_filters(email_data, filters):
+    """Kiểm tra email đã phân loại có thỏa bộ lọc phân loại/độ tin cậy không.
 
-        for message in messages:
-            try:
-                # Lấy thông tin chi tiết của email
-                msg = service.users().messages().get(userId='me', id=message['id']).execute()
-
-                # Lấy thông tin cơ bản
-                headers = msg['payload']['headers']
-                subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), 'No Subject')
-                sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), 'Unknown')
-                date = next((h['value'] for h in headers if h['name'].lower() == 'date'), '')
-
-                # Lấy nội dung email
-                content, plain_content = get_email_content(msg)
-
-                # Kiểm tra trạng thái đã đọc
-                read = 'UNREAD' not in msg.get('labelIds', [])
-
-                # Tạo đối tượng email
-                email_data = {
-                    'id': message['id'],
-                    'subject': subject,
-                    'sender': sender,
-                    'date': date,
-                    'content': content,
-                    'plain_content': plain_content,
-                    'read': read
-                }
-
-                # Phân loại email
-                try:
-                    # Sử dụng plain_content cho phân loại nếu có, nếu không thì sử dụng content
-                    content_for_classification = plain_content if plain_content else strip_html_tags(content)
-                    result = classify_email(model, vectorizer, content_for_classification, email_data['subject'])
-                    email_data.update(result)
-
-                    # Đã xóa logic tự động di chuyển email spam có độ tin cậy cao
-                except Exception as e:
-                    print(f"Lỗi khi phân loại email {email_data['id']}: {str(e)}")
-                    traceback.print_exc()
-                    email_data.update({
-                        'classification': 'unknown',
-                        'confidence': 0
-                    })
+    Args:
+        email_data: dict - Email đã có 'classification' và 'confidence'
+        filters: dict - 'classification' (spam/ham), 'min_confidence' (>=), 'max_confidence' (<)
+    """
+    if not filters:
+        return True
+    if filters.get('classification') is not None and email_data.get('classification') != filters['classification']:
+        return False
+    confidence = email_data.get('confidence', 0)
+    if filters.get('min_confidence') is not None and confidence < filters['min_confidence']:
+        return False
+    if filters.get('max_confidence') is not None and confidence >= filters['max_confidence']:
+        return False
+    return True
+
+def _classify_mirror_messages(account, model, vectorizer, version, emails, messages):
+    """Gắn kết quả phân loại cho các email đọc từ bản sao, chỉ chạy mô hình cho email chưa có kết quả."""
+    pending = []
+    for email_data, message in zip(emails, messages):
+        if message['classification'] is not None and message['model_version'] == version:
+            email_data.update(message['classification'])
+        else:
+            pending.append((email_data, message['text']))
+    if pending:
+        results = classify_page(model, vectorizer, [p[0] for p in pending], [p[1] for p in pending])
+        MAILBOX_MIRROR.save_classifications(account, results, version)
+
+def _iter_mirror_emails(service, account, model, vectorizer, max_results, page_token, label_id, chunk_size,
+                        metadata_only, match=None, filters=None):
+    """Giống iter_emails nhưng đọc từ bản sao; chỉ phân loại các email chưa có kết quả của mô hình hiện tại.
+
+    Khi có match (biểu thức tìm kiếm) hoặc bộ lọc, email được tìm bằng chỉ mục
+    toàn văn của bản sao thay vì liệt kê theo nhãn.
+    """
+    from naive_bayes import get_model_version
+    version = get_model_version(model, vectorizer)
+    if match is None and not _has_filters(filters):
+        messages, next_page_token = MAILBOX_MIRROR.list_messages(service, account, label_id, max_results, page_token)
+    else:
+        if _has_filters(filters):
+            # Bộ lọc theo kết quả phân loại cần mọi email của nhãn đã được phân loại
+            # bằng mô hình hiện tại (chỉ tốn chi phí một lần cho mỗi phiên bản mô hình)
+            stale = MAILBOX_MIRROR.unclassified(account, label_id, version)
+            for start in range(0, len(stale), MAX_CLASSIFY_CHUNK):
+                chunk = stale[start:start + MAX_CLASSIFY_CHUNK]
+                _classify_mirror_messages(account, model, vectorizer, version,
+                                          [_mirror_email_data(message) for message in chunk], chunk)
+        messages, next_page_token = MAILBOX_MIRROR.search(account, label_id, match, max_results, page_token,
+                                                          filters, version)
+    chunk_size = max(1, chunk_size or len(messages) or 1)
+    count = 0
+
+    for start in range(0, len(messages), chunk_size):
+        chunk = messages[start:start + chunk_size]
+        emails = [_mirror_email_data(message, metadata_only) for message in chunk]
+        _classify_mirror_messages(account, model, vectorizer, version, emails, chunk)
+        for email_data in emails:
+            count += 1
+            yield 'email', email_data
+
+    yield 'end', {'nextPageToken': next_page_token, 'count': count}
+
+def _mirror_search(service, account, query, page_token, label_id, filters):
+    """Kiểm tra truy vấn/bộ lọc có trả lời được từ bản sao không.
+
+    Returns:
+        tuple - (có dùng bản sao không, biểu thức MATCH hoặc None)
+    """
+    if not query and not _has_filters(filters):
+        return True, None
+    match = parse_search_query(query) if query else None
+    if query and match is None:
+        return False, None
+    if is_mirror_cursor(page_token):
+        return True, match
+    if not MAILBOX_MIRROR.search_enabled:
+        return False, None
+    # Chỉ tìm trên bản sao khi bản sao có đủ email của nhãn; nếu chưa, tải nền và dùng Gmail cho lần này
+    return MAILBOX_MIRROR.request_backfill(service, account, label_id), match
+
+def iter_emails(service, max_results=20, query=None, page_token=None, label_ids=['INBOX'], chunk_size=None,
+                metadata_only=False, filters=None):
+    """Lấy và phân loại một trang email theo từng lượt nhỏ.
+
+    Danh sách ID được lấy một lần, sau đó mỗi lượt lấy chi tiết (một batch
+    request), phân loại và trả ra tối đa chunk_size email rồi mới sang lượt
+    kế tiếp. Người gọi nhận được email đầu tiên mà không phải chờ cả trang,
+    và chỉ một lượt email (kể cả nội dung HTML) được giữ trong bộ nhớ.
+
+    Args:
+        service: object - Gmail service
+        max_results: int - Số email tối đa của trang
+        query: str - Truy vấn tìm kiếm Gmail
+        page_token: str - Token của trang cần lấy
+        label_ids: list - Nhãn cần lọc
+        chunk_size: int - Số email mỗi lượt (None: cả trang trong một lượt)
+        metadata_only: bool - Chỉ lấy header và snippet (partial response), kết quả
+            phân loại là tạm thời (provisional) cho tới khi email được mở
+        filters: dict - Bộ lọc kết quả phân loại (xem matches_filters)
+
+    Yields:
+        tuple - ('email', dict email đã phân loại) cho từng email, cuối cùng là
+        ('end', {'nextPageToken': str|None, 'count': int})
+    """
+    # Import ở đây để tránh import vòng
+    from app import initialize_model
+    model, vectorizer = initialize_model()
+
+    # Danh sách và tìm kiếm trong nhãn đang được sao chép được trả lời từ bản sao cục bộ
+    account = _mirror_account(service, page_token, label_ids)
+    if account is not None:
+        use_mirror, match = _mirror_search(service, account, query, page_token, label_ids[0], filters)
+        if use_mirror:
+            yield from _iter_mirror_emails(service, account, model, vectorizer, max_results, page_token,
+                                           label_ids[0], chunk_size, metadata_only, match, filters)
+            return
+
+    # Xây dựng truy vấn
+    search_query = query if query else ''
+
+    # Thực hiện tìm kiếm
+    results = service.users().messages().list(
+        userId='me',
+        labelIds=label_ids,
+        q=search_query,
+        maxResults=max_results,
+        pageToken=page_token
+    ).execute()
 
+    message_ids = [message['id'] for message in results.get('messages', [])]
+    chunk_size = max(1, min(chunk_size or len(message_ids) or 1, GMAIL_BATCH_SIZE))
+    count = 0
+    if metadata_only:
+        get_kwargs = {'format': 'metadata', 'metadataHeaders': GMAIL_METADATA_HEADERS, 'fields': GMAIL_METADATA_FIELDS}
+        key_fn = snippet_key
+    else:
+        get_kwargs = {}
+        key_fn = message_key
+
+    for start in range(0, len(message_ids), chunk_size):
+        chunk = message_ids[start:start + chunk_size]
+        # Lấy chi tiết các email của lượt bằng một batch request
+        details = fetch_messages(service, chunk, **get_kwargs)
+
+        emails = []
+        classification_inputs = []
+        for message_id in chunk:
+            try:
+                msg = details.get(message_id)
+                if msg is None:
+                    continue
+                email_data, content_for_classification = build_email_data(message_id, msg, metadata_only)
+                classification_inputs.append(content_for_classification)
                 emails.append(email_data)
             except Exception as e:
-                print(f"Lỗi xử lý email {message['id']}: {str(e)}")
-                traceback.print_exc()
+                logger.exception(f"Lỗi xử lý email {message_id}: {str(e)}")
+                continue
+        details = None
+
+        # Phân loại cả lượt email trong một lần gọi mô hình
+        classify_page(model, vectorizer, emails, classification_inputs, key_fn=key_fn)
+        for email_data in emails:
+            # Gmail không lọc được theo kết quả phân loại nên lọc sau khi phân loại
+            if not matches_filters(email_data, filters):
                 continue
+            count += 1
+            yield 'email', email_data
+
+    yield 'end', {'nextPageToken': results.get('nextPageToken'), 'count': count}
+
+def get_emails(service, max_results=20, query=None, page_token=None, label_ids=['INBOX'], metadata_only=False,
+               filters=None):
+    """Lấy danh sách email từ Gmail API."""
+    try:
+        emails = []
+        next_page_token = None
+        # Cả trang được lấy và phân loại trong một lượt
+        for kind, payload in iter_emails(service, max_results, query, page_token, label_ids,
+                                         metadata_only=metadata_only, filters=filters):
+            if kind == 'email':
+                emails.append(payload)
+            else:
+                next_page_token = payload['nextPageToken']
+        # Đã xóa logic tự động di chuyển email spam có độ tin cậy cao
 
         # Trả về danh sách email cùng với nextPageToken cho phân trang
         return {
             'emails': emails,
-            'nextPageToken': results.get('nextPageToken')
+            'nextPageToken': next_page_token
         }
     except Exception as e:
         print(f"Lỗi chung khi lấy danh sách email: {str(e)}")
@@ -225,44 +538,378 @@ def get_emails(service, max_results=20, query=None, page_token=None, label_ids=[
             'error': str(e)
         }
 
-def get_email_content(msg):
-    """Lấy nội dung email từ đối tượng email."""
-    html_content = ""
-    plain_content = ""
-
-    if 'parts' in msg['payload']:
-        for part in msg['payload']['parts']:
-            if part['mimeType'] == 'text/plain':
-                if 'data' in part['body']:
-                    plain_content = decode_base64(part['body']['data'])
-            elif part['mimeType'] == 'text/html':
-                if 'data' in part['body']:
-                    html_content = decode_base64(part['body']['data'])
-            elif 'parts' in part:
-                # Xử lý các phần lồng nhau
-                for subpart in part['parts']:
-                    if subpart['mimeType'] == 'text/plain':
-                        if 'data' in subpart['body']:
-                            plain_content = decode_base64(subpart['body']['data'])
-                    elif subpart['mimeType'] == 'text/html':
-                        if 'data' in subpart['body']:
-                            html_content = decode_base64(subpart['body']['data'])
-    elif 'body' in msg['payload'] and 'data' in msg['payload']['body']:
-        # Email đơn giản không có phần
-        if msg['payload']['mimeType'] == 'text/plain':
-            plain_content = decode_base64(msg['payload']['body']['data'])
-        elif msg['payload']['mimeType'] == 'text/html':
-            html_content = decode_base64(msg['payload']['body']['data'])
+def get_email_body(service, email_id):
+    """Lấy nội dung đầy đủ của một email và phân loại chính thức theo nội dung.
+
+    Dùng khi mở một email từ danh sách ở chế độ metadata: kết quả thay thế
+    kết quả tạm thời tính từ snippet.
+
+    Args:
+        service: object - Gmail service
+        email_id: str - ID email
+
+    Returns:
+        dict - Thông tin email kèm kết quả phân loại, hoặc {'error': str}
+    """
+    try:
+        # Import ở đây để tránh import vòng
+        from app import initialize_model
+        snapshot = initialize_model()
+
+        account = _mirror_account(service)
+        message = MAILBOX_MIRROR.get_message(account, email_id) if account is not None else None
+        if message is not None:
+            email_data, content_for_classification = _mirror_email_data(message), message['text']
+        else:
+            msg = service.users().messages().get(userId='me', id=email_id).execute()
+            email_data, content_for_classification = build_email_data(email_id, msg)
+
+        # Email đang mở cần cả phần giải thích (từ khóa); kết quả đệm từ màn hình
+        # danh sách không có khóa 'top_keywords' nên được tính lại (danh sách rỗng
+        # là giải thích hợp lệ, không tính lại)
+        key = message_key(email_id)
+        result = CLASSIFICATION_CACHE.get(key, snapshot.version)
+        if result is None or 'top_keywords' not in result:
+            result = classify_email(snapshot.model, snapshot.vectorizer, content_for_classification,
+                                    email_data['subject'], explain=True)
+            CLASSIFICATION_CACHE.put(key, result, snapshot.version)
+        email_data.update(result)
+        return email_data
+    except Exception as e:
+        logger.error(f"Lỗi khi lấy nội dung email {email_id}: {str(e)}")
+        return {'error': str(e)}
 
+def _run_batched(service, make_request, message_ids, batch_size=GMAIL_BATCH_SIZE):
+    """Thực hiện một yêu cầu cho mỗi email, gom thành các Gmail batch request.
+
+    Args:
+        service: object - Gmail service
+        make_request: callable - Hàm (ID email) -> HttpRequest chưa thực hiện
+        message_ids: list - Danh sách ID email (không trùng lặp)
+        batch_size: int - Số yêu cầu tối đa trong một batch
+
+    Returns:
+        tuple - (dict ID -> phản hồi, dict ID -> lỗi)
+    """
+    responses = {}
+    errors = {}
+    batch_size = max(1, min(batch_size, GMAIL_BATCH_SIZE))
+
+    def run_one(message_id):
+        try:
+            responses[message_id] = make_request(message_id).execute()
+            errors.pop(message_id, None)
+        except Exception as e:
+            errors[message_id] = e
+
+    def callback(request_id, response, exception):
+        if exception is not None:
+            errors[request_id] = exception
+        else:
+            responses[request_id] = response
+
+    for start in range(0, len(message_ids), batch_size):
+        chunk = message_ids[start:start + batch_size]
+        try:
+            batch = service.new_batch_http_request(callback=callback)
+            for message_id in chunk:
+                batch.add(make_request(message_id), request_id=message_id)
+            batch.execute()
+        except Exception as e:
+            # Cả batch thất bại: thử lại từng yêu cầu chưa có kết quả
+            logger.warning(f"Lỗi batch request, chuyển sang thực hiện từng yêu cầu: {str(e)}")
+            for message_id in chunk:
+                if message_id not in responses:
+                    run_one(message_id)
+
+    return responses, errors
+
+def fetch_messages(service, message_ids, batch_size=GMAIL_BATCH_SIZE, **get_kwargs):
+    """Lấy chi tiết nhiều email bằng Gmail batch request.
+
+    Các yêu cầu messages().get được gom thành từng batch (tối đa batch_size
+    yêu cầu), nên số round trip tỷ lệ với số batch thay vì số email. Lỗi
+    được xử lý riêng cho từng email: email lỗi bị bỏ qua, các email còn lại
+    vẫn được trả về.
+
+    Args:
+        service: object - Gmail service
+        message_ids: list - Danh sách ID email
+        batch_size: int - Số yêu cầu tối đa trong một batch
+        **get_kwargs: Tham số bổ sung cho messages().get (ví dụ format, fields)
+
+    Returns:
+        dict - Ánh xạ ID email -> dữ liệu email đã lấy được
+    """
+    # Loại bỏ ID trùng vì request_id trong một batch phải là duy nhất
+    message_ids = list(dict.fromkeys(message_ids))
+    if not message_ids:
+        return {}
+
+    messages_api = service.users().messages()
+    fetched, errors = _run_batched(
+        service, lambda message_id: messages_api.get(userId='me', id=message_id, **get_kwargs),
+        message_ids, batch_size
+    )
+    for message_id, error in errors.items():
+        logger.warning(f"Lỗi khi lấy email {message_id}: {str(error)}")
+    return fetched
+
+def modify_messages(service, message_ids, add_label_ids=None, remove_label_ids=None):
+    """Đổi nhãn nhiều email bằng messages.batchModify.
+
+    Mỗi lời gọi batchModify xử lý tối đa GMAIL_BATCH_MODIFY_SIZE ID và thành
+    công/thất bại cho cả nhóm. Khi một nhóm thất bại (ví dụ có ID không tồn
+    tại), các ID của nhóm được đổi nhãn lại từng cái qua batch request để biết
+    chính xác email nào lỗi.
+
+    Args:
+        service: object - Gmail service
+        message_ids: list - Danh sách ID email
+        add_label_ids: list - Nhãn cần thêm
+        remove_label_ids: list - Nhãn cần bỏ
+
+    Returns:
+        dict - ID email -> {'success': bool, 'error': str (nếu lỗi)}
+    """
+    message_ids = list(dict.fromkeys(message_ids))
+    results = {}
+    body = {}
+    if add_label_ids:
+        body['addLabelIds'] = list(add_label_ids)
+    if remove_label_ids:
+        body['removeLabelIds'] = list(remove_label_ids)
+
+    messages_api = service.users().messages()
+    for start in range(0, len(message_ids), GMAIL_BATCH_MODIFY_SIZE):
+        chunk = message_ids[start:start + GMAIL_BATCH_MODIFY_SIZE]
+        try:
+            messages_api.batchModify(userId='me', body=dict(body, ids=chunk)).execute()
+            results.update((message_id, {'success': True}) for message_id in chunk)
+        except Exception as e:
+            logger.warning(f"batchModify thất bại cho {len(chunk)} email ({str(e)}), đổi nhãn từng email")
+            modified, errors = _run_batched(
+                service, lambda message_id: messages_api.modify(userId='me', id=message_id, body=body), chunk
+            )
+            for message_id in chunk:
+                if message_id in modified:
+                    results[message_id] = {'success': True}
+                else:
+                    logger.error(f"Lỗi khi đổi nhãn email {message_id}: {str(errors.get(message_id))}")
+                    results[message_id] = {'success': False, 'error': str(errors.get(message_id))}
+
+    if any(result['success'] for result in results.values()):
+        MAILBOX_MIRROR.mark_stale(service)
+    return results
+
+def trash_messages(service, message_ids):
+    """Chuyển nhiều email vào thùng rác bằng Gmail batch request (không có batchTrash).
+
+    Returns:
+        dict - ID email -> {'success': bool, 'error': str (nếu lỗi)}
+    """
+    message_ids = list(dict.fromkeys(message_ids))
+    if not message_ids:
+        return {}
+
+    messages_api = service.users().messages()
+    trashed, errors = _run_batched(
+        service, lambda message_id: messages_api.trash(userId='me', id=message_id), message_ids
+    )
+    results = {}
+    for message_id in message_ids:
+        if message_id in trashed:
+            results[message_id] = {'success': True}
+        else:
+            logger.warning(f"Lỗi khi xóa email {message_id}: {str(errors.get(message_id))}")
+            results[message_id] = {'success': False, 'error': str(errors.get(message_id))}
+
+    if trashed:
+        MAILBOX_MIRROR.mark_stale(service)
+    return results
+
+def classify_page(model, vectorizer, emails, contents, key_fn=message_key):
+    """Phân loại một danh sách email theo lô và cập nhật kết quả vào từng email.
+
+    Kết quả được lưu đệm theo ID email và phiên bản mô hình nên các lần tải
+    lại trang không cần chạy lại mô hình. Nếu phân loại theo lô thất bại,
+    từng email được phân loại riêng để một email lỗi không làm hỏng cả trang.
+
+    Args:
+        model: object - Mô hình đã huấn luyện
+        vectorizer: object - Vectorizer đã huấn luyện
+        emails: list - Danh sách email (dict có 'id' và 'subject')
+        contents: list - Nội dung dùng để phân loại, tương ứng với emails
+        key_fn: callable - Hàm tạo khóa bộ nhớ đệm từ ID email
+
+    Returns:
+        dict - ID email -> kết quả phân loại (không gồm các email phân loại lỗi)
+    """
+    if not emails:
+        return {}
+    from naive_bayes import get_model_version
+    version = get_model_version(model, vectorizer)
+    keys = [key_fn(email_data['id']) for email_data in emails]
+    cached = CLASSIFICATION_CACHE.get_many(keys, version)
+
+    pending = []
+    classified = {}
+    for email_data, content, key in zip(emails, contents, keys):
+        if key in cached:
+            email_data.update(cached[key])
+            classified[email_data['id']] = cached[key]
+        else:
+            pending.append((email_data, content, key))
+    if not pending:
+        return classified
+
+    new_results = {}
+    try:
+        # Màn hình danh sách không hiển thị từ khóa nên bỏ qua phần giải thích
+        results = classify_emails(model, vectorizer, [p[1] for p in pending],
+                                  [p[0]['subject'] for p in pending], explain=False)
+        for (email_data, _, key), result in zip(pending, results):
+            email_data.update(result)
+            new_results[key] = result
+            classified[email_data['id']] = result
+    except Exception as e:
+        logger.exception(f"Lỗi khi phân loại lô email, chuyển sang phân loại từng email: {str(e)}")
+
+        for email_data, content, key in pending:
+            try:
+                result = classify_email(model, vectorizer, content, email_data['subject'], explain=False)
+                email_data.update(result)
+                new_results[key] = result
+                classified[email_data['id']] = result
+            except Exception as e:
+                logger.exception(f"Lỗi khi phân loại email {email_data['id']}: {str(e)}")
+                email_data.update({
+                    'classification': 'unknown',
+                    'confidence': 0
+                })
+
+    CLASSIFICATION_CACHE.put_many(new_results, version)
+    return classified
+
+def _part_header(part, name):
+    """Giá trị header của một phần MIME (rỗng nếu không có)."""
+    name = name.lower()
+    return next((h['value'] for h in part.get('headers', []) if h['name'].lower() == name), '')
+
+def _part_charset(part):
+    """Bảng mã khai báo trong Content-Type của phần MIME (mặc định utf-8)."""
+    match = CHARSET_PATTERN.search(_part_header(part, 'Content-Type'))
+    if match:
+        try:
+            return codecs.lookup(match.group(1)).name
+        except LookupError:
+            logger.debug(f"Bảng mã không hỗ trợ: {match.group(1)}, dùng utf-8")
+    return 'utf-8'
+
+def _is_attachment(part):
+    """Phần MIME là file đính kèm (có tên file, attachmentId hoặc Content-Disposition: attachment)."""
+    if part.get('filename') or part.get('body', {}).get('attachmentId'):
+        return True
+    return _part_header(part, 'Content-Disposition').strip().lower().startswith('attachment')
+
+def iter_text_parts(payload, max_parts=EMAIL_MIME_MAX_PARTS):
+    """Duyệt cây MIME (không đệ quy, mọi độ sâu) và trả ra các phần văn bản theo thứ tự xuất hiện.
+
+    File đính kèm và phần không phải text/plain, text/html bị bỏ qua mà không giải mã.
+
+    Args:
+        payload: dict - msg['payload'] từ Gmail API
+        max_parts: int - Số phần MIME tối đa được duyệt
+
+    Yields:
+        tuple - (mime type, phần MIME có body.data)
+    """
+    stack = [payload]
+    visited = 0
+    while stack:
+        if visited >= max_parts:
+            logger.debug(f"Email có hơn {max_parts} phần MIME, bỏ qua các phần còn lại")
+            return
+        part = stack.pop()
+        visited += 1
+        children = part.get('parts')
+        if children:
+            # Đảo ngược để phần đầu tiên được lấy ra trước
+            stack.extend(reversed(children))
+            continue
+        mime_type = part.get('mimeType', '').lower()
+        if mime_type in TEXT_MIME_TYPES and part.get('body', {}).get('data') and not _is_attachment(part):
+            yield mime_type, part
+
+def decode_body(data, charset='utf-8', max_bytes=None):
+    """Giải mã body base64url của Gmail API, chỉ giải mã tối đa max_bytes byte đầu.
+
+    Args:
+        data: str - body.data (base64url, có thể thiếu padding)
+        charset: str - Bảng mã của nội dung
+        max_bytes: int - Số byte tối đa cần giải mã (None: toàn bộ)
+
+    Returns:
+        tuple - (str nội dung, int số byte đã giải mã, bool nội dung có bị cắt không)
+    """
+    truncated = False
+    if max_bytes is not None:
+        # 4 ký tự base64 ứng với 3 byte nên chỉ cần cắt phần đầu của chuỗi trước khi giải mã
+        limit = -(-max_bytes // 3) * 4
+        truncated = len(data) > limit
+        data = data[:limit]
+    raw = base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+    if max_bytes is not None and len(raw) > max_bytes:
+        raw = raw[:max_bytes]
+        truncated = True
+    # Bộ giải mã tăng dần bỏ ký tự nhiều byte bị cắt dở ở cuối thay vì thêm ký tự lỗi
+    decoder = codecs.getincrementaldecoder(charset)(errors='replace')
+    return decoder.decode(raw, final=not truncated), len(raw), truncated
+
+def get_email_content(msg, max_bytes=EMAIL_BODY_MAX_BYTES):
+    """Lấy nội dung email từ đối tượng email.
+
+    Mọi phần text/plain (và text/html) được nối theo thứ tự thay vì phần sau
+    ghi đè phần trước. Mỗi loại nội dung chỉ giải mã tối đa max_bytes byte,
+    phần vượt ngân sách bị cắt hoặc bỏ qua.
+
+    Args:
+        msg: dict - Dữ liệu email từ Gmail API (format=full)
+        max_bytes: int - Ngân sách byte giải mã cho mỗi loại nội dung
+
+    Returns:
+        tuple - (nội dung hiển thị (ưu tiên HTML), nội dung văn bản thuần)
+    """
+    budgets = {mime_type: max_bytes for mime_type in TEXT_MIME_TYPES}
+    texts = {mime_type: [] for mime_type in TEXT_MIME_TYPES}
+    truncated = False
+
+    for mime_type, part in iter_text_parts(msg.get('payload', {})):
+        if budgets[mime_type] <= 0:
+            truncated = True
+            continue
+        try:
+            text, used, part_truncated = decode_body(part['body']['data'], _part_charset(part), budgets[mime_type])
+        except Exception as e:
+            logger.warning(f"Lỗi khi giải mã phần {mime_type} của email {msg.get('id')}: {str(e)}")
+            continue
+        budgets[mime_type] -= used
+        truncated = truncated or part_truncated
+        texts[mime_type].append(text)
+
+    if truncated:
+        logger.debug(f"Nội dung email {msg.get('id')} vượt {max_bytes} byte, chỉ giải mã phần đầu")
+
+    html_content = '\n'.join(texts['text/html'])
+    plain_content = '\n'.join(texts['text/plain'])
     # Ưu tiên nội dung HTML
     if html_content:
         return html_content, plain_content
     return plain_content, plain_content
 
-def decode_base64(data):
+def decode_base64(data, charset='utf-8', max_bytes=None):
     """Giải mã chuỗi base64 từ Gmail API."""
-    import base64
-    return base64.urlsafe_b64decode(data.encode('ASCII')).decode('utf-8', errors='replace')
+    return decode_body(data, charset, max_bytes)[0]
 
 def strip_html_tags(html_content):
     """Loại bỏ các thẻ HTML từ nội dung."""
@@ -299,6 +946,7 @@ def move_to_spam(service, email_id):
             id=email_id,
             body={'addLabelIds': ['SPAM'], 'removeLabelIds': ['INBOX']}
         ).execute()
+        MAILBOX_MIRROR.mark_stale(service)
         return True
     except Exception as e:
         print(f"Lỗi khi chuyển email vào spam: {str(e)}")
@@ -314,6 +962,7 @@ def move_to_inbox(service, email_id):
             id=email_id,
             body={'addLabelIds': ['INBOX'], 'removeLabelIds': ['SPAM']}
         ).execute()
+        MAILBOX_MIRROR.mark_stale(service)
         return True
     except Exception as e:
         print(f"Lỗi khi chuyển email vào inbox: {str(e)}")
@@ -329,6 +978,7 @@ def mark_as_read(service, email_id):
             id=email_id,
             body={'removeLabelIds': ['UNREAD']}
         ).execute()
+        MAILBOX_MIRROR.mark_stale(service)
         return True
     except Exception as e:
         print(f"Lỗi khi đánh dấu email là đã đọc: {str(e)}")
@@ -340,6 +990,7 @@ def delete_email(service, email_id):
     try:
         # Thêm nhãn TRASH
         service.users().messages().trash(userId='me', id=email_id).execute()
+        MAILBOX_MIRROR.mark_stale(service)
         return True
     except Exception as e:
         print(f"Lỗi khi xóa email: {str(e)}")
@@ -375,6 +1026,15 @@ def send_email(service, to, subject, body):
 def get_mailbox_stats(service):
     """Lấy thống kê về hộp thư."""
     try:
+        account = _mirror_account(service)
+        if account is not None:
+            # Số email của nhãn được làm mới khi đồng bộ bản sao có thay đổi
+            totals = MAILBOX_MIRROR.label_totals(account)
+            return {
+                'inbox_count': totals.get('INBOX', 0),
+                'spam_count': totals.get('SPAM', 0)
+            }
+
         # Lấy số lượng email trong inbox bằng cách đếm chính xác
         inbox_result = service.users().labels().get(
             userId='me',
@@ -402,7 +1062,43 @@ def get_mailbox_stats(service):
             'error': str(e)
         }
 
-def classify_email(model, vectorizer, content, subject=''):
+def get_feedback_contents(service, email_ids):
+    """Lấy tiêu đề và nội dung (văn bản dùng để phân loại) của nhiều email để thêm vào tập huấn luyện.
+
+    Email có trong bản sao hộp thư được đọc cục bộ, các email còn lại được lấy
+    từ Gmail bằng batch request.
+
+    Returns:
+        dict - ID email -> {'subject': str, 'content': str}
+    """
+    contents = {}
+    account = _mirror_account(service)
+    if account is not None:
+        for email_id in email_ids:
+            message = MAILBOX_MIRROR.get_message(account, email_id)
+            if message is not None and message['text']:
+                contents[email_id] = {'subject': message['subject'], 'content': message['text']}
+
+    missing = [email_id for email_id in email_ids if email_id not in contents]
+    for email_id, msg in fetch_messages(service, missing, format='full').items():
+        email_data, text = build_email_data(email_id, msg)
+        if text:
+            contents[email_id] = {'subject': email_data['subject'], 'content': text}
+    return contents
+
+def list_mailboxes(service):
+    """Lấy tên các thư mục (nhãn) của hộp thư.
+
+    Returns:
+        list - Tên các thư mục
+    """
+    account = _mirror_account(service)
+    if account is not None:
+        return MAILBOX_MIRROR.label_names(account)
+    labels = service.users().labels().list(userId='me').execute().get('labels', [])
+    return [label['name'] for label in labels]
+
+def classify_email(model, vectorizer, content, subject='', explain=True):
     """Phân loại email sử dụng mô hình Naive Bayes.
     
     Args:
@@ -410,6 +1106,7 @@ def classify_email(model, vectorizer, content, subject=''):
         vectorizer: object - Vectorizer đã huấn luyện
         content: str - Nội dung email cần phân loại
         subject: str - Tiêu đề email (tùy chọn)
+        explain: bool - Có phân tích từ khóa hay không
         
     Returns:
         dict - Kết quả phân loại
@@ -417,4 +1114,21 @@ def classify_email(model, vectorizer, content, subject=''):
     # Import function trực tiếp khi cần để tránh circular import
     # Sử dụng late import pattern
     from naive_bayes import classify_email as nb_classify
-    return nb_classify(model, vectorizer, content, subject)
+    return nb_classify(model, vectorizer, content, subject, explain=explain)
+
+
+def classify_emails(model, vectorizer, contents, subjects=None, explain=True):
+    """Phân loại nhiều email cùng lúc sử dụng mô hình Naive Bayes.
+
+    Args:
+        model: object - Mô hình đã huấn luyện
+        vectorizer: object - Vectorizer đã huấn luyện
+        contents: list - Danh sách nội dung email
+        subjects: list - Danh sách tiêu đề tương ứng (tùy chọn)
+        explain: bool - Có phân tích từ khóa hay không
+
+    Returns:
+        list - Danh sách kết quả phân loại
+    """
+    from naive_bayes import classify_emails as nb_classify_batch
+    return nb_classify_batch(model, vectorizer, contents, subjects, explain=explain)
@@ -0,0 +1,118 @@
+# Kiểm tra ngân sách thời gian import của các module chính
+#
+# Mỗi module được import trong một tiến trình Python mới với `-X importtime`.
+# Kiểm tra thất bại (mã thoát 1) nếu module kéo theo một thư viện nặng chỉ dùng
+# cho huấn luyện/vẽ biểu đồ, hoặc nếu thời gian import vượt ngân sách.
+#
+# Cách dùng:
+#     python import_budget.py              # kiểm tra app, naive_bayes, gmail_oauth
+#     python import_budget.py --scale 2    # nới ngân sách gấp đôi (máy chậm, CI)
+#     python import_budget.py naive_bayes  # chỉ kiểm tra một module
+# Phần kiểm tra thư viện nặng cũng chạy trong bộ test (tests/test_import_budget.py).
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+# Ngân sách thời gian import (mili giây, thời gian tích lũy của chính module)
+IMPORT_BUDGET_MS = {
+    'app': 1500,
+    'naive_bayes': 1000,
+    'gmail_oauth': 1000,
+}
+
+# Các thư viện chỉ được import bên trong đường huấn luyện/đánh giá
+FORBIDDEN_MODULES = (
+    'matplotlib', 'seaborn', 'pandas', 'nltk',
+    'sklearn.model_selection', 'sklearn.metrics',
+)
+
+def measure_import(module, cwd):
+    """Import module trong tiến trình mới và đọc kết quả của `-X importtime`.
+
+    Args:
+        module: str - Tên module cần import
+        cwd: str - Thư mục chạy (thư mục gốc của dự án)
+
+    Returns:
+        dict - {module đã import: thời gian tích lũy (micro giây)}
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=cwd, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Không thể import {module}:\n{result.stderr[-2000:]}")
+
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue  # Dòng tiêu đề
+        timings[parts[2].strip()] = int(parts[1])
+    return timings
+
+def heavy_imports(timings):
+    """Các thư viện bị cấm đã được import (chỉ liệt kê gói gốc).
+
+    Args:
+        timings: dict - Kết quả của measure_import
+
+    Returns:
+        list - Tên các module bị cấm, đã sắp xếp
+    """
+    heavy = sorted(
+        name for name in timings
+        if any(name == forbidden or name.startswith(forbidden + '.') for forbidden in FORBIDDEN_MODULES)
+    )
+    return sorted({name for name in heavy if not any(name.startswith(other + '.') for other in heavy)})
+
+def check_module(module, budget_ms, cwd, repeat=3, top=5):
+    """Đo và kiểm tra một module.
+
+    Returns:
+        list - Danh sách lỗi (rỗng nếu đạt)
+    """
+    runs = [measure_import(module, cwd) for _ in range(repeat)]
+    elapsed_ms = statistics.median(run.get(module, 0) for run in runs) / 1000
+    timings = runs[-1]
+
+    errors = []
+    roots = heavy_imports(timings)
+    if roots:
+        errors.append(f"{module} import thư viện nặng ở cấp module: {', '.join(roots)}")
+    if elapsed_ms > budget_ms:
+        errors.append(f"{module} import mất {elapsed_ms:.0f}ms, vượt ngân sách {budget_ms:.0f}ms")
+
+    status = 'FAIL' if errors else 'OK'
+    print(f"[{status}] {module}: {elapsed_ms:.0f}ms (ngân sách {budget_ms:.0f}ms)")
+    children = sorted(
+        ((name, us) for name, us in timings.items() if name != module and '.' not in name),
+        key=lambda item: item[1], reverse=True
+    )[:top]
+    for name, us in children:
+        print(f"    {us / 1000:8.1f}ms  {name}")
+    return errors
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Kiểm tra ngân sách thời gian import')
+    parser.add_argument('modules', nargs='*', default=list(IMPORT_BUDGET_MS), help='Các module cần kiểm tra')
+    parser.add_argument('--scale', type=float, default=1.0, help='Hệ số nhân ngân sách')
+    parser.add_argument('--repeat', type=int, default=3, help='Số lần đo (lấy trung vị)')
+    args = parser.parse_args(argv)
+
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    errors = []
+    for module in args.modules:
+        budget_ms = IMPORT_BUDGET_MS.get(module, max(IMPORT_BUDGET_MS.values())) * args.scale
+        errors.extend(check_module(module, budget_ms, cwd, repeat=args.repeat))
+
+    for error in errors:
+        print(f"Lỗi: {error}", file=sys.stderr)
+    return 1 if errors else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
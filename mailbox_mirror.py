@@ -0,0 +1,798 @@
+# Bản sao cục bộ hộp thư Gmail, đồng bộ dần qua Gmail history API
+#
+# Bản sao giữ header, snippet, nội dung đã giải mã và kết quả phân loại của các
+# email thuộc MAILBOX_MIRROR_LABELS. Lần đầu (hoặc khi historyId đã quá cũ) chỉ
+# trang email mới nhất của mỗi nhãn được tải về; các trang cũ hơn được tải thêm
+# khi người dùng cuộn tới. Sau đó mỗi lần đồng bộ chỉ đọc các thay đổi (thêm,
+# xóa, đổi nhãn) kể từ historyId đã lưu, nên danh sách, thống kê và thư mục
+# được đọc từ SQLite thay vì tải lại từ Gmail. Chỉ mục toàn văn FTS5 trên tiêu
+# đề, người gửi và nội dung cho phép tìm kiếm ngay trên bản sao.
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import weakref
+import threading
+from config import (
+    MAILBOX_MIRROR_DB, MAILBOX_MIRROR_LABELS, MAILBOX_SYNC_INTERVAL, MAILBOX_BACKFILL_PAGE_SIZE,
+    MAILBOX_LABELS_REFRESH_INTERVAL, MAILBOX_BACKFILL_PAUSE
+)
+from utils import logger
+
+CURSOR_PREFIX = 'mirror:'
+HISTORY_TYPES = ['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved']
+# Tăng khi đổi cấu trúc bảng; bản sao cũ bị xóa và đồng bộ lại từ đầu
+SCHEMA_VERSION = 2
+MIRROR_TABLES = ('mirror_search', 'mirror_message_labels', 'mirror_messages', 'mirror_labels', 'mirror_accounts')
+
+# Từ khóa tìm kiếm: cụm trong ngoặc kép hoặc một từ, có thể kèm tiền tố from:/subject:
+SEARCH_TOKEN = re.compile(r'(?:(\w+):)?(?:"([^"]*)"|(\S+))')
+SEARCH_FIELDS = {'from': 'sender', 'subject': 'subject'}
+
+def _fold_sql(expression):
+    """Biểu thức SQL thay "đ"/"Đ" bằng "d"/"D" (NULL được coi là chuỗi rỗng)."""
+    return f"replace(replace(coalesce({expression}, ''), 'đ', 'd'), 'Đ', 'D')"
+
+def parse_search_query(query):
+    """Chuyển truy vấn kiểu Gmail thành biểu thức MATCH của FTS5.
+
+    Hỗ trợ từ đơn (so khớp tiền tố), cụm từ trong ngoặc kép, `from:`,
+    `subject:` và `OR`. Các toán tử khác của Gmail (has:, after:, -từ...)
+    không thể trả lời từ bản sao.
+
+    Args:
+        query: str - Truy vấn tìm kiếm
+
+    Returns:
+        str|None - Biểu thức MATCH, None nếu truy vấn dùng toán tử không hỗ trợ
+    """
+    terms = []
+    for match in SEARCH_TOKEN.finditer(query or ''):
+        field, phrase, word = match.groups()
+        if field is not None and field.lower() not in SEARCH_FIELDS:
+            return None
+        if word is not None:
+            if word == 'OR' and field is None:
+                if terms and terms[-1] != 'OR':
+                    terms.append('OR')
+                continue
+            if word.startswith('-') or ':' in word:
+                return None
+        text = phrase if phrase is not None else word
+        if not text.strip():
+            continue
+        text = text.replace('đ', 'd').replace('Đ', 'D')
+        term = '"' + text.replace('"', '""') + '"' + ('' if phrase is not None else '*')
+        if field is not None:
+            term = f"{SEARCH_FIELDS[field.lower()]} : {term}"
+        terms.append(term)
+    while terms and terms[-1] == 'OR':
+        terms.pop()
+    return ' '.join(terms) or None
+
+class HistoryChanges:
+    """Các thay đổi rút gọn từ một chuỗi bản ghi history của Gmail."""
+
+    def __init__(self):
+        self.added = set()    # ID email mới xuất hiện
+        self.deleted = set()  # ID email đã bị xóa vĩnh viễn
+        self.labels = {}      # ID email -> danh sách nhãn mới nhất đã biết
+
+    def __bool__(self):
+        return bool(self.added or self.deleted or self.labels)
+
+def collect_history_changes(records):
+    """Gộp các bản ghi history (theo thứ tự thời gian) thành trạng thái cuối.
+
+    Email bị xóa sau khi được thêm chỉ còn trong `deleted`; với đổi nhãn, chỉ
+    danh sách nhãn của bản ghi cuối cùng được giữ lại.
+
+    Args:
+        records: iterable - Các phần tử 'history' trả về từ users().history().list
+
+    Returns:
+        HistoryChanges - Các thay đổi cần áp dụng vào bản sao
+    """
+    changes = HistoryChanges()
+    for record in records:
+        for item in record.get('messagesAdded', []):
+            message = item['message']
+            changes.added.add(message['id'])
+            changes.deleted.discard(message['id'])
+            changes.labels[message['id']] = list(message.get('labelIds', []))
+        for item in record.get('messagesDeleted', []):
+            message_id = item['message']['id']
+            changes.deleted.add(message_id)
+            changes.added.discard(message_id)
+            changes.labels.pop(message_id, None)
+        for key in ('labelsAdded', 'labelsRemoved'):
+            for item in record.get(key, []):
+                message = item['message']
+                if message['id'] in changes.deleted:
+                    continue
+                if 'labelIds' in message:
+                    changes.labels[message['id']] = list(message['labelIds'])
+    return changes
+
+def is_mirror_cursor(page_token):
+    """Token phân trang có phải do bản sao tạo ra không."""
+    return bool(page_token) and page_token.startswith(CURSOR_PREFIX)
+
+def _encode_cursor(internal_date, message_id):
+    return f"{CURSOR_PREFIX}{internal_date}:{message_id}"
+
+def _decode_cursor(page_token):
+    internal_date, _, message_id = page_token[len(CURSOR_PREFIX):].partition(':')
+    return int(internal_date), message_id
+
+def _history_expired(error):
+    # Gmail trả về 404 khi startHistoryId đã quá cũ (thường sau khoảng một tuần)
+    return getattr(getattr(error, 'resp', None), 'status', None) == 404
+
+class MailboxMirror:
+    """Bản sao SQLite của hộp thư, chia theo tài khoản Gmail.
+
+    Mọi lời gọi Gmail API được thực hiện ngoài giao dịch SQLite; các thay đổi
+    được ghi trong một giao dịch và có tính lũy đẳng (áp dụng lại cùng một
+    đoạn history cho kết quả như nhau), nên nhiều luồng/tiến trình đồng bộ
+    cùng lúc vẫn an toàn.
+    """
+
+    def __init__(self, db_path=MAILBOX_MIRROR_DB, labels=MAILBOX_MIRROR_LABELS):
+        self.db_path = db_path or None
+        self.labels = list(labels)
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+        self.search_enabled = False
+        self._accounts = weakref.WeakKeyDictionary()  # Gmail service -> địa chỉ email
+        self._sync_locks = {}
+        self._sync_locks_lock = threading.Lock()
+        self._backfill_threads = {}  # (tài khoản, nhãn) -> luồng đang tải nền
+
+    @property
+    def enabled(self):
+        return self.db_path is not None
+
+    def _connect(self):
+        # Mỗi luồng (và mỗi tiến trình sau khi fork) dùng kết nối riêng
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _db(self):
+        if self._initialized:
+            return self._connect()
+        with self._init_lock:
+            conn = self._connect()
+            if not self._initialized:
+                if conn.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+                    # Bản sao chỉ là bộ nhớ đệm của Gmail: đổi cấu trúc thì dựng lại từ đầu
+                    for table in MIRROR_TABLES:
+                        conn.execute(f'DROP TABLE IF EXISTS {table}')
+                    conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+                self._create_schema(conn)
+                self._initialized = True
+        return conn
+
+    def _create_schema(self, conn):
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS mirror_accounts ('
+            'account TEXT PRIMARY KEY, history_id INTEGER, '
+            'synced_at REAL NOT NULL DEFAULT 0, labels_synced_at REAL NOT NULL DEFAULT 0)'
+        )
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS mirror_labels ('
+            'account TEXT NOT NULL, label_id TEXT NOT NULL, name TEXT NOT NULL, type TEXT, '
+            'messages_total INTEGER, backfill_token TEXT, backfill_done INTEGER NOT NULL DEFAULT 0, '
+            'PRIMARY KEY (account, label_id))'
+        )
+        # doc_id cố định làm rowid cho chỉ mục toàn văn
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS mirror_messages ('
+            'doc_id INTEGER PRIMARY KEY, account TEXT NOT NULL, id TEXT NOT NULL, thread_id TEXT, '
+            'internal_date INTEGER NOT NULL, label_ids TEXT NOT NULL, '
+            'subject TEXT, sender TEXT, date TEXT, snippet TEXT, '
+            'content TEXT, plain_content TEXT, text TEXT, '
+            'classification TEXT, model_version TEXT, updated_at REAL NOT NULL, '
+            'UNIQUE (account, id))'
+        )
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS mirror_message_labels ('
+            'account TEXT NOT NULL, label_id TEXT NOT NULL, message_id TEXT NOT NULL, '
+            'internal_date INTEGER NOT NULL, PRIMARY KEY (account, label_id, message_id))'
+        )
+        conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_mirror_message_labels_order '
+            'ON mirror_message_labels (account, label_id, internal_date DESC, message_id DESC)'
+        )
+        conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_mirror_message_labels_message '
+            'ON mirror_message_labels (account, message_id)'
+        )
+
+        # Chỉ mục toàn văn không lưu nội dung (contentless), được cập nhật bằng
+        # trigger. unicode61 bỏ dấu tiếng Việt nhưng không đổi "đ" (không phải
+        # chữ có dấu), nên "đ" được thay bằng "d" ở cả văn bản và truy vấn
+        # để "trung thuong dai" khớp với "Trúng thưởng đãi".
+        try:
+            conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS mirror_search USING fts5("
+                "subject, sender, text, content='', tokenize='unicode61 remove_diacritics 2')"
+            )
+        except sqlite3.OperationalError as e:
+            logger.warning(f"SQLite không hỗ trợ FTS5, tìm kiếm sẽ dùng Gmail: {str(e)}")
+            self.search_enabled = False
+            return
+        new_values = ', '.join(_fold_sql(f'new.{column}') for column in ('subject', 'sender', 'text'))
+        old_values = ', '.join(_fold_sql(f'old.{column}') for column in ('subject', 'sender', 'text'))
+        conn.execute(
+            'CREATE TRIGGER IF NOT EXISTS mirror_messages_ai AFTER INSERT ON mirror_messages BEGIN '
+            f'INSERT INTO mirror_search (rowid, subject, sender, text) VALUES (new.doc_id, {new_values}); END'
+        )
+        conn.execute(
+            'CREATE TRIGGER IF NOT EXISTS mirror_messages_ad AFTER DELETE ON mirror_messages BEGIN '
+            'INSERT INTO mirror_search (mirror_search, rowid, subject, sender, text) '
+            f"VALUES ('delete', old.doc_id, {old_values}); END"
+        )
+        conn.execute(
+            'CREATE TRIGGER IF NOT EXISTS mirror_messages_au AFTER UPDATE OF subject, sender, text '
+            'ON mirror_messages BEGIN '
+            'INSERT INTO mirror_search (mirror_search, rowid, subject, sender, text) '
+            f"VALUES ('delete', old.doc_id, {old_values}); "
+            f'INSERT INTO mirror_search (rowid, subject, sender, text) VALUES (new.doc_id, {new_values}); END'
+        )
+        self.search_enabled = True
+
+    def _sync_lock(self, account):
+        with self._sync_locks_lock:
+            return self._sync_locks.setdefault(account, threading.Lock())
+
+    def account(self, service):
+        """Địa chỉ email của tài khoản ứng với Gmail service (gọi getProfile một lần)."""
+        account = self._accounts.get(service)
+        if account is None:
+            profile = service.users().getProfile(userId='me').execute()
+            account = profile['emailAddress']
+            self._accounts[service] = account
+        return account
+
+    def mark_stale(self, service):
+        """Buộc lần đọc kế tiếp đồng bộ ngay (sau khi ứng dụng tự sửa hộp thư)."""
+        if not self.enabled:
+            return
+        account = self._accounts.get(service)
+        if account is None:
+            return
+        try:
+            self._db().execute('UPDATE mirror_accounts SET synced_at = 0 WHERE account = ?', (account,))
+        except Exception as e:
+            logger.warning(f"Không thể đánh dấu bản sao hộp thư cần đồng bộ: {str(e)}")
+
+    # ---- Đồng bộ -------------------------------------------------------
+
+    def sync(self, service, force=False):
+        """Đồng bộ bản sao với Gmail nếu đã quá MAILBOX_SYNC_INTERVAL.
+
+        Args:
+            service: object - Gmail service
+            force: bool - Đồng bộ ngay, bỏ qua khoảng thời gian tối thiểu
+
+        Returns:
+            str - Tài khoản (địa chỉ email) của bản sao
+        """
+        account = self.account(service)
+        conn = self._db()
+        with self._sync_lock(account):
+            state = conn.execute(
+                'SELECT history_id, synced_at, labels_synced_at FROM mirror_accounts WHERE account = ?',
+                (account,)
+            ).fetchone()
+            if state is None or state['history_id'] is None:
+                self._full_sync(conn, service, account)
+                return account
+
+            now = time.time()
+            if force or now - state['synced_at'] >= MAILBOX_SYNC_INTERVAL:
+                if not self._incremental_sync(conn, service, account, state['history_id']):
+                    self._full_sync(conn, service, account)
+                    return account
+            if now - state['labels_synced_at'] >= MAILBOX_LABELS_REFRESH_INTERVAL:
+                self._refresh_labels(conn, service, account)
+        return account
+
+    def _full_sync(self, conn, service, account):
+        """Xóa bản sao của tài khoản rồi tải lại trang mới nhất của mỗi nhãn."""
+        # Lấy historyId trước khi liệt kê để không bỏ sót thay đổi xảy ra trong lúc tải
+        history_id = int(service.users().getProfile(userId='me').execute()['historyId'])
+        logger.info(f"Đồng bộ toàn bộ bản sao hộp thư {account} từ historyId {history_id}")
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for table in ('mirror_message_labels', 'mirror_messages', 'mirror_labels'):
+                conn.execute(f'DELETE FROM {table} WHERE account = ?', (account,))
+            conn.execute(
+                'INSERT OR REPLACE INTO mirror_accounts (account, history_id, synced_at, labels_synced_at) '
+                'VALUES (?, ?, ?, 0)',
+                (account, history_id, time.time())
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        self._refresh_labels(conn, service, account)
+        for label_id in self.labels:
+            self._backfill(conn, service, account, label_id)
+
+    def _incremental_sync(self, conn, service, account, start_history_id):
+        """Áp dụng các thay đổi kể từ start_history_id.
+
+        Returns:
+            bool - False nếu historyId đã hết hạn và cần đồng bộ toàn bộ
+        """
+        records = []
+        latest_history_id = start_history_id
+        page_token = None
+        history_api = service.users().history()
+        try:
+            while True:
+                response = history_api.list(
+                    userId='me', startHistoryId=str(start_history_id),
+                    historyTypes=HISTORY_TYPES, pageToken=page_token
+                ).execute()
+                records.extend(response.get('history', []))
+                latest_history_id = max(latest_history_id, int(response.get('historyId', start_history_id)))
+                page_token = response.get('nextPageToken')
+                if not page_token:
+                    break
+        except Exception as e:
+            if _history_expired(e):
+                logger.warning(f"historyId {start_history_id} của {account} đã hết hạn, đồng bộ lại toàn bộ")
+                return False
+            raise
+
+        changes = collect_history_changes(records)
+        mirrored = set(self.labels)
+        known = set()
+        if changes.labels:
+            ids = list(changes.labels)
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                known.update(row[0] for row in conn.execute(
+                    f"SELECT id FROM mirror_messages WHERE account = ? AND id IN ({','.join('?' * len(chunk))})",
+                    [account] + chunk
+                ))
+
+        # Email mới, hoặc email cũ chưa có trong bản sao vừa được chuyển vào nhãn đang sao chép
+        to_fetch = [
+            message_id for message_id, label_ids in changes.labels.items()
+            if message_id not in known and mirrored.intersection(label_ids)
+        ]
+        fetched = {}
+        if to_fetch:
+            from gmail_oauth import fetch_messages
+            fetched = fetch_messages(service, to_fetch)
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._store_messages(conn, account, fetched.values())
+            removed = set(changes.deleted)
+            for message_id in known:
+                label_ids = changes.labels[message_id]
+                if mirrored.intersection(label_ids):
+                    self._set_labels(conn, account, message_id, label_ids)
+                else:
+                    removed.add(message_id)
+            self._delete_messages(conn, account, removed)
+            # Chỉ tiến historyId về phía trước (tiến trình khác có thể đã đồng bộ xa hơn)
+            conn.execute(
+                'UPDATE mirror_accounts SET history_id = MAX(history_id, ?), synced_at = ? WHERE account = ?',
+                (latest_history_id, time.time(), account)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        if changes:
+            logger.info(
+                f"Đồng bộ hộp thư {account}: {len(fetched)} email mới, {len(removed)} email bị xóa, "
+                f"{len(known)} email đổi nhãn (historyId {latest_history_id})"
+            )
+            self._refresh_label_totals(conn, service, account)
+        return True
+
+    def _refresh_labels(self, conn, service, account):
+        """Làm mới danh sách thư mục và số email của các nhãn đang sao chép."""
+        labels = service.users().labels().list(userId='me').execute().get('labels', [])
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Xóa các thư mục đã bị xóa trên Gmail
+            current = {label['id'] for label in labels}
+            stale = [
+                row[0] for row in conn.execute('SELECT label_id FROM mirror_labels WHERE account = ?', (account,))
+                if row[0] not in current
+            ]
+            conn.executemany(
+                'DELETE FROM mirror_labels WHERE account = ? AND label_id = ?',
+                [(account, label_id) for label_id in stale]
+            )
+            conn.executemany(
+                'INSERT INTO mirror_labels (account, label_id, name, type) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (account, label_id) DO UPDATE SET name = excluded.name, type = excluded.type',
+                [(account, label['id'], label['name'], label.get('type')) for label in labels]
+            )
+            conn.execute('UPDATE mirror_accounts SET labels_synced_at = ? WHERE account = ?', (time.time(), account))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self._refresh_label_totals(conn, service, account)
+
+    def _refresh_label_totals(self, conn, service, account):
+        totals = {}
+        for label_id in self.labels:
+            try:
+                totals[label_id] = service.users().labels().get(userId='me', id=label_id).execute().get('messagesTotal', 0)
+            except Exception as e:
+                logger.warning(f"Không thể lấy số email của nhãn {label_id}: {str(e)}")
+        conn.executemany(
+            'UPDATE mirror_labels SET messages_total = ? WHERE account = ? AND label_id = ?',
+            [(total, account, label_id) for label_id, total in totals.items()]
+        )
+
+    def _backfill(self, conn, service, account, label_id, page_size=MAILBOX_BACKFILL_PAGE_SIZE):
+        """Tải thêm một trang email cũ hơn của nhãn vào bản sao.
+
+        Returns:
+            bool - True nếu đã tải thêm một trang, False nếu nhãn đã được tải hết
+        """
+        row = conn.execute(
+            'SELECT backfill_token, backfill_done FROM mirror_labels WHERE account = ? AND label_id = ?',
+            (account, label_id)
+        ).fetchone()
+        if row is not None and row['backfill_done']:
+            return False
+
+        from gmail_oauth import fetch_messages
+        results = service.users().messages().list(
+            userId='me', labelIds=[label_id], maxResults=page_size,
+            pageToken=row['backfill_token'] if row is not None else None
+        ).execute()
+        message_ids = [message['id'] for message in results.get('messages', [])]
+        fetched = fetch_messages(service, message_ids)
+        next_token = results.get('nextPageToken')
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._store_messages(conn, account, fetched.values())
+            conn.execute(
+                'INSERT INTO mirror_labels (account, label_id, name, backfill_token, backfill_done) '
+                'VALUES (?, ?, ?, ?, ?) ON CONFLICT (account, label_id) DO UPDATE SET '
+                'backfill_token = excluded.backfill_token, backfill_done = excluded.backfill_done',
+                (account, label_id, label_id, next_token, 0 if next_token else 1)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return True
+
+    # ---- Ghi dữ liệu (bên trong giao dịch) -----------------------------
+
+    def _store_messages(self, conn, account, messages):
+        from gmail_oauth import build_email_data
+
+        now = time.time()
+        for msg in messages:
+            try:
+                email_data, text = build_email_data(msg['id'], msg)
+            except Exception as e:
+                logger.warning(f"Bỏ qua email {msg.get('id')} khi lưu bản sao: {str(e)}")
+                continue
+            internal_date = int(msg.get('internalDate') or 0)
+            label_ids = list(msg.get('labelIds', []))
+            # Dùng upsert thay vì INSERT OR REPLACE: REPLACE không kích hoạt trigger xóa
+            # nên sẽ để lại dòng cũ trong chỉ mục toàn văn
+            conn.execute(
+                'INSERT INTO mirror_messages (account, id, thread_id, internal_date, label_ids, '
+                'subject, sender, date, snippet, content, plain_content, text, classification, model_version, '
+                'updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, NULL, NULL, ?) '
+                'ON CONFLICT (account, id) DO UPDATE SET thread_id = excluded.thread_id, '
+                'internal_date = excluded.internal_date, label_ids = excluded.label_ids, '
+                'subject = excluded.subject, sender = excluded.sender, date = excluded.date, '
+                'snippet = excluded.snippet, content = excluded.content, plain_content = excluded.plain_content, '
+                'text = excluded.text, classification = NULL, model_version = NULL, updated_at = excluded.updated_at',
+                (account, msg['id'], msg.get('threadId'), internal_date, json.dumps(label_ids),
+                 email_data['subject'], email_data['sender'], email_data['date'], email_data['snippet'],
+                 email_data['content'], email_data['plain_content'], text, now)
+            )
+            self._replace_label_rows(conn, account, msg['id'], label_ids, internal_date)
+
+    def _set_labels(self, conn, account, message_id, label_ids):
+        row = conn.execute(
+            'SELECT internal_date FROM mirror_messages WHERE account = ? AND id = ?', (account, message_id)
+        ).fetchone()
+        if row is None:
+            return
+        conn.execute(
+            'UPDATE mirror_messages SET label_ids = ?, updated_at = ? WHERE account = ? AND id = ?',
+            (json.dumps(list(label_ids)), time.time(), account, message_id)
+        )
+        self._replace_label_rows(conn, account, message_id, label_ids, row['internal_date'])
+
+    @staticmethod
+    def _replace_label_rows(conn, account, message_id, label_ids, internal_date):
+        conn.execute('DELETE FROM mirror_message_labels WHERE account = ? AND message_id = ?', (account, message_id))
+        conn.executemany(
+            'INSERT INTO mirror_message_labels (account, label_id, message_id, internal_date) VALUES (?, ?, ?, ?)',
+            [(account, label_id, message_id, internal_date) for label_id in label_ids]
+        )
+
+    @staticmethod
+    def _delete_messages(conn, account, message_ids):
+        for message_id in message_ids:
+            conn.execute('DELETE FROM mirror_message_labels WHERE account = ? AND message_id = ?', (account, message_id))
+            conn.execute('DELETE FROM mirror_messages WHERE account = ? AND id = ?', (account, message_id))
+
+    # ---- Đọc dữ liệu ---------------------------------------------------
+
+    @staticmethod
+    def _row_to_message(row):
+        label_ids = json.loads(row['label_ids'])
+        return {
+            'id': row['id'],
+            'thread_id': row['thread_id'],
+            'internal_date': row['internal_date'],
+            'label_ids': label_ids,
+            'subject': row['subject'],
+            'sender': row['sender'],
+            'date': row['date'],
+            'snippet': row['snippet'],
+            'content': row['content'],
+            'plain_content': row['plain_content'],
+            'text': row['text'],
+            'read': 'UNREAD' not in label_ids,
+            'classification': json.loads(row['classification']) if row['classification'] else None,
+            'model_version': row['model_version']
+        }
+
+    def list_messages(self, service, account, label_id, limit, page_token=None):
+        """Đọc một trang email của nhãn từ bản sao, tải thêm từ Gmail khi cần.
+
+        Args:
+            service: object - Gmail service (dùng khi phải tải thêm email cũ hơn)
+            account: str - Tài khoản trả về từ sync()
+            label_id: str - Nhãn cần đọc (thuộc MAILBOX_MIRROR_LABELS)
+            limit: int - Số email tối đa
+            page_token: str - Token do bản sao tạo ở trang trước (None: trang đầu)
+
+        Returns:
+            tuple - (list email, token trang kế tiếp hoặc None)
+        """
+        conn = self._db()
+        if page_token:
+            cursor_date, cursor_id = _decode_cursor(page_token)
+        else:
+            cursor_date, cursor_id = None, None
+
+        while True:
+            query = (
+                'SELECT m.* FROM mirror_message_labels l JOIN mirror_messages m '
+                'ON m.account = l.account AND m.id = l.message_id '
+                'WHERE l.account = ? AND l.label_id = ?'
+            )
+            params = [account, label_id]
+            if cursor_date is not None:
+                query += ' AND (l.internal_date < ? OR (l.internal_date = ? AND l.message_id < ?))'
+                params += [cursor_date, cursor_date, cursor_id]
+            query += ' ORDER BY l.internal_date DESC, l.message_id DESC LIMIT ?'
+            rows = conn.execute(query, params + [limit + 1]).fetchall()
+            # Bản sao chưa đủ email cho trang này: tải thêm một trang cũ hơn từ Gmail
+            if len(rows) > limit or not self._backfill(conn, service, account, label_id):
+                break
+
+        has_more = len(rows) > limit or self._has_backfill(conn, account, label_id)
+        messages = [self._row_to_message(row) for row in rows[:limit]]
+        next_token = None
+        if has_more and messages:
+            next_token = _encode_cursor(messages[-1]['internal_date'], messages[-1]['id'])
+        return messages, next_token
+
+    @staticmethod
+    def _has_backfill(conn, account, label_id):
+        row = conn.execute(
+            'SELECT backfill_done FROM mirror_labels WHERE account = ? AND label_id = ?', (account, label_id)
+        ).fetchone()
+        return row is not None and not row['backfill_done']
+
+    def is_complete(self, account, label_id):
+        """Bản sao đã chứa toàn bộ email của nhãn chưa."""
+        return not self._has_backfill(self._db(), account, label_id)
+
+    def request_backfill(self, service, account, label_id):
+        """Tải dần toàn bộ email cũ của nhãn ở luồng nền (không chặn request).
+
+        Tìm kiếm trên bản sao chỉ đúng khi bản sao có đủ email của nhãn; trong
+        lúc chờ, tìm kiếm được trả lời bằng Gmail. Mỗi (tài khoản, nhãn) chỉ có
+        một luồng tải nền trong toàn bộ các tiến trình (khóa file), giữa hai
+        trang nghỉ MAILBOX_BACKFILL_PAUSE giây để không dồn hạn mức Gmail API.
+
+        Returns:
+            bool - True nếu bản sao đã có toàn bộ email của nhãn
+        """
+        if self.is_complete(account, label_id):
+            return True
+        key = (account, label_id)
+        with self._sync_locks_lock:
+            thread = self._backfill_threads.get(key)
+            if thread is None or not thread.is_alive():
+                thread = threading.Thread(
+                    target=self._run_backfill, args=(service, account, label_id),
+                    name=f'mirror-backfill-{label_id}', daemon=True
+                )
+                self._backfill_threads[key] = thread
+                thread.start()
+        return False
+
+    def _backfill_lock_file(self, account, label_id):
+        """Giữ khóa file của (tài khoản, nhãn), None nếu tiến trình khác đang tải."""
+        try:
+            import fcntl
+        except ImportError:  # Windows: chỉ có khóa trong tiến trình
+            return open(os.devnull, 'a')
+        name = hashlib.sha256(f'{account}\0{label_id}'.encode('utf-8')).hexdigest()[:16]
+        lock_file = open(f'{self.db_path}.backfill-{name}.lock', 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return None
+        return lock_file
+
+    def _run_backfill(self, service, account, label_id):
+        lock_file = self._backfill_lock_file(account, label_id)
+        if lock_file is None:
+            return
+        started = time.monotonic()
+        pages = 0
+        try:
+            conn = self._db()
+            while self._backfill(conn, service, account, label_id):
+                pages += 1
+                time.sleep(MAILBOX_BACKFILL_PAUSE)
+            logger.info(
+                f"Đã tải đủ nhãn {label_id} của {account} vào bản sao "
+                f"({pages} trang trong {time.monotonic() - started:.1f}s)"
+            )
+        except Exception as e:
+            logger.warning(f"Dừng tải nền nhãn {label_id} của {account} sau {pages} trang: {str(e)}")
+        finally:
+            lock_file.close()
+
+    def unclassified(self, account, label_id, version):
+        """Các email của nhãn chưa có kết quả phân loại của phiên bản mô hình hiện tại."""
+        rows = self._db().execute(
+            'SELECT m.* FROM mirror_message_labels l JOIN mirror_messages m '
+            'ON m.account = l.account AND m.id = l.message_id '
+            'WHERE l.account = ? AND l.label_id = ? AND m.model_version IS NOT ?',
+            (account, label_id, version)
+        ).fetchall()
+        return [self._row_to_message(row) for row in rows]
+
+    def search(self, account, label_id, match, limit, page_token=None, filters=None, version=None):
+        """Tìm email của nhãn bằng chỉ mục toàn văn, mới nhất trước.
+
+        Args:
+            account: str - Tài khoản
+            label_id: str - Nhãn cần tìm trong đó
+            match: str|None - Biểu thức MATCH từ parse_search_query (None: không lọc theo nội dung)
+            limit: int - Số email tối đa
+            page_token: str - Token do bản sao tạo ở trang trước
+            filters: dict - Bộ lọc 'classification', 'min_confidence', 'max_confidence'
+            version: str - Phiên bản mô hình; bộ lọc phân loại chỉ xét kết quả của phiên bản này
+
+        Returns:
+            tuple - (list email, token trang kế tiếp hoặc None)
+        """
+        filters = filters or {}
+        query = 'SELECT m.* FROM mirror_messages m '
+        params = []
+        if match:
+            query += 'JOIN mirror_search s ON s.rowid = m.doc_id AND mirror_search MATCH ? '
+            params.append(match)
+        query += (
+            'JOIN mirror_message_labels l ON l.account = m.account AND l.message_id = m.id AND l.label_id = ? '
+            'WHERE m.account = ?'
+        )
+        params += [label_id, account]
+        if any(filters.get(key) is not None for key in ('classification', 'min_confidence', 'max_confidence')):
+            query += ' AND m.model_version = ?'
+            params.append(version)
+        if filters.get('classification') is not None:
+            query += " AND json_extract(m.classification, '$.classification') = ?"
+            params.append(filters['classification'])
+        if filters.get('min_confidence') is not None:
+            query += " AND json_extract(m.classification, '$.confidence') >= ?"
+            params.append(filters['min_confidence'])
+        if filters.get('max_confidence') is not None:
+            query += " AND json_extract(m.classification, '$.confidence') < ?"
+            params.append(filters['max_confidence'])
+        if page_token:
+            cursor_date, cursor_id = _decode_cursor(page_token)
+            query += ' AND (m.internal_date < ? OR (m.internal_date = ? AND m.id < ?))'
+            params += [cursor_date, cursor_date, cursor_id]
+        query += ' ORDER BY m.internal_date DESC, m.id DESC LIMIT ?'
+        params.append(limit + 1)
+
+        rows = self._db().execute(query, params).fetchall()
+        messages = [self._row_to_message(row) for row in rows[:limit]]
+        next_token = None
+        if len(rows) > limit:
+            next_token = _encode_cursor(messages[-1]['internal_date'], messages[-1]['id'])
+        return messages, next_token
+
+    def get_message(self, account, message_id):
+        """Đọc một email từ bản sao.
+
+        Returns:
+            dict|None - Email hoặc None nếu không có trong bản sao
+        """
+        row = self._db().execute(
+            'SELECT * FROM mirror_messages WHERE account = ? AND id = ?', (account, message_id)
+        ).fetchone()
+        return self._row_to_message(row) if row is not None else None
+
+    def save_classifications(self, account, results, version):
+        """Lưu kết quả phân loại của các email theo phiên bản mô hình.
+
+        Args:
+            account: str - Tài khoản
+            results: dict - ID email -> kết quả phân loại
+            version: str - Phiên bản mô hình đã tạo kết quả
+        """
+        if not results:
+            return
+        conn = self._db()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                'UPDATE mirror_messages SET classification = ?, model_version = ? WHERE account = ? AND id = ?',
+                [(json.dumps(result, ensure_ascii=False), version, account, message_id)
+                 for message_id, result in results.items()]
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def label_totals(self, account):
+        """Số email của các nhãn đang sao chép (theo Gmail, không giới hạn bởi bản sao).
+
+        Returns:
+            dict - {nhãn: số email}
+        """
+        rows = self._db().execute(
+            f"SELECT label_id, messages_total FROM mirror_labels WHERE account = ? "
+            f"AND label_id IN ({','.join('?' * len(self.labels))})",
+            [account] + self.labels
+        ).fetchall()
+        return {row['label_id']: row['messages_total'] or 0 for row in rows}
+
+    def label_names(self, account):
+        """Tên các thư mục của tài khoản."""
+        rows = self._db().execute(
+            'SELECT name FROM mirror_labels WHERE account = ? ORDER BY rowid', (account,)
+        ).fetchall()
+        return [row['name'] for row in rows]
+
+MAILBOX_MIRROR = MailboxMirror()
@@ -0,0 +1,108 @@
+# Sổ đăng ký mô hình đang phục vụ: ảnh chụp bất biến + cập nhật kiểu read-copy-update
+import time
+import threading
+from utils import logger
+
+class ModelSnapshot:
+    """Ảnh chụp bất biến của mô hình đang phục vụ.
+
+    Mô hình, vectorizer và phiên bản luôn thuộc cùng một lần huấn luyện/cập
+    nhật. Có thể giải nén như tuple cũ: `model, vectorizer = snapshot`.
+    """
+
+    __slots__ = ('model', 'vectorizer', 'version', 'published_at')
+
+    def __init__(self, model, vectorizer, version):
+        object.__setattr__(self, 'model', model)
+        object.__setattr__(self, 'vectorizer', vectorizer)
+        object.__setattr__(self, 'version', version)
+        object.__setattr__(self, 'published_at', time.time())
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ModelSnapshot là bất biến")
+
+    def __iter__(self):
+        return iter((self.model, self.vectorizer))
+
+    def __repr__(self):
+        return f"ModelSnapshot(version={self.version!r})"
+
+class ModelRegistry:
+    """Giữ ảnh chụp mô hình đang phục vụ sau một tham chiếu duy nhất.
+
+    Đường đọc không dùng khóa: mỗi request lấy ảnh chụp hiện tại một lần
+    (phép đọc một tham chiếu là nguyên tử) và dùng nó cho đến hết request,
+    nên không bao giờ thấy mô hình và vectorizer của hai phiên bản khác nhau.
+    Đường ghi (huấn luyện lại, học từ phản hồi) tuần tự qua một khóa, tạo
+    ảnh chụp mới từ ảnh chụp cũ rồi thay tham chiếu trong một phép gán.
+    """
+
+    def __init__(self, loader, version_fn):
+        """
+        Args:
+            loader: callable - Hàm trả về (model, vectorizer) cho lần nạp đầu tiên
+            version_fn: callable - Hàm tính phiên bản từ (model, vectorizer)
+        """
+        self._loader = loader
+        self._version_fn = version_fn
+        self._snapshot = None
+        self._write_lock = threading.RLock()
+
+    @property
+    def loaded(self):
+        return self._snapshot is not None
+
+    @property
+    def version(self):
+        """Phiên bản đang phục vụ (None nếu chưa nạp)."""
+        snapshot = self._snapshot
+        return snapshot.version if snapshot is not None else None
+
+    def current(self):
+        """Lấy ảnh chụp đang phục vụ, nạp lần đầu nếu cần.
+
+        Returns:
+            ModelSnapshot - Ảnh chụp cần dùng cho toàn bộ request hiện tại
+        """
+        snapshot = self._snapshot
+        if snapshot is not None:
+            return snapshot
+        with self._write_lock:
+            if self._snapshot is None:
+                model, vectorizer = self._loader()
+                self._install(model, vectorizer)
+            return self._snapshot
+
+    def _install(self, model, vectorizer):
+        snapshot = ModelSnapshot(model, vectorizer, self._version_fn(model, vectorizer))
+        previous = self._snapshot
+        self._snapshot = snapshot
+        if previous is None or previous.version != snapshot.version:
+            logger.info(f"Mô hình phục vụ: phiên bản {snapshot.version}")
+        return snapshot
+
+    def publish(self, model, vectorizer):
+        """Đưa cặp (model, vectorizer) mới vào phục vụ.
+
+        Returns:
+            ModelSnapshot - Ảnh chụp vừa được đưa vào phục vụ
+        """
+        with self._write_lock:
+            return self._install(model, vectorizer)
+
+    def update(self, fn):
+        """Cập nhật kiểu read-copy-update.
+
+        fn nhận ảnh chụp hiện tại và trả về cặp (model, vectorizer) mới; ảnh
+        chụp cũ không bị sửa nên các request đang dùng nó vẫn nhất quán.
+        Các lần cập nhật được thực hiện tuần tự.
+
+        Args:
+            fn: callable - Hàm (ModelSnapshot) -> (model, vectorizer)
+
+        Returns:
+            ModelSnapshot - Ảnh chụp mới
+        """
+        with self._write_lock:
+            model, vectorizer = fn(self.current())
+            return self._install(model, vectorizer)
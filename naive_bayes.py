@@ -1,24 +1,31 @@
 import re
 import os
-import pandas as pd
+import sys
+import time
+import shutil
+import tempfile
+import hashlib
+import threading
+import weakref
+import copy
+import types
+import functools
+from collections import OrderedDict
+from contextlib import contextmanager
 import joblib
 import unicodedata
-import matplotlib.pyplot as plt
-import matplotlib
-matplotlib.use('Agg')  # Use non-interactive backend
-import seaborn as sns
 import numpy as np
-import nltk
 import json
 from datetime import datetime
-from nltk.tokenize import word_tokenize as nltk_word_tokenize
-from sklearn.model_selection import train_test_split, GridSearchCV
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.naive_bayes import MultinomialNB
-from sklearn.pipeline import Pipeline
-from sklearn.metrics import accuracy_score, classification_report, confusion_matrix, precision_score, recall_score, f1_score
-from config import MODEL_PATH, VECTORIZER_PATH, PIPELINE_PATH, STOPWORDS_FILE
+# pandas, matplotlib/seaborn, nltk và các phần huấn luyện/đánh giá của sklearn
+# chỉ được import bên trong các hàm cần đến chúng để khởi động ứng dụng nhanh
+# (kiểm tra bằng import_budget.py)
+from config import (
+    MODEL_PATH, VECTORIZER_PATH, PIPELINE_PATH, EVALUATION_PATH, DATA_FILE, STOPWORDS_FILE,
+    PREPROCESS_CACHE_SIZE, NLTK_OFFLINE, PREPROCESSED_CORPUS_PATH, SEARCH_MODE, SEARCH_CANCEL_CHUNK
+)
 from utils import logger
+from dataset_store import get_dataset_store, text_hash
 
 # Đọc danh sách stopwords từ file
 def load_stopwords(file_path=STOPWORDS_FILE):
@@ -33,6 +40,192 @@ def load_stopwords(file_path=STOPWORDS_FILE):
 
 STOPWORDS = load_stopwords()
 
+def _hash_code(digest, code):
+    """Băm bytecode, tên và hằng số của một code object (kể cả code object lồng nhau).
+
+    repr() của code object lồng nhau (comprehension, lambda) chứa địa chỉ bộ nhớ,
+    và thứ tự phần tử của frozenset phụ thuộc PYTHONHASHSEED, nên cả hai được
+    băm theo nội dung để dấu vân tay giống nhau giữa các lần khởi động.
+    """
+    digest.update(code.co_code)
+    digest.update(repr(code.co_names).encode('utf-8'))
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _hash_code(digest, const)
+        elif isinstance(const, frozenset):
+            digest.update(repr(sorted(repr(item) for item in const)).encode('utf-8'))
+        else:
+            digest.update(repr(const).encode('utf-8'))
+
+class TextPreprocessor:
+    """Bộ tiền xử lý văn bản có bộ nhớ đệm LRU.
+
+    Tài nguyên tokenizer của NLTK chỉ được kiểm tra/tải một lần (khi warm-up
+    hoặc ở lần gọi đầu tiên). Nếu không có tài nguyên và không tải được,
+    bộ xử lý chuyển sang chế độ offline và tách từ theo khoảng trắng.
+    Kết quả của toàn bộ chuỗi chuẩn hóa - tách từ - lọc được lưu theo mã băm
+    nội dung, nên các tiêu đề/nội dung lặp lại chỉ tốn một lần tra cứu.
+    """
+
+    NLTK_RESOURCES = ('punkt', 'punkt_tab')
+
+    def __init__(self, stopwords, maxsize=PREPROCESS_CACHE_SIZE, offline=NLTK_OFFLINE):
+        self.stopwords = stopwords
+        self.maxsize = maxsize
+        self.offline = offline
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._init_lock = threading.Lock()
+        self._tokenizer = None
+        self.hits = 0
+        self.misses = 0
+
+    def warmup(self):
+        """Nạp tài nguyên tokenizer một lần duy nhất.
+
+        Returns:
+            str - Chế độ tokenizer đang dùng ('nltk' hoặc 'offline')
+        """
+        if self._tokenizer is not None:
+            return self.tokenizer_mode
+        with self._init_lock:
+            if self._tokenizer is None:
+                self._tokenizer = self._load_tokenizer()
+        return self.tokenizer_mode
+
+    @property
+    def tokenizer_mode(self):
+        if self._tokenizer is None:
+            return 'uninitialized'
+        return 'offline' if self._tokenizer is str.split else 'nltk'
+
+    def _load_tokenizer(self):
+        import nltk
+        from nltk.tokenize import word_tokenize as nltk_word_tokenize
+
+        for resource in self.NLTK_RESOURCES:
+            try:
+                nltk.data.find(f'tokenizers/{resource}')
+            except LookupError:
+                if self.offline:
+                    continue
+                try:
+                    nltk.download(resource, quiet=True, raise_on_error=True)
+                except Exception as e:
+                    logger.warning(f"Không thể tải tài nguyên NLTK '{resource}': {e}")
+
+        # Kiểm tra tokenizer hoạt động thật sự trước khi dùng
+        try:
+            nltk_word_tokenize('kiểm tra tokenizer')
+        except Exception as e:
+            logger.warning(f"Tokenizer NLTK không khả dụng ({type(e).__name__}), chuyển sang chế độ offline")
+            return str.split
+        return nltk_word_tokenize
+
+    @staticmethod
+    def _cache_key(text):
+        return hashlib.blake2b(text.encode('utf-8', errors='surrogatepass'), digest_size=16).digest()
+
+    def __call__(self, text):
+        """Tiền xử lý văn bản, dùng kết quả đã lưu nếu có.
+
+        Args:
+            text: str - Văn bản cần xử lý
+
+        Returns:
+            str - Văn bản đã được xử lý
+        """
+        if not isinstance(text, str):
+            return ""
+
+        key = self._cache_key(text)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        result = self._process(text)
+
+        if self.maxsize > 0:
+            with self._lock:
+                self._cache[key] = result
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.maxsize:
+                    self._cache.popitem(last=False)
+        return result
+
+    def _process(self, text):
+        # Loại bỏ thẻ HTML
+        text = re.sub(r'<[^>]+>', '', text)
+        # Chuẩn hóa URL, email, số điện thoại
+        text = re.sub(r'http[s]?://\S+', 'URL', text)
+        text = re.sub(r'\S+@\S+', 'EMAIL', text)
+        text = re.sub(r'\b\d{10,11}\b', 'PHONE', text)
+
+        # Chuẩn hóa dấu tiếng Việt sử dụng NFC
+        text = unicodedata.normalize('NFC', text)
+
+        # Chuyển về chữ thường
+        text = text.lower()
+
+        # Tách từ tiếng Việt (sử dụng NLTK thay cho underthesea)
+        if self._tokenizer is None:
+            self.warmup()
+        try:
+            words = self._tokenizer(text)
+        except Exception:
+            # Fallback to simple word splitting if NLTK fails
+            words = text.split()
+
+        # Loại bỏ từ ngắn và stopwords
+        stopwords = self.stopwords
+        return ' '.join([word for token in words for word in token.split()
+                         if len(word) > 2 and word not in stopwords])
+
+    def fingerprint(self):
+        """Dấu vân tay của bộ tiền xử lý (mã nguồn, stopwords và chế độ tokenizer).
+
+        Kết quả tiền xử lý đã lưu chỉ được dùng lại khi dấu vân tay không đổi.
+
+        Returns:
+            str - Chuỗi dấu vân tay dạng hex
+        """
+        self.warmup()
+        digest = hashlib.blake2b(digest_size=16)
+        _hash_code(digest, TextPreprocessor._process.__code__)
+        digest.update('\n'.join(sorted(self.stopwords)).encode('utf-8'))
+        digest.update(self.tokenizer_mode.encode('utf-8'))
+        return digest.hexdigest()
+
+    def clear(self):
+        """Xóa bộ nhớ đệm và đặt lại bộ đếm."""
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Thống kê bộ nhớ đệm tiền xử lý.
+
+        Returns:
+            dict - Số lần hit/miss, kích thước hiện tại và chế độ tokenizer
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'size': len(self._cache),
+                'maxsize': self.maxsize,
+                'tokenizer': self.tokenizer_mode
+            }
+
+PREPROCESSOR = TextPreprocessor(STOPWORDS)
+
 def preprocess_text(text):
     """Tiền xử lý văn bản cho tiếng Việt.
 
@@ -42,37 +235,109 @@ def preprocess_text(text):
     Returns:
         str - Văn bản đã được xử lý
     """
-    if not isinstance(text, str):
-        return ""
+    return PREPROCESSOR(text)
 
-    # Loại bỏ thẻ HTML
-    text = re.sub(r'<[^>]+>', '', text)
-    # Chuẩn hóa URL, email, số điện thoại
-    text = re.sub(r'http[s]?://\S+', 'URL', text)
-    text = re.sub(r'\S+@\S+', 'EMAIL', text)
-    text = re.sub(r'\b\d{10,11}\b', 'PHONE', text)
+def warmup_preprocessing():
+    """Nạp trước tài nguyên tokenizer để lần gọi đầu tiên không phải chờ.
 
-    # Chuẩn hóa dấu tiếng Việt sử dụng NFC
-    text = unicodedata.normalize('NFC', text)
-
-    # Chuyển về chữ thường
-    text = text.lower()
+    Returns:
+        str - Chế độ tokenizer đang dùng ('nltk' hoặc 'offline')
+    """
+    return PREPROCESSOR.warmup()
 
-    # Tách từ tiếng Việt (sử dụng NLTK thay cho underthesea)
+def _load_corpus_cache(path, fingerprint):
+    """Đọc file văn bản đã tiền xử lý; trả về dict rỗng nếu không có hoặc đã cũ."""
+    if not os.path.exists(path):
+        return {}
     try:
-        # Download punkt if not already downloaded
-        import nltk
-        nltk.download('punkt', quiet=True)
-        nltk.download('punkt_tab', quiet=True)
-        words = nltk_word_tokenize(text)
-        text = ' '.join(words)
-    except:
-        # Fallback to simple word splitting if NLTK fails
-        text = ' '.join(text.split())
-
-    # Loại bỏ từ ngắn và stopwords
-    text = ' '.join([word for word in text.split() if len(word) > 2 and word not in STOPWORDS])
-    return text
+        with np.load(path, allow_pickle=False) as cache:
+            if str(cache['fingerprint']) != fingerprint:
+                logger.info("Bộ tiền xử lý đã thay đổi, bỏ qua văn bản đã tiền xử lý được lưu")
+                return {}
+            hashes = cache['hashes'].tobytes()
+            offsets = cache['offsets']
+            blob = cache['blob'].tobytes()
+        return {
+            hashes[i * 16:(i + 1) * 16]: blob[offsets[i]:offsets[i + 1]].decode('utf-8')
+            for i in range(len(offsets) - 1)
+        }
+    except Exception as e:
+        logger.warning(f"Không thể đọc file văn bản đã tiền xử lý {path}: {e}")
+        return {}
+
+def _save_corpus_cache(path, fingerprint, entries):
+    """Ghi văn bản đã tiền xử lý dạng nhị phân: mã băm, offset và một khối UTF-8 liền."""
+    encoded = [value.encode('utf-8') for value in entries.values()]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        np.savez(
+            f,
+            fingerprint=np.array(fingerprint),
+            hashes=np.frombuffer(b''.join(entries.keys()), dtype=np.uint8),
+            offsets=offsets,
+            blob=np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        )
+    os.replace(tmp_path, path)
+
+def preprocess_corpus(texts, cache_path=PREPROCESSED_CORPUS_PATH):
+    """Tiền xử lý cả tập huấn luyện, chỉ tách từ các dòng mới hoặc đã thay đổi.
+
+    Văn bản đã tiền xử lý được lưu cạnh tập dữ liệu, theo mã băm nội dung
+    từng dòng và dấu vân tay của bộ tiền xử lý. Lần huấn luyện sau chỉ xử lý
+    các dòng chưa có trong file; file được ghi lại với đúng các dòng hiện có.
+
+    Args:
+        texts: list - Danh sách văn bản gốc
+        cache_path: str - Đường dẫn file lưu văn bản đã tiền xử lý
+
+    Returns:
+        list - Văn bản đã tiền xử lý, cùng thứ tự với texts
+    """
+    fingerprint = PREPROCESSOR.fingerprint()
+    cached = _load_corpus_cache(cache_path, fingerprint)
+
+    entries = {}
+    processed = []
+    reused = 0
+    for text in texts:
+        if not isinstance(text, str):
+            processed.append(preprocess_text(text))
+            continue
+        key = text_hash(text)
+        value = entries.get(key)
+        if value is None:
+            value = cached.get(key)
+            if value is None:
+                value = preprocess_text(text)
+            else:
+                reused += 1
+            entries[key] = value
+        processed.append(value)
+
+    logger.info(f"Tiền xử lý tập huấn luyện: dùng lại {reused}/{len(entries)} văn bản khác nhau")
+    if reused != len(entries) or len(entries) != len(cached):
+        try:
+            _save_corpus_cache(cache_path, fingerprint, entries)
+        except Exception as e:
+            logger.warning(f"Không thể lưu văn bản đã tiền xử lý: {e}")
+    return processed
+
+def get_preprocess_cache_stats():
+    """Lấy thống kê hit/miss của bộ nhớ đệm tiền xử lý.
+
+    Returns:
+        dict - Thống kê bộ nhớ đệm
+    """
+    return PREPROCESSOR.stats()
+
+def _pyplot():
+    """Import matplotlib (backend không giao diện) khi cần vẽ biểu đồ."""
+    import matplotlib
+    matplotlib.use('Agg')  # Use non-interactive backend
+    import matplotlib.pyplot as plt
+    return plt
 
 def save_model_performance_chart(accuracy, precision, recall, f1, output_path):
     """Tạo và lưu biểu đồ hiệu suất của mô hình.
@@ -88,6 +353,7 @@ def save_model_performance_chart(accuracy, precision, recall, f1, output_path):
         None
     """
     try:
+        plt = _pyplot()
         metrics = ['Accuracy', 'Precision', 'Recall', 'F1 Score']
         values = [accuracy * 100, precision * 100, recall * 100, f1 * 100]
 
@@ -148,6 +414,9 @@ def save_confusion_matrix(cm, class_names, output_path):
         None
     """
     try:
+        plt = _pyplot()
+        import seaborn as sns
+
         # Tạo figure và axis
         fig, ax = plt.subplots(figsize=(8, 6))
 
@@ -187,7 +456,8 @@ def save_confusion_matrix(cm, class_names, output_path):
         except:
             pass
 
-def save_training_metrics(train_metrics, val_metrics, test_metrics, best_params, output_path='training_metrics.json'):
+def save_training_metrics(train_metrics, val_metrics, test_metrics, best_params, output_path='training_metrics.json',
+                          search_stats=None):
     """Lưu các metrics từ quá trình training vào file JSON.
     
     Args:
@@ -196,6 +466,7 @@ def save_training_metrics(train_metrics, val_metrics, test_metrics, best_params,
         test_metrics: dict - Metrics trên tập test
         best_params: dict - Tham số tốt nhất từ GridSearchCV
         output_path: str - Đường dẫn file JSON
+        search_stats: dict - Thời gian và bộ nhớ của bước tìm kiếm tham số (tùy chọn)
     """
     try:
         metrics_data = {
@@ -210,6 +481,8 @@ def save_training_metrics(train_metrics, val_metrics, test_metrics, best_params,
                 'is_overfitting': (train_metrics['accuracy'] - val_metrics['accuracy']) > 0.1
             }
         }
+        if search_stats is not None:
+            metrics_data['search'] = search_stats
         
         with open(output_path, 'w', encoding='utf-8') as f:
             json.dump(metrics_data, f, indent=2, ensure_ascii=False)
@@ -218,33 +491,412 @@ def save_training_metrics(train_metrics, val_metrics, test_metrics, best_params,
     except Exception as e:
         logger.error(f"Lỗi khi lưu training metrics: {e}")
 
-def train_model(csv_file):
+_PIPELINE_THREAD_LOCK = threading.RLock()
+
+@contextmanager
+def pipeline_lock(path=PIPELINE_PATH):
+    """Khóa liên tiến trình quanh chuỗi đọc-cập nhật-ghi file pipeline.
+
+    Các worker của serve_prod.py đều có thể cập nhật mô hình; giữ khóa này
+    trong lúc đọc pipeline mới nhất, cập nhật và ghi lại để cập nhật của
+    tiến trình này không ghi đè mất cập nhật của tiến trình khác.
+
+    Args:
+        path: str - Đường dẫn file pipeline (khóa nằm ở file `<path>.lock`)
+    """
+    with _PIPELINE_THREAD_LOCK:
+        try:
+            import fcntl
+        except ImportError:  # Windows: chỉ có khóa trong tiến trình
+            yield
+            return
+        with open(f"{path}.lock", 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def pipeline_stamp(path=PIPELINE_PATH):
+    """Dấu (mtime, kích thước) của file pipeline, None nếu chưa có file."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def save_pipeline(model, vectorizer, path=PIPELINE_PATH):
+    """Lưu pipeline (vectorizer + mô hình) một cách nguyên tử.
+
+    Pipeline được ghi ra file tạm rồi đổi tên, nên tiến trình khác không bao
+    giờ đọc phải file đang ghi dở.
+
+    Args:
+        model: object - Mô hình đã huấn luyện
+        vectorizer: object - Vectorizer đã huấn luyện
+        path: str - Đường dẫn file pipeline
+
+    Returns:
+        str - Đường dẫn đã lưu
+    """
+    from sklearn.pipeline import Pipeline
+
+    pipeline = Pipeline([
+        ('vectorizer', vectorizer),
+        ('classifier', model)
+    ])
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    joblib.dump(pipeline, tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+def update_model_incremental(model, vectorizer, texts, labels, old_labels=None):
+    """Cập nhật mô hình Naive Bayes với dữ liệu mới mà không huấn luyện lại từ đầu.
+
+    Các email mới được cộng trực tiếp vào bộ đếm của MultinomialNB qua
+    partial_fit trên không gian đặc trưng cố định của vectorizer hiện tại
+    (từ mới ngoài từ vựng bị bỏ qua cho tới lần huấn luyện đầy đủ tiếp theo).
+    Khi một email đổi nhãn, đóng góp của nó vào lớp cũ được trừ đi trước.
+    Mô hình gốc không bị thay đổi; hàm trả về một bản sao đã cập nhật.
+
+    Args:
+        model: object - Mô hình MultinomialNB đã huấn luyện
+        vectorizer: object - Vectorizer đã huấn luyện
+        texts: list - Danh sách văn bản (chưa tiền xử lý)
+        labels: list - Nhãn tương ứng ('spam'/'ham')
+        old_labels: list - Nhãn cũ của từng văn bản nếu là đổi nhãn (tùy chọn)
+
+    Returns:
+        object - Mô hình mới đã cập nhật
+    """
+    X = vectorizer.transform([preprocess_text(text) for text in texts])
+    new_model = copy.deepcopy(model)
+
+    # Trừ đóng góp của nhãn cũ với các email đổi nhãn
+    if old_labels:
+        classes = list(new_model.classes_)
+        for i, old_label in enumerate(old_labels):
+            if old_label is None or old_label == labels[i]:
+                continue
+            class_index = classes.index(old_label)
+            row = X[i].toarray()[0]
+            new_model.feature_count_[class_index] = np.maximum(new_model.feature_count_[class_index] - row, 0)
+            new_model.class_count_[class_index] = max(new_model.class_count_[class_index] - 1, 1)
+
+    # partial_fit cộng bộ đếm và tính lại xác suất log từ bộ đếm
+    new_model.partial_fit(X, labels)
+    return new_model
+
+def load_dataset(csv_file=DATA_FILE):
+    """Đọc dữ liệu huấn luyện.
+
+    File dữ liệu mặc định được đọc từ kho dữ liệu có chỉ mục (index của
+    DataFrame là id ổn định của từng mẫu); các file CSV khác được đọc trực tiếp.
+
+    Args:
+        csv_file: str - Đường dẫn đến file dữ liệu CSV
+
+    Returns:
+        DataFrame - Dữ liệu với các cột label, text
+    """
+    if os.path.abspath(csv_file) == os.path.abspath(DATA_FILE):
+        return get_dataset_store().to_dataframe()
+    import pandas as pd
+    return pd.read_csv(csv_file)
+
+_EVALUATION_CACHE = {}
+
+def save_evaluation(model, vectorizer, X_test, y_test, dataset_size, path=EVALUATION_PATH):
+    """Đánh giá mô hình trên tập test và lưu kết quả theo phiên bản mô hình.
+
+    Kết quả gồm cả chỉ số (index) các dòng của tập test để các phiên bản sau
+    (ví dụ sau khi học tăng dần) được đánh giá lại trên đúng tập test đó.
+
+    Args:
+        model: object - Mô hình đã huấn luyện
+        vectorizer: object - Vectorizer đã huấn luyện
+        X_test: Series - Văn bản đã tiền xử lý của tập test (giữ index gốc)
+        y_test: Series - Nhãn của tập test
+        dataset_size: int - Số mẫu trong tập dữ liệu
+        path: str - Đường dẫn file kết quả
+
+    Returns:
+        dict - Kết quả đánh giá
+    """
+    from sklearn.metrics import accuracy_score, confusion_matrix, precision_score, recall_score, f1_score
+
+    y_pred = model.predict(vectorizer.transform(X_test))
+    evaluation = {
+        'model_version': get_model_version(model, vectorizer),
+        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'training_size': int(dataset_size),
+        'test_indices': [int(i) for i in X_test.index],
+        'accuracy': float(accuracy_score(y_test, y_pred)),
+        'precision': float(precision_score(y_test, y_pred, pos_label='spam', zero_division=0)),
+        'recall': float(recall_score(y_test, y_pred, pos_label='spam', zero_division=0)),
+        'f1_score': float(f1_score(y_test, y_pred, pos_label='spam', zero_division=0)),
+        'confusion_matrix': confusion_matrix(y_test, y_pred, labels=['ham', 'spam']).tolist()
+    }
+
+    try:
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(evaluation, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logger.warning(f"Không thể lưu kết quả đánh giá mô hình: {e}")
+
+    _EVALUATION_CACHE.clear()
+    _EVALUATION_CACHE[evaluation['model_version']] = evaluation
+    return evaluation
+
+def _load_evaluation(path=EVALUATION_PATH):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Không thể đọc kết quả đánh giá mô hình: {e}")
+        return None
+
+def get_evaluation(model, vectorizer, csv_file, path=EVALUATION_PATH):
+    """Lấy kết quả đánh giá của mô hình, chỉ tính lại khi phiên bản mô hình thay đổi.
+
+    Args:
+        model: object - Mô hình đang phục vụ
+        vectorizer: object - Vectorizer đang phục vụ
+        csv_file: str - File dữ liệu (chỉ đọc khi cần đánh giá lại)
+        path: str - Đường dẫn file kết quả
+
+    Returns:
+        dict - Kết quả đánh giá của đúng phiên bản mô hình
+    """
+    version = get_model_version(model, vectorizer)
+    evaluation = _EVALUATION_CACHE.get(version)
+    if evaluation is not None:
+        return evaluation
+
+    evaluation = _load_evaluation(path)
+    if evaluation is not None and evaluation.get('model_version') == version:
+        _EVALUATION_CACHE.clear()
+        _EVALUATION_CACHE[version] = evaluation
+        return evaluation
+
+    # Phiên bản mới chưa được đánh giá: đánh giá lại trên tập test đã lưu nếu có
+    logger.info(f"Đánh giá mô hình phiên bản {version}...")
+    data = load_dataset(csv_file).dropna()
+    test_indices = evaluation.get('test_indices') if evaluation else None
+    if test_indices:
+        test_data = data.loc[data.index.intersection(test_indices)]
+    else:
+        from sklearn.model_selection import train_test_split
+        _, test_data = train_test_split(data, test_size=0.2, random_state=42, stratify=data['label'])
+    X_test = test_data['text'].apply(preprocess_text)
+    return save_evaluation(model, vectorizer, X_test, test_data['label'], len(data), path)
+
+class TrainingCancelled(Exception):
+    """Quá trình huấn luyện bị hủy theo yêu cầu."""
+
+def load_pipeline(path=PIPELINE_PATH):
+    """Tải pipeline đã lưu.
+
+    Args:
+        path: str - Đường dẫn file pipeline
+
+    Returns:
+        tuple - (model, vectorizer)
+    """
+    pipeline = joblib.load(path)
+    return pipeline.named_steps['classifier'], pipeline.named_steps['vectorizer']
+
+def validate_pipeline(path):
+    """Kiểm tra pipeline vừa huấn luyện trước khi đưa vào phục vụ.
+
+    Args:
+        path: str - Đường dẫn file pipeline cần kiểm tra
+
+    Returns:
+        tuple - (model, vectorizer) đọc từ file nếu hợp lệ
+
+    Raises:
+        ValueError - Nếu pipeline không hợp lệ
+    """
+    model, vectorizer = load_pipeline(path)
+    if sorted(model.classes_) != ['ham', 'spam']:
+        raise ValueError(f"Pipeline có các lớp không hợp lệ: {list(model.classes_)}")
+    if len(vectorizer.vocabulary_) != model.feature_log_prob_.shape[1]:
+        raise ValueError("Kích thước từ vựng không khớp với mô hình")
+    probabilities = model.predict_proba(vectorizer.transform([preprocess_text("kiểm tra pipeline")]))
+    if not np.all(np.isfinite(probabilities)):
+        raise ValueError("Pipeline trả về xác suất không hợp lệ")
+    return model, vectorizer
+
+def _report_progress(progress_callback, cancel_event, progress, stage):
+    """Báo tiến độ và dừng huấn luyện nếu đã có yêu cầu hủy."""
+    if cancel_event is not None and cancel_event.is_set():
+        raise TrainingCancelled(f"Đã hủy huấn luyện tại bước: {stage}")
+    if progress_callback is not None:
+        progress_callback(progress, stage)
+
+def _max_rss_mb():
+    """Mức RSS cao nhất từ trước đến nay (high-water mark, MB) của tiến trình hiện tại
+    và của các tiến trình con đã kết thúc và được thu hồi (RUSAGE_CHILDREN).
+
+    Returns:
+        dict|None - {'process': float, 'children': float} hoặc None nếu hệ điều hành không hỗ trợ
+    """
+    try:
+        import resource
+    except ImportError:  # Windows không có module resource
+        return None
+    # ru_maxrss tính bằng KB trên Linux và byte trên macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return {
+        'process': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1),
+        'children': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1)
+    }
+
+def _search_memory_mb(before, after):
+    """Bộ nhớ mà bước tìm kiếm tham số đã đẩy lên, so sánh hai lần đo _max_rss_mb().
+
+    ru_maxrss chỉ tăng nên hiệu sau - trước là phần high-water mark tăng thêm trong lúc
+    tìm kiếm (0 nếu tìm kiếm không vượt đỉnh cũ, ví dụ lúc nạp dữ liệu). 'children' chỉ
+    tính các worker đã kết thúc trong lúc tìm kiếm; worker loky còn sống để tái sử dụng
+    chưa được tính. 'process_high_water' là đỉnh của cả vòng đời tiến trình, để tham khảo.
+
+    Returns:
+        dict|None - {'process_increase', 'children_increase', 'process_high_water'} (MB)
+    """
+    if before is None or after is None:
+        return None
+    return {
+        'process_increase': round(max(0.0, after['process'] - before['process']), 1),
+        'children_increase': round(max(0.0, after['children'] - before['children']), 1),
+        'process_high_water': after['process']
+    }
+
+def _build_search(pipeline, param_grid, mode, cache_dir=None):
+    """Tạo bộ tìm kiếm siêu tham số theo chiến lược đã chọn.
+
+    Ở chế độ 'cached' và 'halving', pipeline lưu đệm vectorizer đã fit trên
+    từng fold vào cache_dir: các ứng viên chỉ khác nhau ở classifier__alpha
+    dùng lại cùng ma trận TF-IDF thay vì tokenize và fit lại từ đầu.
+
+    Args:
+        pipeline: Pipeline - Pipeline vectorizer + classifier
+        param_grid: dict - Lưới tham số
+        mode: str - 'grid', 'cached' hoặc 'halving'
+        cache_dir: str - Thư mục lưu đệm vectorizer (bắt buộc với 'cached'/'halving')
+
+    Returns:
+        object - GridSearchCV hoặc HalvingGridSearchCV chưa fit
+    """
+    if mode not in ('grid', 'cached', 'halving'):
+        raise ValueError(f"SEARCH_MODE không hợp lệ: {mode}")
+
+    from sklearn.model_selection import GridSearchCV
+
+    if mode != 'grid':
+        pipeline.set_params(memory=joblib.Memory(cache_dir, verbose=0))
+
+    common = dict(cv=5, scoring='f1_weighted', verbose=1, n_jobs=-1, return_train_score=True)
+    if mode == 'halving':
+        from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+        from sklearn.model_selection import HalvingGridSearchCV
+        return HalvingGridSearchCV(pipeline, param_grid, factor=3, random_state=42, **common)
+    return GridSearchCV(pipeline, param_grid, **common)
+
+def _track_search_progress(search, n_candidates, progress_callback, cancel_event, start, end,
+                           chunk_size=SEARCH_CANCEL_CHUNK):
+    """Cho phép báo tiến độ và hủy giữa các nhóm ứng viên trong lúc tìm kiếm tham số.
+
+    GridSearchCV đánh giá cả lưới trong một lần gọi evaluate_candidates; lời gọi
+    đó được chia thành các nhóm chunk_size ứng viên. HalvingGridSearchCV giữ
+    nguyên từng vòng (more_results phải khớp số ứng viên của vòng) nên được
+    kiểm tra giữa các vòng. Yêu cầu hủy có hiệu lực sau khi nhóm đang chạy xong.
+
+    Args:
+        search: object - GridSearchCV/HalvingGridSearchCV chưa fit
+        n_candidates: int - Số lượt đánh giá ứng viên dự kiến (để tính tiến độ)
+        progress_callback: callable - Hàm nhận (tiến độ 0-1, tên bước) (tùy chọn)
+        cancel_event: threading.Event - Sự kiện yêu cầu hủy (tùy chọn)
+        start, end: float - Khoảng tiến độ dành cho bước tìm kiếm
+        chunk_size: int - Số ứng viên mỗi nhóm
+    """
+    run_search = search._run_search
+    evaluated = [0]
+
+    def report():
+        fraction = min(1.0, evaluated[0] / max(1, n_candidates))
+        _report_progress(progress_callback, cancel_event, start + (end - start) * fraction, 'grid_search')
+
+    # wraps giữ chữ ký của _run_search gốc (sklearn kiểm tra chữ ký để truyền thêm tham số)
+    @functools.wraps(run_search)
+    def tracked_run_search(evaluate_candidates, *args, **kwargs):
+        def evaluate_in_chunks(candidate_params, *eval_args, **eval_kwargs):
+            candidate_params = list(candidate_params)
+            chunked = not eval_args and eval_kwargs.get('more_results') is None
+            size = max(1, chunk_size) if chunked else max(1, len(candidate_params))
+            if len(candidate_params) > size:
+                # Ngữ cảnh callback của sklearn (nếu có) chỉ dùng được cho một lần gọi
+                eval_kwargs.pop('callback_ctx', None)
+            results = None
+            for i in range(0, len(candidate_params), size):
+                report()
+                chunk = candidate_params[i:i + size]
+                # evaluate_candidates trả về kết quả dồn của mọi ứng viên đã đánh giá
+                results = evaluate_candidates(chunk, *eval_args, **eval_kwargs)
+                evaluated[0] += len(chunk)
+            return results
+
+        return run_search(evaluate_in_chunks, *args, **kwargs)
+
+    # Gán trên đối tượng nên hoạt động với cả GridSearchCV và HalvingGridSearchCV
+    search._run_search = tracked_run_search
+
+def train_model(csv_file, force=False, output_path=PIPELINE_PATH, progress_callback=None, cancel_event=None):
     """Huấn luyện mô hình Naive Bayes với TF-IDF và GridSearchCV.
 
     Args:
         csv_file: str - Đường dẫn đến file dữ liệu CSV
+        force: bool - Huấn luyện lại kể cả khi đã có pipeline đã lưu
+        output_path: str - Đường dẫn lưu pipeline mới
+        progress_callback: callable - Hàm nhận (tiến độ 0-1, tên bước) (tùy chọn)
+        cancel_event: threading.Event - Sự kiện yêu cầu hủy huấn luyện (tùy chọn)
 
     Returns:
         tuple - (model, vectorizer) đã huấn luyện
+
+    Raises:
+        TrainingCancelled - Nếu cancel_event được bật trong lúc huấn luyện (được kiểm tra
+            giữa các bước và giữa các nhóm SEARCH_CANCEL_CHUNK ứng viên khi tìm tham số)
     """
-    # Kiểm tra xem pipeline đã được huấn luyện chưa
-    if os.path.exists(PIPELINE_PATH):
-        logger.info("Đang tải pipeline đã huấn luyện...")
-        pipeline = joblib.load(PIPELINE_PATH)
-        model = pipeline.named_steps['classifier']
-        vectorizer = pipeline.named_steps['vectorizer']
-        return model, vectorizer
-
-    # Kiểm tra xem mô hình cũ đã được huấn luyện chưa (để tương thích ngược)
-    elif os.path.exists(MODEL_PATH) and os.path.exists(VECTORIZER_PATH):
-        logger.info("Đang tải mô hình và vectorizer cũ...")
-        model = joblib.load(MODEL_PATH)
-        vectorizer = joblib.load(VECTORIZER_PATH)
-        return model, vectorizer
+    if not force:
+        # Kiểm tra xem pipeline đã được huấn luyện chưa
+        if os.path.exists(PIPELINE_PATH):
+            logger.info("Đang tải pipeline đã huấn luyện...")
+            return load_pipeline(PIPELINE_PATH)
+
+        # Kiểm tra xem mô hình cũ đã được huấn luyện chưa (để tương thích ngược)
+        elif os.path.exists(MODEL_PATH) and os.path.exists(VECTORIZER_PATH):
+            logger.info("Đang tải mô hình và vectorizer cũ...")
+            model = joblib.load(MODEL_PATH)
+            vectorizer = joblib.load(VECTORIZER_PATH)
+            return model, vectorizer
 
     logger.info("Đang huấn luyện mô hình mới...")
+    from sklearn.model_selection import train_test_split
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.naive_bayes import MultinomialNB
+    from sklearn.pipeline import Pipeline
+    from sklearn.metrics import (
+        accuracy_score, classification_report, confusion_matrix, precision_score, recall_score, f1_score
+    )
+
+    _report_progress(progress_callback, cancel_event, 0.0, 'loading_data')
     # Tải dữ liệu
-    data = pd.read_csv(csv_file)
+    data = load_dataset(csv_file)
     data = data.dropna()
 
     # Kiểm tra tỷ lệ lớp để phát hiện mất cân bằng
@@ -259,7 +911,8 @@ def train_model(csv_file):
         class_weights[label] = total_samples / (n_classes * count)
 
     # Tiền xử lý dữ liệu
-    data['processed_text'] = data['text'].apply(preprocess_text)
+    _report_progress(progress_callback, cancel_event, 0.05, 'preprocessing')
+    data['processed_text'] = preprocess_corpus(data['text'].tolist())
 
     # Chia dữ liệu thành train/val/test (60%/20%/20%)
     X = data['processed_text']
@@ -299,23 +952,44 @@ def train_model(csv_file):
         'classifier__alpha': [0.01, 0.1, 0.5, 1.0],
     }
 
-    logger.info("Bắt đầu GridSearchCV để tìm tham số tối ưu...")
+    logger.info(f"Bắt đầu tìm tham số tối ưu (chế độ: {SEARCH_MODE})...")
     
     # Tạo tập train+val để GridSearchCV có thể cross-validate
     # Nhưng chúng ta sẽ đánh giá riêng trên val sau
-    grid_search = GridSearchCV(
-        pipeline,
-        param_grid,
-        cv=5,
-        scoring='f1_weighted',
-        verbose=1,
-        n_jobs=-1,
-        return_train_score=True
-    )
+    cache_dir = tempfile.mkdtemp(prefix='nb_search_') if SEARCH_MODE != 'grid' else None
+    grid_search = _build_search(pipeline, param_grid, SEARCH_MODE, cache_dir)
+    from sklearn.model_selection import ParameterGrid
+    n_candidates = len(ParameterGrid(param_grid))
+    if SEARCH_MODE == 'halving':
+        # Mỗi vòng giữ lại 1/3 ứng viên: tổng số lượt đánh giá ~ 1.5 lần số ứng viên ban đầu
+        n_candidates = n_candidates * 3 // 2
+    _track_search_progress(grid_search, n_candidates, progress_callback, cancel_event, 0.2, 0.8)
 
     # Huấn luyện trên tập train
+    _report_progress(progress_callback, cancel_event, 0.2, 'grid_search')
     logger.info("Huấn luyện mô hình trên tập TRAIN...")
-    grid_search.fit(X_train, y_train)
+    search_start = time.perf_counter()
+    memory_before = _max_rss_mb()
+    try:
+        grid_search.fit(X_train, y_train)
+    finally:
+        if cache_dir:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+    search_stats = {
+        'mode': SEARCH_MODE,
+        'wall_time_seconds': round(time.perf_counter() - search_start, 2),
+        'candidates': len(grid_search.cv_results_['params']),
+        'memory_mb': _search_memory_mb(memory_before, _max_rss_mb())
+    }
+    logger.info(
+        f"Tìm tham số xong sau {search_stats['wall_time_seconds']}s "
+        f"({search_stats['candidates']} lượt đánh giá ứng viên), "
+        f"bộ nhớ tăng thêm khi tìm kiếm: {search_stats['memory_mb']}"
+    )
+    _report_progress(progress_callback, cancel_event, 0.8, 'evaluating')
+
+    # Bỏ bộ nhớ đệm khỏi pipeline tốt nhất (thư mục đệm đã bị xóa)
+    grid_search.best_estimator_.set_params(memory=None)
 
     # Lấy mô hình tốt nhất
     best_model = grid_search.best_estimator_
@@ -386,6 +1060,10 @@ def train_model(csv_file):
     logger.info(f"F1-Score:  {f1:.4f}")
     logger.info(f"\nBáo cáo phân loại chi tiết:\n{report}")
     logger.info(f"Confusion Matrix:\n{cm}")
+
+    # Lưu kết quả đánh giá cho trang thống kê
+    save_evaluation(best_model.named_steps['classifier'], best_model.named_steps['vectorizer'],
+                    X_test, y_test, len(data))
     
     # ========== TỔNG HỢP KẾT QUẢ ==========
     logger.info("\n" + "="*60)
@@ -451,90 +1129,138 @@ def train_model(csv_file):
             val_metrics_dict,
             test_metrics_dict,
             grid_search.best_params_,
-            'training_metrics.json'
+            'training_metrics.json',
+            search_stats=search_stats
         )
     except Exception as e:
         logger.warning(f"Không thể lưu training metrics: {e}")
 
     # Lưu pipeline hoàn chỉnh (chỉ cần file này)
-    joblib.dump(best_model, PIPELINE_PATH)
-    logger.info(f"Đã lưu pipeline tại: {PIPELINE_PATH}")
+    _report_progress(progress_callback, cancel_event, 0.95, 'saving')
+    save_pipeline(model, vectorizer, output_path)
+    logger.info(f"Đã lưu pipeline tại: {output_path}")
 
     # Không cần lưu model và vectorizer riêng biệt nữa vì pipeline đã chứa tất cả
 
     return model, vectorizer
 
-def classify_email(model, vectorizer, email_text, email_subject=None):
-    """Phân loại email với độ tin cậy và thông tin chi tiết.
-
-    Args:
-        model: object - Mô hình đã huấn luyện
-        vectorizer: object - Vectorizer đã huấn luyện
-        email_text: str - Nội dung email cần phân loại
-        email_subject: str - Tiêu đề email (tùy chọn)
-
-    Returns:
-        dict - Kết quả phân loại với các thông tin chi tiết
-    """
+def _combine_text(email_text, email_subject=None):
+    """Tiền xử lý và kết hợp tiêu đề với nội dung email."""
     preprocessed_text = preprocess_text(email_text)
 
     # Kết hợp tiêu đề và nội dung nếu có
     if email_subject:
         preprocessed_subject = preprocess_text(email_subject)
-        combined_text = preprocessed_subject + " " + preprocessed_text
-    else:
-        combined_text = preprocessed_text
+        return preprocessed_subject + " " + preprocessed_text
+    return preprocessed_text
 
-    # Chuyển đổi văn bản sang vector đặc trưng
-    text_vec = vectorizer.transform([combined_text])
+# Bảng giải thích theo từng mô hình/vectorizer, tính một lần rồi dùng lại
+_LOG_RATIO_CACHE = weakref.WeakKeyDictionary()
+_FEATURE_NAMES_CACHE = weakref.WeakKeyDictionary()
 
-    # Dự đoán và lấy xác suất
-    prediction = model.predict(text_vec)[0]
-    probabilities = model.predict_proba(text_vec)[0]
+def _get_log_ratio(model):
+    """Lấy vector log(P(w|spam)) - log(P(w|ham)) của mô hình, tính một lần cho mỗi mô hình.
 
-    # Lấy độ tin cậy
-    confidence = max(probabilities) * 100
+    Vector được tính lại nếu feature_log_prob_ của mô hình đã thay đổi.
+    """
+    feature_log_prob = model.feature_log_prob_
+    cached = _LOG_RATIO_CACHE.get(model)
+    if cached is not None and cached[0] is feature_log_prob:
+        return cached[1]
+    spam_index = list(model.classes_).index('spam')
+    ham_index = 1 - spam_index
+    log_ratio = feature_log_prob[spam_index] - feature_log_prob[ham_index]
+    _LOG_RATIO_CACHE[model] = (feature_log_prob, log_ratio)
+    return log_ratio
 
-    # Phân tích các từ khóa quan trọng
-    feature_names = vectorizer.get_feature_names_out()
-    coef_index = 1 if prediction == 'spam' else 0  # Chỉ số cho lớp spam hoặc ham
+_MODEL_VERSION_CACHE = weakref.WeakKeyDictionary()
+
+def get_model_version(model, vectorizer):
+    """Tính dấu vân tay (phiên bản) của cặp mô hình/vectorizer.
+
+    Dấu vân tay được tính từ tham số đã học nên hai pipeline giống hệt nhau
+    có cùng phiên bản, còn mọi lần huấn luyện lại cho ra phiên bản mới.
+
+    Args:
+        model: object - Mô hình đã huấn luyện
+        vectorizer: object - Vectorizer đã huấn luyện
 
-    # Lấy các từ khóa và trọng số
+    Returns:
+        str - Chuỗi phiên bản dạng hex
+    """
+    feature_log_prob = model.feature_log_prob_
+    cached = _MODEL_VERSION_CACHE.get(model)
+    if cached is not None and cached[0] is feature_log_prob and cached[1] is vectorizer:
+        return cached[2]
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update(np.ascontiguousarray(feature_log_prob).tobytes())
+    digest.update(np.ascontiguousarray(model.class_log_prior_).tobytes())
+    idf = getattr(vectorizer, 'idf_', None)
+    if idf is not None:
+        digest.update(np.ascontiguousarray(idf).tobytes())
+    digest.update(str(len(vectorizer.vocabulary_)).encode())
+    version = digest.hexdigest()
+    _MODEL_VERSION_CACHE[model] = (feature_log_prob, vectorizer, version)
+    return version
+
+def _get_feature_names(vectorizer):
+    """Lấy danh sách đặc trưng của vectorizer, chỉ dựng một lần cho mỗi vectorizer."""
+    feature_names = _FEATURE_NAMES_CACHE.get(vectorizer)
+    if feature_names is None or len(feature_names) != len(vectorizer.vocabulary_):
+        feature_names = vectorizer.get_feature_names_out()
+        _FEATURE_NAMES_CACHE[vectorizer] = feature_names
+    return feature_names
+
+def _analyze_keywords(model, feature_names, text_vec, prediction, top_k=20):
+    """Phân tích các từ khóa quan trọng của một email đã vector hóa.
+
+    Chỉ duyệt các chỉ số khác 0 của hàng thưa và chọn top-k bằng phân hoạch
+    một phần thay vì sắp xếp toàn bộ từ vựng.
+    """
     try:
-        # Lấy log probabilities từ mô hình
+        indices = np.unique(text_vec.indices[text_vec.data > 0])
+        if indices.size == 0:
+            return []
+
+        # Tỷ lệ log-likelihood giữa lớp dự đoán và lớp còn lại
+        log_ratio = _get_log_ratio(model)
+        is_spam = prediction == 'spam'
+        impacts = log_ratio[indices] if is_spam else -log_ratio[indices]
+        magnitudes = np.abs(impacts)
+
+        # Giữ mọi ứng viên bằng ngưỡng top-k để thứ tự khi bằng nhau vẫn theo chỉ số từ vựng
+        if indices.size > top_k:
+            threshold = np.partition(magnitudes, indices.size - top_k)[indices.size - top_k]
+            candidates = np.flatnonzero(magnitudes >= threshold)
+        else:
+            candidates = np.arange(indices.size)
+        order = candidates[np.lexsort((indices[candidates], -magnitudes[candidates]))][:top_k]
+
+        # Lấy log probabilities của lớp dự đoán
+        coef_index = list(model.classes_).index(prediction)
         feature_weights = model.feature_log_prob_[coef_index]
-        present_features = text_vec.toarray()[0] > 0
+        label_text = "spam" if is_spam else "email thường"
 
-        # Tạo danh sách từ khóa với trọng số và giải thích
         keywords = []
-        for i, present in enumerate(present_features):
-            if present:
-                word = feature_names[i]
-                weight = float(feature_weights[i])
-                # Tính toán tỷ lệ log-likelihood giữa spam và ham
-                other_weight = float(model.feature_log_prob_[0 if coef_index == 1 else 1][i])
-                impact = weight - other_weight
-
-                # Thêm giải thích
-                explanation = "Từ này thường xuất hiện trong " if impact > 0 else "Từ này ít khi xuất hiện trong "
-                explanation += "spam" if prediction == "spam" else "email thường"
-
-                keywords.append({
-                    'word': word,
-                    'weight': weight,
-                    'impact': impact,
-                    'explanation': explanation
-                })
-
-        # Sắp xếp theo mức độ ảnh hưởng
-        keywords.sort(key=lambda x: abs(x['impact']), reverse=True)
-        top_keywords = keywords[:20]  # Giới hạn số lượng từ khóa trả về
+        for j in order:
+            i = indices[j]
+            impact = float(impacts[j])
+            # Thêm giải thích
+            explanation = "Từ này thường xuất hiện trong " if impact > 0 else "Từ này ít khi xuất hiện trong "
+            keywords.append({
+                'word': str(feature_names[i]),
+                'weight': float(feature_weights[i]),
+                'impact': impact,
+                'explanation': explanation + label_text
+            })
+        return keywords
     except Exception as e:
         logger.error(f"Lỗi khi phân tích từ khóa: {e}")
-        top_keywords = []
+        return []
 
-    # Phân tích độ dài và cấu trúc email
-    email_stats = {
+def _email_stats(email_text, combined_text):
+    """Phân tích độ dài và cấu trúc email."""
+    return {
         'total_length': len(email_text),
         'word_count': len(email_text.split()),
         'uppercase_ratio': sum(1 for c in email_text if c.isupper()) / max(len(email_text), 1),
@@ -543,9 +1269,88 @@ def classify_email(model, vectorizer, email_text, email_subject=None):
         'special_char_count': sum(1 for c in email_text if c in '!@#$%^&*')
     }
 
+def classify_emails(model, vectorizer, texts, subjects=None, explain=True):
+    """Phân loại nhiều email cùng lúc.
+
+    Toàn bộ danh sách được vector hóa thành một ma trận thưa và chấm điểm
+    bằng một lần gọi predict_proba, thay vì gọi transform/predict cho từng email.
+
+    Args:
+        model: object - Mô hình đã huấn luyện
+        vectorizer: object - Vectorizer đã huấn luyện
+        texts: list - Danh sách nội dung email
+        subjects: list - Danh sách tiêu đề tương ứng (tùy chọn)
+        explain: bool - Có phân tích từ khóa hay không (False cho các màn hình danh sách)
+
+    Returns:
+        list - Danh sách kết quả, mỗi phần tử giống kết quả của classify_email
+               (không có khóa 'top_keywords' khi explain=False)
+    """
+    if not texts:
+        return []
+    if subjects is None:
+        subjects = [None] * len(texts)
+    elif len(subjects) != len(texts):
+        raise ValueError("Số lượng tiêu đề và nội dung email không khớp")
+
+    combined_texts = [_combine_text(text, subject) for text, subject in zip(texts, subjects)]
+
+    # Chuyển đổi toàn bộ văn bản sang ma trận đặc trưng
+    text_vecs = vectorizer.transform(combined_texts)
+
+    # Dự đoán xác suất một lần cho cả lô; nhãn dự đoán là lớp có xác suất cao nhất
+    probabilities = model.predict_proba(text_vecs)
+    best = probabilities.argmax(axis=1)
+    feature_names = _get_feature_names(vectorizer) if explain else None
+
+    results = []
+    for i, email_text in enumerate(texts):
+        prediction = model.classes_[best[i]]
+        confidence = probabilities[i, best[i]] * 100
+        result = {
+            'classification': prediction,
+            'confidence': round(float(confidence), 2),
+            'email_stats': _email_stats(email_text, combined_texts[i])
+        }
+        if explain:
+            result['top_keywords'] = _analyze_keywords(model, feature_names, text_vecs[i], prediction)
+        results.append(result)
+    return results
+
+def classify_email(model, vectorizer, email_text, email_subject=None, explain=True):
+    """Phân loại email với độ tin cậy và thông tin chi tiết.
+
+    Args:
+        model: object - Mô hình đã huấn luyện
+        vectorizer: object - Vectorizer đã huấn luyện
+        email_text: str - Nội dung email cần phân loại
+        email_subject: str - Tiêu đề email (tùy chọn)
+        explain: bool - Có phân tích từ khóa hay không
+
+    Returns:
+        dict - Kết quả phân loại với các thông tin chi tiết
+    """
+    return classify_emails(model, vectorizer, [email_text], [email_subject], explain=explain)[0]
+
+def explain_email(model, vectorizer, email_text, email_subject=None, top_k=20):
+    """Giải thích kết quả phân loại bằng các từ khóa có ảnh hưởng lớn nhất.
+
+    Args:
+        model: object - Mô hình đã huấn luyện
+        vectorizer: object - Vectorizer đã huấn luyện
+        email_text: str - Nội dung email
+        email_subject: str - Tiêu đề email (tùy chọn)
+        top_k: int - Số từ khóa tối đa trả về
+
+    Returns:
+        dict - Nhãn dự đoán, độ tin cậy và danh sách từ khóa
+    """
+    text_vec = vectorizer.transform([_combine_text(email_text, email_subject)])
+    probabilities = model.predict_proba(text_vec)[0]
+    best = probabilities.argmax()
+    prediction = model.classes_[best]
     return {
         'classification': prediction,
-        'confidence': round(confidence, 2),
-        'top_keywords': top_keywords,
-        'email_stats': email_stats
-    }
\ No newline at end of file
+        'confidence': round(float(probabilities[best]) * 100, 2),
+        'top_keywords': _analyze_keywords(model, _get_feature_names(vectorizer), text_vec, prediction, top_k)
+    }
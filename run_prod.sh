@@ -58,14 +58,15 @@ echo "======================================================"
 echo "  ✅ Application is running in PRODUCTION mode!"
 echo "  🌐 URL: http://localhost:5001"
 echo "  📁 Serving: vite-frontend/dist/"
+echo "  👷 Workers: ${PROD_WORKERS:-$(python3 -c 'import os; print(os.cpu_count())')}"
 echo "  📝 Backend logs: backend.log"
 echo ""
 echo "  Press Ctrl+C to stop"
 echo "======================================================"
 echo ""
 
-# Chạy Flask và lưu log
-python3 app.py 2>&1 | tee backend.log
+# Chạy server production nhiều tiến trình (số worker: PROD_WORKERS, mặc định = số CPU) và lưu log
+python3 serve_prod.py 2>&1 | tee backend.log
 
 # Cleanup
 echo ""
@@ -0,0 +1,250 @@
+# Điểm khởi động production: nạp và warm-up mô hình ở tiến trình master rồi fork các worker
+#
+# Master nạp mô hình một lần, "đóng băng" các object đã nạp khỏi bộ thu gom
+# rác (gc.freeze) rồi mới fork, nên các worker dùng chung trang nhớ của mô hình
+# theo cơ chế copy-on-write thay vì mỗi worker giữ một bản sao riêng. Tất cả
+# worker cùng accept trên một socket do master mở.
+#
+# Master định kỳ kiểm tra file mô hình; khi một worker huấn luyện lại hoặc học
+# từ phản hồi làm phiên bản mô hình thay đổi, master nạp lại mô hình rồi thay
+# lần lượt từng worker (worker cũ xử lý xong request đang chạy rồi mới thoát).
+# Ở chế độ LEARNING_MODE='incremental' mỗi lần đánh dấu spam đều ghi lại file
+# pipeline, nên hai lần thay worker cách nhau ít nhất MODEL_GENERATION_MIN_INTERVAL
+# giây và mọi thay đổi trong khoảng đó được gộp lại. Trong lúc chờ, worker vừa học
+# phản hồi phục vụ mô hình mới còn các worker khác vẫn phục vụ mô hình cũ.
+#
+# Cách dùng:
+#     python serve_prod.py                  # số worker mặc định = số CPU
+#     PROD_WORKERS=4 python serve_prod.py
+# Tín hiệu: SIGTERM/SIGINT dừng toàn bộ, SIGHUP nạp lại mô hình và thay worker ngay.
+# Với AUTO_TRIAGE_ENABLED=1, một trong các worker chạy luồng tự động phân loại (auto_triage.py).
+import os
+import gc
+import sys
+import time
+import signal
+import socket
+import threading
+from config import (
+    PROD_HOST, PROD_PORT, PROD_WORKERS, MODEL_RELOAD_INTERVAL, MODEL_GENERATION_MIN_INTERVAL,
+    WORKER_MEMORY_REPORT_INTERVAL, WORKER_SHUTDOWN_TIMEOUT, PIPELINE_PATH, COMPACT_MODEL_PATH, MODEL_FORMAT
+)
+from utils import logger, process_memory_mb
+
+def _model_stamp():
+    """Dấu thời gian sửa đổi của file mô hình đang dùng để phục vụ."""
+    path = COMPACT_MODEL_PATH if MODEL_FORMAT == 'compact' else PIPELINE_PATH
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def _run_worker(flask_app, listen_socket):
+    """Vòng đời của một worker: phục vụ trên socket chung cho tới khi nhận SIGTERM."""
+    from werkzeug.serving import make_server
+
+    server = make_server(PROD_HOST, PROD_PORT, flask_app, threaded=True, fd=listen_socket.fileno())
+    # Chờ các request đang xử lý khi dừng thay vì cắt ngang
+    server.daemon_threads = False
+    server.block_on_close = True
+
+    def stop(signum, frame):
+        # shutdown() chờ serve_forever thoát nên phải gọi từ luồng khác
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    # Luồng tự động phân loại được tạo sau khi fork; chỉ một worker giữ khóa và chạy các chu kỳ
+    from app import AUTO_TRIAGE, TRAINING_JOBS
+    AUTO_TRIAGE.start()
+
+    server.serve_forever()
+    server.server_close()
+    AUTO_TRIAGE.stop(timeout=WORKER_SHUTDOWN_TIMEOUT)
+
+    # Không bỏ dở job huấn luyện đang chạy trong worker này
+    job = TRAINING_JOBS.current()
+    if job is not None and job.active and getattr(job, 'pid', None) == os.getpid():
+        logger.info(f"Worker {os.getpid()} chờ job huấn luyện {job.id} hoàn tất trước khi thoát")
+        while job.active:
+            time.sleep(1)
+
+class PreforkServer:
+    """Master quản lý các worker được fork sau khi mô hình đã được nạp."""
+
+    def __init__(self, workers=PROD_WORKERS):
+        self.workers = max(1, workers)
+        self.generation = 0
+        self._children = {}  # pid -> thế hệ (mỗi lần nạp lại mô hình là một thế hệ mới)
+        self._retiring = set()  # Worker đã nhận SIGTERM, đang xử lý nốt request
+        self._stopping = False
+        self._reload_requested = False
+        self.socket = None
+
+    def _spawn(self):
+        import app as app_module
+
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                _run_worker(app_module.app, self.socket)
+            except Exception as e:
+                logger.error(f"Worker {os.getpid()} dừng do lỗi: {str(e)}")
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        self._children[pid] = self.generation
+        return pid
+
+    def _stop_workers(self, pids):
+        for pid in pids:
+            self._retiring.add(pid)
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                self._children.pop(pid, None)
+                self._retiring.discard(pid)
+
+    def _reap(self):
+        while self._children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self._children.clear()
+                return
+            if pid == 0:
+                return
+            generation = self._children.pop(pid, None)
+            self._retiring.discard(pid)
+            if generation == self.generation and not self._stopping:
+                logger.warning(f"Worker {pid} thoát bất thường (mã {status}), khởi động worker mới")
+                self._spawn()
+
+    def _freeze_shared_state(self):
+        # Object đã nạp được chuyển vào thế hệ "vĩnh viễn" để GC của worker
+        # không ghi lên header của chúng (làm mất chia sẻ trang nhớ)
+        gc.collect()
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+
+    def _reload(self):
+        """Nạp lại mô hình ở master rồi thay lần lượt từng worker."""
+        import app as app_module
+
+        old_version = app_module.MODEL_REGISTRY.version
+        try:
+            snapshot = app_module.reload_serving_model()
+        except Exception as e:
+            logger.error(f"Không thể nạp lại mô hình, giữ nguyên các worker: {str(e)}")
+            return
+        if snapshot.version == old_version and not self._reload_requested:
+            return
+
+        logger.info(f"Mô hình đổi sang phiên bản {snapshot.version}, thay thế {self.workers} worker")
+        self._freeze_shared_state()
+        self.generation += 1
+        old_workers = [
+            pid for pid, generation in self._children.items()
+            if generation < self.generation and pid not in self._retiring
+        ]
+        for pid in old_workers:
+            self._spawn()
+            self._stop_workers([pid])
+
+    def report_memory(self):
+        """Ghi log bộ nhớ của master và từng worker."""
+        total_pss = 0.0
+        for label, pid in [('master', os.getpid())] + [('worker', pid) for pid in sorted(self._children)]:
+            memory = process_memory_mb(pid)
+            if memory is None:
+                continue
+            total_pss += memory['pss']
+            logger.info(
+                f"Bộ nhớ {label} {pid}: RSS {memory['rss']}MB, PSS {memory['pss']}MB, "
+                f"dùng chung {memory['shared']}MB, riêng {memory['private']}MB"
+            )
+        logger.info(f"Tổng PSS của master và {len(self._children)} worker: {round(total_pss, 1)}MB")
+
+    def run(self):
+        import app as app_module
+
+        readiness = app_module.warm_up_model()
+        if not readiness['ready']:
+            logger.error(f"Không thể khởi động: mô hình chưa sẵn sàng ({readiness['error']})")
+            return 1
+
+        self.socket = socket.create_server((PROD_HOST, PROD_PORT), backlog=128, reuse_port=False)
+        self.socket.set_inheritable(True)
+        self._freeze_shared_state()
+
+        def handle_stop(signum, frame):
+            self._stopping = True
+
+        def handle_reload(signum, frame):
+            self._reload_requested = True
+
+        signal.signal(signal.SIGTERM, handle_stop)
+        signal.signal(signal.SIGINT, handle_stop)
+        signal.signal(signal.SIGHUP, handle_reload)
+
+        for _ in range(self.workers):
+            self._spawn()
+        logger.info(f"Server production chạy tại http://{PROD_HOST}:{PROD_PORT} với {self.workers} worker")
+
+        model_stamp = _model_stamp()
+        last_generation = time.monotonic()
+        reload_pending = False
+        next_reload_check = time.monotonic() + MODEL_RELOAD_INTERVAL
+        next_memory_report = time.monotonic() + min(10, WORKER_MEMORY_REPORT_INTERVAL)
+        while not self._stopping:
+            time.sleep(0.5)
+            self._reap()
+            now = time.monotonic()
+            if self._reload_requested or now >= next_reload_check:
+                stamp = _model_stamp()
+                # Chỉ thay worker khi đã đủ khoảng cách từ thế hệ trước; SIGHUP thay ngay
+                due = now - last_generation >= MODEL_GENERATION_MIN_INTERVAL
+                if self._reload_requested or (stamp != model_stamp and due):
+                    model_stamp = stamp
+                    self._reload()
+                    self._reload_requested = False
+                    last_generation = now
+                    reload_pending = False
+                elif stamp != model_stamp and not reload_pending:
+                    reload_pending = True
+                    logger.info(
+                        f"Mô hình đã đổi, hoãn thay worker tới "
+                        f"{round(MODEL_GENERATION_MIN_INTERVAL - (now - last_generation))}s nữa"
+                    )
+                next_reload_check = now + MODEL_RELOAD_INTERVAL
+            if now >= next_memory_report:
+                self.report_memory()
+                next_memory_report = now + WORKER_MEMORY_REPORT_INTERVAL
+
+        logger.info("Đang dừng các worker...")
+        self._stop_workers(list(self._children))
+        deadline = time.monotonic() + WORKER_SHUTDOWN_TIMEOUT
+        while self._children and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.2)
+        for pid in list(self._children):
+            logger.warning(f"Worker {pid} không dừng kịp, buộc dừng")
+            os.kill(pid, signal.SIGKILL)
+        self.socket.close()
+        return 0
+
+def main():
+    if not hasattr(os, 'fork'):
+        # Windows không hỗ trợ fork: chạy một tiến trình nhiều luồng
+        import app as app_module
+        logger.warning("Hệ điều hành không hỗ trợ fork, chạy server một tiến trình")
+        app_module.warm_up_model()
+        app_module.app.run(host=PROD_HOST, port=PROD_PORT, threaded=True)
+        return 0
+    return PreforkServer().run()
+
+if __name__ == '__main__':
+    sys.exit(main())
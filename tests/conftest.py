@@ -0,0 +1,8 @@
+# Cho phép import các module ở thư mục gốc của dự án khi chạy pytest
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+os.environ.setdefault('NLTK_OFFLINE', '1')
@@ -0,0 +1,180 @@
+# Gmail service giả cho kiểm thử: hộp thư trong bộ nhớ, mỗi thay đổi ghi một bản ghi history
+import base64
+
+
+class FakeHttpError(Exception):
+    """Lỗi HTTP giống googleapiclient.errors.HttpError (có resp.status)."""
+
+    def __init__(self, status):
+        super().__init__(f'HTTP {status}')
+        self.resp = type('Response', (), {'status': status})()
+
+
+class FakeRequest:
+    def __init__(self, fn):
+        self._fn = fn
+
+    def execute(self):
+        return self._fn()
+
+
+class FakeBatch:
+    def __init__(self, gmail, callback):
+        self._gmail = gmail
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request, request_id):
+        self._requests.append((request_id, request))
+
+    def execute(self):
+        if self._gmail.failing_batches > 0:
+            # Giả lập lỗi của cả batch (ví dụ lỗi mạng) trước khi yêu cầu nào được thực hiện
+            self._gmail.failing_batches -= 1
+            raise FakeHttpError(503)
+        for request_id, request in self._requests:
+            try:
+                self._callback(request_id, request.execute(), None)
+            except Exception as e:
+                self._callback(request_id, None, e)
+
+
+class FakeGmail:
+    """Hộp thư Gmail giả với luồng history được ghi theo kịch bản.
+
+    Các hàm add/delete/relabel vừa sửa hộp thư vừa ghi bản ghi history như
+    Gmail; expire_history() làm mọi historyId cũ trả về 404. Đặt failing_batches
+    để các batch request tiếp theo thất bại toàn bộ.
+    """
+
+    def __init__(self, email='me@example.com'):
+        self.email = email
+        self.mailbox = {}  # ID -> email (không đặt tên messages vì trùng với messages())
+        self.history_records = []
+        self.history_id = 100
+        self.min_history_id = 0
+        self._clock = 1000
+        self.failing_batches = 0  # Số batch tiếp theo sẽ thất bại toàn bộ
+        self.calls = {'list': 0, 'get': 0, 'history': 0, 'profile': 0, 'batch': 0}
+
+    # ---- Kịch bản ------------------------------------------------------
+
+    def _record(self, **changes):
+        self.history_id += 1
+        changes['id'] = str(self.history_id)
+        self.history_records.append(changes)
+
+    def add(self, message_id, text, label_ids, subject=None):
+        self._clock += 1
+        self.mailbox[message_id] = {
+            'id': message_id, 'threadId': message_id, 'labelIds': list(label_ids),
+            'internalDate': str(self._clock), 'snippet': text[:40],
+            'payload': {
+                'mimeType': 'text/plain',
+                'headers': [
+                    {'name': 'Subject', 'value': subject or f'Subject {message_id}'},
+                    {'name': 'From', 'value': 'sender@example.com'}
+                ],
+                'body': {'data': base64.urlsafe_b64encode(text.encode('utf-8')).decode('ascii')}
+            }
+        }
+        self._record(messagesAdded=[{'message': {'id': message_id, 'labelIds': list(label_ids)}}])
+
+    def delete(self, message_id):
+        message = self.mailbox.pop(message_id)
+        self._record(messagesDeleted=[{'message': {'id': message_id, 'labelIds': message['labelIds']}}])
+
+    def relabel(self, message_id, add=(), remove=()):
+        message = self.mailbox[message_id]
+        message['labelIds'] = [l for l in message['labelIds'] if l not in remove]
+        message['labelIds'] += [l for l in add if l not in message['labelIds']]
+        snapshot = {'id': message_id, 'labelIds': list(message['labelIds'])}
+        changes = {}
+        if add:
+            changes['labelsAdded'] = [{'message': snapshot, 'labelIds': list(add)}]
+        if remove:
+            changes['labelsRemoved'] = [{'message': snapshot, 'labelIds': list(remove)}]
+        self._record(**changes)
+
+    def expire_history(self):
+        self.min_history_id = self.history_id + 1
+
+    # ---- Gmail API -----------------------------------------------------
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def labels(self):
+        return _FakeLabels(self)
+
+    def history(self):
+        return _FakeHistory(self)
+
+    def new_batch_http_request(self, callback):
+        self.calls['batch'] += 1
+        return FakeBatch(self, callback)
+
+    def getProfile(self, userId):
+        def run():
+            self.calls['profile'] += 1
+            return {'emailAddress': self.email, 'historyId': str(self.history_id)}
+        return FakeRequest(run)
+
+    def list(self, userId, labelIds=None, q=None, maxResults=100, pageToken=None):
+        def run():
+            self.calls['list'] += 1
+            matching = sorted(
+                (m for m in self.mailbox.values() if all(l in m['labelIds'] for l in labelIds or [])),
+                key=lambda m: int(m['internalDate']), reverse=True
+            )
+            offset = int(pageToken or 0)
+            response = {'messages': [{'id': m['id']} for m in matching[offset:offset + maxResults]]}
+            if offset + maxResults < len(matching):
+                response['nextPageToken'] = str(offset + maxResults)
+            return response
+        return FakeRequest(run)
+
+    def get(self, userId, id, **kwargs):
+        def run():
+            self.calls['get'] += 1
+            if id not in self.mailbox:
+                raise FakeHttpError(404)
+            return dict(self.mailbox[id])
+        return FakeRequest(run)
+
+
+class _FakeLabels:
+    def __init__(self, gmail):
+        self._gmail = gmail
+
+    def list(self, userId):
+        names = ['INBOX', 'SPAM', 'TRASH', 'UNREAD']
+        return FakeRequest(lambda: {'labels': [{'id': name, 'name': name, 'type': 'system'} for name in names]})
+
+    def get(self, userId, id):
+        total = sum(id in m['labelIds'] for m in self._gmail.mailbox.values())
+        return FakeRequest(lambda: {'id': id, 'messagesTotal': total})
+
+
+class _FakeHistory:
+    def __init__(self, gmail):
+        self._gmail = gmail
+
+    def list(self, userId, startHistoryId, historyTypes=None, pageToken=None, labelId=None):
+        def run():
+            gmail = self._gmail
+            gmail.calls['history'] += 1
+            start = int(startHistoryId)
+            if start < gmail.min_history_id:
+                raise FakeHttpError(404)
+            records = [r for r in gmail.history_records if int(r['id']) > start]
+            # Trả về từng trang 2 bản ghi để kiểm tra phân trang
+            offset = int(pageToken or 0)
+            response = {'history': records[offset:offset + 2], 'historyId': str(gmail.history_id)}
+            if offset + 2 < len(records):
+                response['nextPageToken'] = str(offset + 2)
+            return response
+        return FakeRequest(run)
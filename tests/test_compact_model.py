@@ -0,0 +1,40 @@
+# Kiểm tra mô hình gọn cho cùng dự đoán với pipeline gốc trên toàn bộ tập dữ liệu
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from compact_model import PROBABILITY_TOLERANCE, export_compact_model, load_compact_model, verify_compact_model
+from config import DATA_FILE, PIPELINE_PATH
+from naive_bayes import load_pipeline, preprocess_corpus
+
+
+@pytest.fixture(scope='module')
+def pipeline():
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')  # Pipeline có thể được lưu bằng phiên bản sklearn khác
+        return load_pipeline(PIPELINE_PATH)
+
+
+@pytest.fixture(scope='module')
+def texts():
+    return preprocess_corpus(pd.read_csv(DATA_FILE)['text'].dropna().tolist())
+
+
+@pytest.mark.parametrize('dtype', ['float32', 'float64'])
+def test_compact_model_matches_pipeline(tmp_path, pipeline, texts, dtype):
+    model, vectorizer = pipeline
+    path = export_compact_model(model, vectorizer, path=str(tmp_path / 'model.nbc'), dtype=dtype)
+    compact_model, compact_vectorizer = load_compact_model(path)
+
+    X = vectorizer.transform(texts)
+    X_compact = compact_vectorizer.transform(texts)
+    np.testing.assert_array_equal(compact_model.predict(X_compact), model.predict(X))
+    np.testing.assert_allclose(
+        compact_model.predict_proba(X_compact), model.predict_proba(X),
+        rtol=0, atol=PROBABILITY_TOLERANCE[dtype]
+    )
+
+    report = verify_compact_model(model, vectorizer, compact_model, compact_vectorizer, texts)
+    assert report['passed'], report
@@ -0,0 +1,45 @@
+# Kiểm tra lấy email bằng Gmail batch request với service giả
+from config import GMAIL_BATCH_SIZE
+from fake_gmail import FakeGmail
+from gmail_oauth import fetch_messages
+
+
+def make_gmail(count):
+    gmail = FakeGmail()
+    for i in range(count):
+        gmail.add(f'm{i}', f'Email số {i}', ['INBOX'])
+    return gmail
+
+
+def test_chunks_requests_into_batches():
+    gmail = make_gmail(GMAIL_BATCH_SIZE * 2 + 5)
+    ids = list(gmail.mailbox)
+
+    fetched = fetch_messages(gmail, ids + ids[:3])  # ID trùng chỉ được lấy một lần
+
+    assert set(fetched) == set(ids)
+    assert gmail.calls['batch'] == 3
+    assert gmail.calls['get'] == len(ids)
+
+
+def test_missing_message_is_skipped():
+    gmail = make_gmail(5)
+
+    fetched = fetch_messages(gmail, ['m0', 'missing', 'm1', 'm2'])
+
+    assert set(fetched) == {'m0', 'm1', 'm2'}
+    assert fetched['m1']['id'] == 'm1'
+    assert gmail.calls['batch'] == 1
+
+
+def test_failed_batch_falls_back_to_single_requests():
+    gmail = make_gmail(GMAIL_BATCH_SIZE + 10)
+    ids = list(gmail.mailbox)
+    gmail.failing_batches = 1
+
+    fetched = fetch_messages(gmail, ids + ['missing'])
+
+    assert set(fetched) == set(ids)
+    assert gmail.calls['batch'] == 2
+    # Batch đầu thất bại nên 100 email của nó được lấy lại từng cái, batch sau chạy bình thường
+    assert gmail.calls['get'] == len(ids) + 1
@@ -0,0 +1,15 @@
+# Các module chính không được import thư viện nặng ở cấp module (xem import_budget.py)
+import os
+
+import pytest
+
+from import_budget import IMPORT_BUDGET_MS, heavy_imports, measure_import
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.mark.parametrize('module', sorted(IMPORT_BUDGET_MS))
+def test_module_does_not_import_heavy_libraries(module):
+    timings = measure_import(module, ROOT)
+    assert module in timings
+    assert heavy_imports(timings) == []
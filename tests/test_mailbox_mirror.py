@@ -0,0 +1,134 @@
+# Kiểm tra đồng bộ bản sao hộp thư với luồng Gmail history giả
+import pytest
+
+from fake_gmail import FakeGmail
+from mailbox_mirror import MailboxMirror, collect_history_changes, parse_search_query
+
+ACCOUNT = 'me@example.com'
+
+
+@pytest.fixture
+def gmail():
+    gmail = FakeGmail(ACCOUNT)
+    gmail.add('m1', 'Hẹn gặp cuộc họp dự án', ['INBOX'])
+    gmail.add('m2', 'Trúng thưởng miễn phí', ['SPAM'])
+    return gmail
+
+
+@pytest.fixture
+def mirror(tmp_path, gmail):
+    mirror = MailboxMirror(db_path=str(tmp_path / 'mirror.db'))
+    assert mirror.sync(gmail) == ACCOUNT
+    return mirror
+
+
+def label_ids(mirror, label_id):
+    messages, _ = mirror.list_messages(None, ACCOUNT, label_id, 100)
+    return [message['id'] for message in messages]
+
+
+def search_ids(mirror, label_id, query):
+    messages, _ = mirror.search(ACCOUNT, label_id, parse_search_query(query), 100)
+    return [message['id'] for message in messages]
+
+
+def history_id(mirror):
+    return mirror._db().execute(
+        'SELECT history_id FROM mirror_accounts WHERE account = ?', (ACCOUNT,)
+    ).fetchone()[0]
+
+
+def test_collect_history_changes_add_then_delete():
+    records = [
+        {'id': '1', 'messagesAdded': [{'message': {'id': 'a', 'labelIds': ['INBOX']}}]},
+        {'id': '2', 'labelsAdded': [{'message': {'id': 'a', 'labelIds': ['INBOX', 'UNREAD']}, 'labelIds': ['UNREAD']}]},
+        {'id': '3', 'messagesDeleted': [{'message': {'id': 'a'}}]},
+        {'id': '4', 'labelsRemoved': [{'message': {'id': 'a', 'labelIds': []}, 'labelIds': ['INBOX']}]},
+    ]
+    changes = collect_history_changes(records)
+    assert changes.deleted == {'a'}
+    assert not changes.added
+    assert changes.labels == {}
+
+
+def test_full_sync_loads_mirrored_labels(mirror):
+    assert label_ids(mirror, 'INBOX') == ['m1']
+    assert label_ids(mirror, 'SPAM') == ['m2']
+    assert search_ids(mirror, 'SPAM', 'trung thuong') == ['m2']
+
+
+def test_add_then_delete_leaves_no_row(mirror, gmail):
+    gmail.add('m3', 'Khuyến mãi đặc biệt', ['INBOX'])
+    gmail.delete('m3')
+    gmail.add('m4', 'Báo cáo tuần', ['INBOX'])
+
+    mirror.sync(gmail, force=True)
+
+    assert mirror.get_message(ACCOUNT, 'm3') is None
+    assert label_ids(mirror, 'INBOX') == ['m4', 'm1']
+    assert search_ids(mirror, 'INBOX', 'khuyen mai') == []
+    assert search_ids(mirror, 'INBOX', 'bao cao') == ['m4']
+    # m3 đã bị xóa trước khi đồng bộ nên không cần lấy chi tiết
+    assert gmail.calls['get'] == 3
+
+
+def test_label_moves_between_and_out_of_mirrored_labels(mirror, gmail):
+    gmail.relabel('m1', add=['SPAM'], remove=['INBOX'])
+    gmail.relabel('m2', add=['TRASH'], remove=['SPAM'])
+    mirror.sync(gmail, force=True)
+
+    assert label_ids(mirror, 'INBOX') == []
+    assert label_ids(mirror, 'SPAM') == ['m1']
+    assert mirror.get_message(ACCOUNT, 'm1')['label_ids'] == ['SPAM']
+    assert search_ids(mirror, 'SPAM', 'cuoc hop') == ['m1']
+    # Email rời khỏi mọi nhãn được sao chép bị xóa khỏi bản sao và chỉ mục
+    assert mirror.get_message(ACCOUNT, 'm2') is None
+    assert search_ids(mirror, 'SPAM', 'trung thuong') == []
+
+    # Chuyển lại vào INBOX
+    gmail.relabel('m1', add=['INBOX'], remove=['SPAM'])
+    mirror.sync(gmail, force=True)
+    assert label_ids(mirror, 'INBOX') == ['m1']
+    assert label_ids(mirror, 'SPAM') == []
+    assert search_ids(mirror, 'INBOX', 'du an') == ['m1']
+
+
+def test_message_moved_into_mirrored_label_is_fetched(mirror, gmail):
+    gmail.add('m5', 'Thư lưu trữ cũ', ['TRASH'])
+    mirror.sync(gmail, force=True)
+    assert mirror.get_message(ACCOUNT, 'm5') is None
+
+    gmail.relabel('m5', add=['INBOX'], remove=['TRASH'])
+    mirror.sync(gmail, force=True)
+    assert label_ids(mirror, 'INBOX') == ['m5', 'm1']
+    assert search_ids(mirror, 'INBOX', 'luu tru') == ['m5']
+
+
+def test_expired_history_triggers_full_resync(mirror, gmail):
+    gmail.delete('m1')
+    gmail.add('m6', 'Email mới sau khi hết hạn', ['INBOX'])
+    gmail.expire_history()
+    profile_calls = gmail.calls['profile']
+
+    mirror.sync(gmail, force=True)
+
+    assert gmail.calls['profile'] == profile_calls + 1  # Đồng bộ toàn bộ lấy historyId mới
+    assert history_id(mirror) == gmail.history_id
+    assert label_ids(mirror, 'INBOX') == ['m6']
+    assert mirror.get_message(ACCOUNT, 'm1') is None
+    assert search_ids(mirror, 'INBOX', 'het han') == ['m6']
+    assert search_ids(mirror, 'INBOX', 'cuoc hop') == []
+
+
+def test_history_id_only_moves_forward(mirror, gmail):
+    gmail.add('m7', 'Một email nữa', ['INBOX'])
+    mirror.sync(gmail, force=True)
+    latest = history_id(mirror)
+    assert latest == gmail.history_id
+
+    # Một tiến trình chậm áp dụng lại đoạn history cũ: không lùi historyId, kết quả không đổi
+    conn = mirror._db()
+    assert mirror._incremental_sync(conn, gmail, ACCOUNT, 100)
+    assert history_id(mirror) == latest
+    assert label_ids(mirror, 'INBOX') == ['m7', 'm1']
+    assert search_ids(mirror, 'INBOX', 'mot email') == ['m7']
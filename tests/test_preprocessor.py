@@ -0,0 +1,23 @@
+# Kiểm tra dấu vân tay của bộ tiền xử lý
+import os
+import subprocess
+import sys
+
+from conftest import ROOT
+
+FINGERPRINT_SCRIPT = 'from naive_bayes import PREPROCESSOR; print(PREPROCESSOR.fingerprint())'
+
+def _fingerprint_in_subprocess(hash_seed):
+    env = dict(os.environ, PYTHONHASHSEED=str(hash_seed), NLTK_OFFLINE='1')
+    result = subprocess.run(
+        [sys.executable, '-c', FINGERPRINT_SCRIPT], cwd=ROOT, env=env,
+        capture_output=True, text=True, check=True
+    )
+    return result.stdout.strip().splitlines()[-1]
+
+def test_fingerprint_stable_across_processes():
+    # Mỗi tiến trình có địa chỉ bộ nhớ và hash seed khác nhau
+    first = _fingerprint_in_subprocess(1)
+    second = _fingerprint_in_subprocess(2)
+    assert len(first) == 32
+    assert first == second
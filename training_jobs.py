@@ -0,0 +1,269 @@
+# Chạy các tác vụ huấn luyện mô hình ở luồng nền
+import os
+import re
+import json
+import uuid
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from naive_bayes import TrainingCancelled
+from utils import logger
+
+class TrainingJob:
+    """Trạng thái của một lần huấn luyện chạy nền."""
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:12]
+        self.status = 'queued'  # queued | running | succeeded | failed | cancelled
+        self.progress = 0.0
+        self.stage = 'queued'
+        self.error = None
+        self.result = None
+        self.created_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self.pid = os.getpid()
+        self.on_change = None
+
+    @property
+    def active(self):
+        return self.status in ('queued', 'running')
+
+    def set_progress(self, progress, stage):
+        """Cập nhật tiến độ (dùng làm progress_callback cho train_model)."""
+        self.progress = round(float(progress), 3)
+        self.stage = stage
+        if self.on_change is not None:
+            self.on_change(self)
+
+    def to_dict(self):
+        """Chuyển trạng thái job thành dict để trả về qua API."""
+        def fmt(value):
+            return value.strftime('%Y-%m-%d %H:%M:%S') if value else None
+
+        duration = None
+        if self.started_at:
+            duration = round(((self.finished_at or datetime.now()) - self.started_at).total_seconds(), 2)
+
+        return {
+            'id': self.id,
+            'status': self.status,
+            'progress': self.progress,
+            'stage': self.stage,
+            'error': self.error,
+            'result': self.result,
+            'created_at': fmt(self.created_at),
+            'started_at': fmt(self.started_at),
+            'finished_at': fmt(self.finished_at),
+            'duration_seconds': duration
+        }
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+class JobRecord:
+    """Trạng thái của job do tiến trình khác chạy, đọc từ thư mục trạng thái."""
+
+    def __init__(self, data):
+        self.id = data['id']
+        self.pid = data.get('pid')
+        self._data = data
+
+    @property
+    def active(self):
+        if self._data['status'] not in ('queued', 'running'):
+            return False
+        return self.pid is None or _process_alive(self.pid)
+
+    def to_dict(self):
+        data = {key: value for key, value in self._data.items() if key != 'pid'}
+        if data['status'] in ('queued', 'running') and not self.active:
+            # Tiến trình chạy job đã dừng giữa chừng
+            data['status'] = 'failed'
+            data['error'] = 'Tiến trình huấn luyện đã dừng trước khi hoàn tất'
+        return data
+
+class TrainingJobRunner:
+    """Hàng đợi huấn luyện chỉ cho phép một job chạy tại một thời điểm.
+
+    Gửi yêu cầu mới trong lúc đang có job chạy sẽ trả về job đó thay vì bắt
+    đầu lần huấn luyện thứ hai. Hàm huấn luyện nhận đối tượng TrainingJob để
+    báo tiến độ và kiểm tra yêu cầu hủy.
+
+    Khi có state_dir, trạng thái job được ghi ra thư mục dùng chung nên các
+    tiến trình worker (xem serve_prod.py) đều thấy cùng một job: chỉ một job
+    chạy trên toàn bộ các worker, trạng thái đọc được từ worker bất kỳ và
+    yêu cầu hủy được chuyển tới worker đang chạy job qua file đánh dấu.
+    """
+
+    _JOB_ID_PATTERN = re.compile(r'[0-9a-f]{12}')
+
+    def __init__(self, train_fn, max_history=20, state_dir=None):
+        self.train_fn = train_fn
+        self.max_history = max_history
+        self.state_dir = state_dir
+        self._jobs = {}
+        self._current = None
+        self._lock = threading.Lock()
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+
+    def _state_path(self, name, suffix='.json'):
+        return os.path.join(self.state_dir, f'{name}{suffix}')
+
+    @contextmanager
+    def _process_lock(self):
+        """Khóa liên tiến trình quanh thao tác kiểm tra-và-tạo job."""
+        if not self.state_dir:
+            yield
+            return
+        try:
+            import fcntl
+        except ImportError:  # Windows: chỉ có khóa trong tiến trình
+            yield
+            return
+        with open(self._state_path('.lock', ''), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _persist(self, job):
+        if not self.state_dir:
+            return
+        data = job.to_dict()
+        data['pid'] = job.pid
+        names = [job.id] + (['current'] if job is self._current else [])
+        try:
+            for name in names:
+                path = self._state_path(name)
+                tmp_path = f"{path}.tmp-{os.getpid()}"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Không thể lưu trạng thái job huấn luyện {job.id}: {e}")
+
+    def _load_record(self, name):
+        if not self.state_dir:
+            return None
+        try:
+            with open(self._state_path(name), 'r', encoding='utf-8') as f:
+                return JobRecord(json.load(f))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _on_change(self, job):
+        # Yêu cầu hủy từ worker khác được gửi qua file đánh dấu
+        if self.state_dir and not job.cancel_event.is_set() and os.path.exists(self._state_path(job.id, '.cancel')):
+            job.cancel_event.set()
+        self._persist(job)
+
+    def _prune_state_files(self):
+        files = [
+            os.path.join(self.state_dir, name) for name in os.listdir(self.state_dir)
+            if self._JOB_ID_PATTERN.fullmatch(name.split('.')[0])
+        ]
+        files.sort(key=os.path.getmtime)
+        for path in files[:max(0, len(files) - 2 * self.max_history)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def submit(self):
+        """Bắt đầu một job huấn luyện hoặc trả về job đang chạy.
+
+        Returns:
+            tuple - (TrainingJob, bool) - job và cờ cho biết job có phải mới tạo không
+        """
+        with self._lock, self._process_lock():
+            current = self.current()
+            if current is not None and current.active:
+                return current, False
+
+            job = TrainingJob()
+            job.on_change = self._on_change
+            self._jobs[job.id] = job
+            self._current = job
+            self._persist(job)
+            # Giữ lịch sử job có giới hạn
+            while len(self._jobs) > self.max_history:
+                oldest = next(iter(self._jobs))
+                if self._jobs[oldest].active:
+                    break
+                del self._jobs[oldest]
+            if self.state_dir:
+                self._prune_state_files()
+
+        thread = threading.Thread(target=self._run, args=(job,), name=f'training-{job.id}', daemon=True)
+        thread.start()
+        return job, True
+
+    def _run(self, job):
+        job.status = 'running'
+        job.started_at = datetime.now()
+        self._persist(job)
+        logger.info(f"Bắt đầu job huấn luyện {job.id}")
+        try:
+            job.result = self.train_fn(job)
+            job.status = 'succeeded'
+            job.set_progress(1.0, 'done')
+            logger.info(f"Job huấn luyện {job.id} hoàn tất")
+        except TrainingCancelled as e:
+            job.status = 'cancelled'
+            job.error = str(e)
+            logger.info(f"Job huấn luyện {job.id} đã bị hủy")
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e)
+            logger.error(f"Job huấn luyện {job.id} thất bại: {str(e)}")
+        finally:
+            job.finished_at = datetime.now()
+            self._persist(job)
+
+    def get(self, job_id):
+        """Lấy job theo ID (kể cả job của worker khác), trả về None nếu không tồn tại."""
+        job = self._jobs.get(job_id)
+        if job is None and self.state_dir and self._JOB_ID_PATTERN.fullmatch(job_id or ''):
+            job = self._load_record(job_id)
+        return job
+
+    def current(self):
+        """Lấy job gần nhất (đang chạy hoặc đã xong)."""
+        if self.state_dir:
+            record = self._load_record('current')
+            if record is not None:
+                return self._jobs.get(record.id) or record
+        return self._current
+
+    def cancel(self, job_id):
+        """Yêu cầu hủy job.
+
+        Việc hủy có hiệu lực ở ranh giới bước tiếp theo của quá trình huấn
+        luyện (khi tìm tham số: sau nhóm ứng viên đang đánh giá, xem
+        SEARCH_CANCEL_CHUNK); mô hình đang phục vụ không bị ảnh hưởng.
+
+        Returns:
+            bool - True nếu job đang chạy và đã nhận yêu cầu hủy
+        """
+        job = self.get(job_id)
+        if job is None or not job.active:
+            return False
+        if isinstance(job, JobRecord):
+            # Job chạy ở worker khác: worker đó sẽ thấy file đánh dấu ở bước tiếp theo
+            with open(self._state_path(job.id, '.cancel'), 'w'):
+                pass
+            return True
+        job.cancel_event.set()
+        return True
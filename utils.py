@@ -1,6 +1,7 @@
 # Các hàm tiện ích chung cho ứng dụng
 from functools import wraps
 from flask import session, jsonify
+import os
 import traceback
 import logging
 
@@ -62,3 +63,36 @@ def get_service_safely():
         logger.error("Lỗi xác thực, không thể lấy Gmail service")
         return None
     return service
+
+def process_memory_mb(pid=None):
+    """
+    Đọc mức dùng bộ nhớ của một tiến trình (chỉ hỗ trợ Linux, qua /proc)
+
+    PSS chia đều các trang nhớ dùng chung cho các tiến trình cùng dùng, nên
+    tổng PSS của các worker là lượng bộ nhớ thực sự bị chiếm.
+
+    Args:
+        pid: int - ID tiến trình (mặc định là tiến trình hiện tại)
+
+    Returns:
+        dict|None - {'rss', 'pss', 'shared', 'private'} tính bằng MB hoặc None nếu không đọc được
+    """
+    fields = {}
+    try:
+        with open(f"/proc/{pid or os.getpid()}/smaps_rollup", 'r') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(':') and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1])
+    except OSError:
+        return None
+
+    def mb(*names):
+        return round(sum(fields.get(name, 0) for name in names) / 1024, 1)
+
+    return {
+        'rss': mb('Rss'),
+        'pss': mb('Pss'),
+        'shared': mb('Shared_Clean', 'Shared_Dirty'),
+        'private': mb('Private_Clean', 'Private_Dirty')
+    }
@@ -1,8 +1,8 @@
 import { useState, useEffect, useRef } from "react";
 import { useInfiniteQuery, useMutation, useQueryClient } from "@tanstack/react-query";
 import {
-  getEmails,
-  getSpamEmails,
+  streamEmails,
+  getEmailBody,
   markAsSpam,
   markAsNotSpam,
   markAsRead,
@@ -71,6 +71,8 @@ const EmailList = ({ type = "inbox" }) => {
   const [datasetLabel, setDatasetLabel] = useState("");
   const [isAddingToDataset, setIsAddingToDataset] = useState(false);
   const scrollContainerRef = useRef(null);
+  // Email của trang đang tải, hiển thị dần trong lúc server stream về
+  const [streamingEmails, setStreamingEmails] = useState([]);
 
   // Sử dụng React Query để fetch emails
   const {
@@ -84,11 +86,14 @@ const EmailList = ({ type = "inbox" }) => {
   } = useInfiniteQuery({
     queryKey: ["emails", type, searchQuery],
     queryFn: async ({ pageParam = null }) => {
-      const response =
-        type === "inbox"
-          ? await getEmails(20, searchQuery, pageParam)
-          : await getSpamEmails(20, searchQuery, pageParam);
-      return response.data;
+      setStreamingEmails([]);
+      try {
+        return await streamEmails(type, 20, searchQuery, pageParam, (email) =>
+          setStreamingEmails((current) => [...current, email])
+        );
+      } finally {
+        setStreamingEmails([]);
+      }
     },
     getNextPageParam: (lastPage) => lastPage.nextPageToken || undefined,
     keepPreviousData: true,
@@ -97,7 +102,12 @@ const EmailList = ({ type = "inbox" }) => {
   });
 
   // Trích xuất emails từ data.pages
-  const emails = data?.pages?.flatMap((page) => page.emails) || [];
+  const loadedEmails = data?.pages?.flatMap((page) => page.emails) || [];
+  const loadedIds = new Set(loadedEmails.map((email) => email.id));
+  const emails = [
+    ...loadedEmails,
+    ...streamingEmails.filter((email) => !loadedIds.has(email.id)),
+  ];
   const error = queryError ? `Lỗi khi tải email: ${queryError.message}` : "";
 
   // Debug logging
@@ -237,6 +247,18 @@ const EmailList = ({ type = "inbox" }) => {
     } catch (err) {
       console.error("Error marking email as read:", err);
     }
+
+    // Danh sách chỉ có tiêu đề + snippet: lấy nội dung đầy đủ và kết quả phân loại chính thức
+    if (email.provisional) {
+      try {
+        const response = await getEmailBody(email.id);
+        setSelectedEmail((current) =>
+          current && current.id === email.id ? { ...current, ...response.data } : current
+        );
+      } catch (err) {
+        console.error("Error loading email body:", err);
+      }
+    }
   };
 
   const closeModal = () => {
@@ -404,7 +426,7 @@ const EmailList = ({ type = "inbox" }) => {
         </div>
       )}
 
-      {isLoading && !data?.emails?.length ? (
+      {isLoading && !emails.length ? (
         <div className="flex flex-col items-center justify-center p-8 space-y-4">
           <div className="w-12 h-12 border-4 border-t-transparent border-primary rounded-full animate-spin"></div>
           <p className="text-text-secondary">Đang tải email...</p>
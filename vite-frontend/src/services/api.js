@@ -66,6 +66,60 @@ export const getSpamEmails = (maxResults = 20, searchQuery = '', pageToken = nul
   });
 };
 
+// Tải một trang email dạng stream (NDJSON): onEmail được gọi cho từng email
+// ngay khi server phân loại xong, Promise trả về { emails, nextPageToken }.
+// mode 'metadata' chỉ lấy tiêu đề + snippet (kết quả phân loại tạm thời),
+// nội dung đầy đủ được lấy bằng getEmailBody khi mở email.
+// filters: { classification: 'spam'|'ham', min_confidence, max_confidence }.
+export const streamEmails = async (type = 'inbox', maxResults = 20, searchQuery = '', pageToken = null, onEmail = () => {}, mode = 'metadata', filters = {}) => {
+  const params = new URLSearchParams({ max: maxResults, q: searchQuery, stream: '1', mode });
+  Object.entries(filters).forEach(([key, value]) => {
+    if (value !== null && value !== undefined && value !== '') params.set(key, value);
+  });
+  if (pageToken) params.set('pageToken', pageToken);
+  const path = type === 'inbox' ? '/emails' : '/spam_emails';
+  const response = await fetch(`${path}?${params}`, { credentials: 'include' });
+  if (!response.ok) {
+    const data = await response.json().catch(() => ({}));
+    throw new Error(data.error || `HTTP ${response.status}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  const emails = [];
+  let nextPageToken = null;
+  let buffer = '';
+
+  const handleLine = (line) => {
+    if (!line.trim()) return;
+    const record = JSON.parse(line);
+    if (record.type === 'email') {
+      emails.push(record.email);
+      onEmail(record.email);
+    } else if (record.type === 'end') {
+      nextPageToken = record.nextPageToken;
+    } else if (record.type === 'error') {
+      throw new Error(record.error);
+    }
+  };
+
+  for (;;) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const lines = buffer.split('\n');
+    buffer = lines.pop();
+    lines.forEach(handleLine);
+  }
+  handleLine(buffer + decoder.decode());
+
+  return { emails, nextPageToken };
+};
+
+export const getEmailBody = (emailId) => {
+  return api.get(`/emails/${encodeURIComponent(emailId)}`);
+};
+
 export const markAsSpam = (emailId) => {
   return api.post('/mark_spam', { email_id: emailId });
 };
@@ -74,6 +128,36 @@ export const markAsNotSpam = (emailId) => {
   return api.post('/mark_not_spam', { email_id: emailId });
 };
 
+// Thao tác hàng loạt: emails là danh sách ID hoặc { id, subject, content };
+// server trả về kết quả của từng ID trong results.
+const bulkPayload = (emails) =>
+  typeof emails[0] === 'string' ? { email_ids: emails } : { emails };
+
+export const bulkMarkAsSpam = (emails) => {
+  return api.post('/bulk/mark_spam', bulkPayload(emails));
+};
+
+export const bulkMarkAsNotSpam = (emails) => {
+  return api.post('/bulk/mark_not_spam', bulkPayload(emails));
+};
+
+export const bulkMarkAsRead = (emailIds) => {
+  return api.post('/bulk/mark_read', { email_ids: emailIds });
+};
+
+export const bulkDeleteEmails = (emailIds) => {
+  return api.post('/bulk/delete', { email_ids: emailIds });
+};
+
+// Tự động phân loại email mới ở luồng nền (server cần AUTO_TRIAGE_ENABLED=1)
+export const getAutoTriageStatus = () => {
+  return api.get('/auto_triage');
+};
+
+export const setAutoTriage = (enabled) => {
+  return api.post('/auto_triage', { enabled });
+};
+
 export const markAsRead = (emailId) => {
   return api.post('/mark_read', { email_id: emailId });
 };
@@ -98,8 +182,26 @@ export const getStats = () => {
 };
 
 // Model Training API
-export const retrainModel = () => {
-  return api.post('/retrain');
+// Huấn luyện chạy nền: bắt đầu job rồi hỏi trạng thái cho tới khi xong
+export const retrainModel = async (pollInterval = 2000) => {
+  const { data } = await api.post('/retrain');
+  let job = data.job;
+  while (job.status === 'queued' || job.status === 'running') {
+    await new Promise((resolve) => setTimeout(resolve, pollInterval));
+    job = (await api.get(`/retrain/${job.id}`)).data.job;
+  }
+  if (job.status !== 'succeeded') {
+    throw new Error(job.error || 'Huấn luyện lại mô hình thất bại');
+  }
+  return job;
+};
+
+export const getRetrainStatus = (jobId) => {
+  return api.get(`/retrain/${jobId}`);
+};
+
+export const cancelRetrain = (jobId) => {
+  return api.post(`/retrain/${jobId}/cancel`);
 };
 
 export const addToDataset = (subject, content, label) => {
@@ -18,6 +18,8 @@ export default defineConfig({
       '/mark_not_spam': 'http://localhost:5001',
       '/mark_read': 'http://localhost:5001',
       '/delete_email': 'http://localhost:5001',
+      '/bulk': 'http://localhost:5001',
+      '/auto_triage': 'http://localhost:5001',
       '/send_email': 'http://localhost:5001',
       
       // Analysis endpoints